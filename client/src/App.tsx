@@ -18,7 +18,7 @@ import Brands from './components/Brands';
 // 👇 1. IMPORT TRANG SETTINGS (NẾU CHƯA CÓ FILE NÀY HÃY TẠO NÓ)
 import Settings from './components/Settings'; 
 
-import { warehouseApi } from './services/api';
+import { warehouseApi, applyFeedEvent, FeedEvent } from './services/api';
 import { Product, Transaction, StocktakeSession } from './types';
 // 👇 2. ĐỔI TÊN ICON 'Settings' THÀNH 'SettingsIcon' ĐỂ TRÁNH TRÙNG TÊN VỚI TRANG SETTINGS
 import { Loader2, Menu, LogOut, User as UserIcon, ChevronDown, Settings as SettingsIcon, Users } from 'lucide-react';
@@ -43,6 +43,8 @@ function App() {
   const [transactions, setTransactions] = useState<Transaction[]>([]);
   const [stocktakes, setStocktakes] = useState<StocktakeSession[]>([]);
   const [loading, setLoading] = useState<boolean>(false);
+  // Hủy theo dõi change feed hiện tại
+  const unsubscribeFeed = useRef<(() => void) | null>(null);
 
   const [prefillTransaction, setPrefillTransaction] = useState<{ productId: string; quantity: number } | null>(null);
 
@@ -62,6 +64,8 @@ function App() {
     localStorage.removeItem('smartwms_token');
     localStorage.removeItem('smartwms_user');
     
+    unsubscribeFeed.current?.();
+    unsubscribeFeed.current = null;
     setIsAuthenticated(false);
     setCurrentUser(null);
     setProducts([]);
@@ -82,11 +86,19 @@ function App() {
 
   // --- LOGIC DATA ---
 
+  const applyChange = (event: FeedEvent) => {
+    if (event.topic === 'product') setProducts(prev => applyFeedEvent(prev, event));
+    else if (event.topic === 'transaction') setTransactions(prev => applyFeedEvent(prev, event));
+    else if (event.topic === 'stocktake') setStocktakes(prev => applyFeedEvent(prev, event));
+  };
+
+  // Tải danh sách 1 lần, sau đó chỉ nhận thay đổi qua change feed (không tải lại sau mỗi thao tác)
   const refreshData = async () => {
     if (!isAuthenticated) return;
 
     setLoading(true);
     try {
+      const token = await warehouseApi.getFeedToken();
       const [pData, tData, sData] = await Promise.all([
         warehouseApi.getProducts(),
         warehouseApi.getTransactions(),
@@ -95,6 +107,11 @@ function App() {
       setProducts(pData);
       setTransactions(tData);
       setStocktakes(sData);
+
+      unsubscribeFeed.current?.();
+      unsubscribeFeed.current = warehouseApi.subscribeFeed(
+        ['product', 'transaction', 'stocktake'], applyChange, refreshData, token
+      );
     } catch (error) {
       console.error("Lỗi kết nối Backend:", error);
       if ((error as any).response && (error as any).response.status === 401) {
@@ -109,33 +126,29 @@ function App() {
     if (isAuthenticated) {
       refreshData();
     }
+    return () => unsubscribeFeed.current?.();
   }, [isAuthenticated]);
 
   // --- HANDLERS ---
   
   const handleAddProduct = async (p: Product) => {
     await warehouseApi.addProduct(p);
-    refreshData();
   };
 
   const handleUpdateProduct = async (p: Product) => {
     await warehouseApi.updateProduct(p);
-    refreshData();
   };
 
   const handleDeleteProduct = async (id: string) => {
     await warehouseApi.deleteProduct(id);
-    refreshData();
   };
 
   const handleAddTransaction = async (t: Transaction) => {
     await warehouseApi.addTransaction(t);
-    refreshData();
   };
 
   const handleSaveStocktake = async (s: StocktakeSession) => {
     await warehouseApi.saveStocktake(s);
-    refreshData();
   };
 
   const handleRestockFromAI = (productName: string, quantity: number) => {
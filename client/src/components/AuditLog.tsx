@@ -1,5 +1,5 @@
 import React, { useEffect, useState } from 'react';
-import { warehouseApi } from '../services/api';
+import { warehouseApi, applyFeedEvent } from '../services/api';
 import { SystemLog } from '../types';
 import { Clock, User, FileText, ShieldAlert, Filter, Search, Loader2 } from 'lucide-react';
 
@@ -12,11 +12,18 @@ const AuditLog: React.FC = () => {
   const [filterAction, setFilterAction] = useState('ALL');
 
   useEffect(() => {
+    let unsubscribe: (() => void) | null = null;
     const fetchLogs = async () => {
       try {
+        const token = await warehouseApi.getFeedToken();
         const data = await warehouseApi.getSystemLogs();
         setLogs(data);
         setFilteredLogs(data);
+        // Nhật ký mới được đẩy qua change feed, không cần tải lại
+        unsubscribe?.();
+        unsubscribe = warehouseApi.subscribeFeed(
+          ['log'], (event) => setLogs(prev => applyFeedEvent(prev, event)), fetchLogs, token
+        );
       } catch (err) {
         setError("Bạn không có quyền xem nhật ký hoặc lỗi kết nối.");
       } finally {
@@ -24,6 +31,7 @@ const AuditLog: React.FC = () => {
       }
     };
     fetchLogs();
+    return () => unsubscribe?.();
   }, []);
 
   // Xử lý tìm kiếm và lọc
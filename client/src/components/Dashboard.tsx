@@ -1,6 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import { Product, Transaction, TransactionType  } from '../types';
-import { warehouseApi, DashboardStats } from '../services/api';
+import { warehouseApi, DashboardStats, LowStockAlert } from '../services/api';
 import { 
   TrendingUp, TrendingDown, AlertTriangle, DollarSign, Package, Activity, 
   ArrowUpRight, ArrowDownRight, Loader2, RefreshCw 
@@ -21,12 +21,16 @@ const Dashboard: React.FC<DashboardProps> = ({ products, transactions }) => {
   const [stats, setStats] = useState<DashboardStats | null>(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null); // Thêm state lỗi
+  const [lowStockAlerts, setLowStockAlerts] = useState<LowStockAlert[] | null>(null);
 
   // Tính toán các chỉ số tổng quan (Cards) ngay lập tức (Không cần chờ API)
   const totalProducts = products.length;
   const totalStock = products.reduce((acc, p) => acc + p.quantity, 0);
   const totalValue = products.reduce((acc, p) => acc + (p.price * p.quantity), 0);
-  const lowStockCount = products.filter(p => p.quantity <= p.minStock).length;
+  // Số hàng sắp hết do server đẩy qua SSE; chưa kết nối được thì tạm tính từ props
+  const lowStockCount = lowStockAlerts ? lowStockAlerts.length : products.filter(p => p.quantity <= p.minStock).length;
+
+  useEffect(() => warehouseApi.subscribeLowStock(setLowStockAlerts), []);
 
   const fetchStats = async () => {
     try {
@@ -63,12 +63,32 @@ const Inventory: React.FC<InventoryProps> = ({ products, onAddProduct, onUpdateP
     documentTitle: `Tem_${selectedProduct?.sku}`,
   });
 
+  // Tìm trên server (không dấu, xếp theo độ khớp): productId -> thứ hạng. null = chưa có kết quả
+  const [searchRank, setSearchRank] = useState<Map<string, number> | null>(null);
+
+  useEffect(() => {
+    setSearchRank(null);
+    const term = searchTerm.trim();
+    if (!term) return;
+    const timer = setTimeout(async () => {
+      try {
+        const hits = await warehouseApi.search(term, ['product'], 200);
+        setSearchRank(new Map(hits.map((h, i) => [h.id, i])));
+      } catch (error) { console.error(error); }
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
   const filteredProducts = products.filter(p => {
-    const matchesSearch = p.name.toLowerCase().includes(searchTerm.toLowerCase()) || 
-                          p.sku.toLowerCase().includes(searchTerm.toLowerCase());
+    // Trong lúc chờ server: lọc tạm theo tên / SKU
+    const matchesSearch = !searchTerm.trim() || (searchRank
+      ? searchRank.has(p.id)
+      : p.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
+        p.sku.toLowerCase().includes(searchTerm.toLowerCase()));
     const matchesCategory = filterCategory === 'all' || p.category === filterCategory;
     return matchesSearch && matchesCategory;
   });
+  if (searchRank) filteredProducts.sort((a, b) => searchRank.get(a.id)! - searchRank.get(b.id)!);
 
   const totalPages = Math.ceil(filteredProducts.length / ITEMS_PER_PAGE);
   const startIndex = (currentPage - 1) * ITEMS_PER_PAGE;
@@ -109,9 +129,27 @@ const Inventory: React.FC<InventoryProps> = ({ products, onAddProduct, onUpdateP
     setIsModalOpen(true);
   };
 
-  const handleEditClick = (product: Product) => {
-    setNewProduct({ ...product });
-    setImeiInput(product.imeis ? product.imeis.join('\n') : '');
+  // IMEI không còn nằm trong Product, tải riêng khi cần hiển thị
+  const loadImeis = async (product: Product): Promise<string[]> => {
+    if (!product.imeiCount) return [];
+    try {
+      return await warehouseApi.getProductImeis(product.id);
+    } catch (error) {
+      console.error("Lỗi tải IMEI:", error);
+      return [];
+    }
+  };
+
+  const handleSelectProduct = async (product: Product) => {
+    setSelectedProduct(product);
+    const imeis = await loadImeis(product);
+    setSelectedProduct(prev => (prev && prev.id === product.id ? { ...prev, imeis } : prev));
+  };
+
+  const handleEditClick = async (product: Product) => {
+    const imeis = await loadImeis(product);
+    setNewProduct({ ...product, imeis });
+    setImeiInput(imeis.join('\n'));
     setIsModalOpen(true);
   };
 
@@ -275,7 +313,7 @@ const Inventory: React.FC<InventoryProps> = ({ products, onAddProduct, onUpdateP
                   {currentTableData.map((product) => {
                     const isLowStock = product.quantity <= product.minStock;
                     return (
-                      <tr key={product.id} onClick={() => setSelectedProduct(product)} className="hover:bg-slate-50 transition-colors group cursor-pointer">
+                      <tr key={product.id} onClick={() => handleSelectProduct(product)} className="hover:bg-slate-50 transition-colors group cursor-pointer">
                         <td className="px-6 py-4 font-medium text-slate-800">{product.name}</td>
                         <td className="px-6 py-4 text-slate-500 font-mono text-sm">{product.sku}</td>
                         <td className="px-6 py-4 text-slate-600"><span className="bg-slate-100 px-2 py-1 rounded text-xs font-medium">{product.category}</span></td>
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
-import { Product, Transaction, TransactionType, MovementLog } from '../types';
-import { warehouseApi } from '../services/api'; // Import API
+import { Product, Transaction, MovementLog } from '../types';
+import { warehouseApi, SlottingMove } from '../services/api'; // Import API
 import { ArrowRight, Box, CheckCircle, AlertCircle, X, RefreshCw, TrendingUp, Zap, PieChart as PieIcon, History, Calendar, MoveRight } from 'lucide-react';
 import { BarChart, Bar, XAxis, YAxis, Tooltip, ResponsiveContainer, Cell, PieChart, Pie, Legend } from 'recharts';
 
@@ -10,17 +10,10 @@ interface StorageOptimizationProps {
   onUpdateProduct: (product: Product) => void;
 }
 
-interface MoveSuggestion {
-  product: Product;
-  currentZone: string;
-  idealZone: string;
-  velocityScore: number;
-  reason: string;
-}
-
 const StorageOptimization: React.FC<StorageOptimizationProps> = ({ products, transactions, onUpdateProduct }) => {
   const [activeTab, setActiveTab] = useState<'analysis' | 'history'>('analysis');
-  const [suggestions, setSuggestions] = useState<MoveSuggestion[]>([]);
+  const [suggestions, setSuggestions] = useState<SlottingMove[]>([]);
+  const [applyingAll, setApplyingAll] = useState(false);
   const [idealZoneStats, setIdealZoneStats] = useState<any[]>([]);
   const [currentZoneStats, setCurrentZoneStats] = useState<any[]>([]);
   const [efficiency, setEfficiency] = useState(0);
@@ -57,113 +50,80 @@ const StorageOptimization: React.FC<StorageOptimizationProps> = ({ products, tra
     }
   }, [activeTab]);
 
-  // Phân tích kho
+  // Phân tích kho (server tính tốc độ xuất + phân loại ABC, chỉ trả về các sản phẩm cần chuyển)
   useEffect(() => {
     if (products.length > 0) {
       analyzeWarehouse();
     }
   }, [products, transactions]);
 
-  const analyzeWarehouse = () => {
-    // 1. Thống kê hiện tại
-    const currentCounts = { A: 0, B: 0, C: 0, Other: 0 };
-    products.forEach(p => {
-      const zone = p.location ? p.location.charAt(0).toUpperCase() : 'Other';
-      if (zone === 'A') currentCounts.A++;
-      else if (zone === 'B') currentCounts.B++;
-      else if (zone === 'C') currentCounts.C++;
-      else currentCounts.Other++;
-    });
-
-    setCurrentZoneStats([
-      { name: 'Zone A', value: currentCounts.A, color: '#ef4444' },
-      { name: 'Zone B', value: currentCounts.B, color: '#f59e0b' },
-      { name: 'Zone C', value: currentCounts.C, color: '#3b82f6' },
-      { name: 'Khác', value: currentCounts.Other, color: '#94a3b8' },
-    ]);
-
-    // 2. Tính tốc độ xuất hàng
-    const productVelocity = products.map(p => {
-      const exportCount = transactions
-        .filter(t => t.productId === p.id && t.type === TransactionType.EXPORT)
-        .reduce((sum, t) => sum + t.quantity, 0);
-      return { ...p, exportCount };
-    });
-
-    productVelocity.sort((a, b) => b.exportCount - a.exportCount);
-
-    const totalItems = productVelocity.length;
-    const moves: MoveSuggestion[] = [];
-    const idealCounts = { A: 0, B: 0, C: 0 };
-    let correctPlacements = 0;
-
-    // 3. Phân tích ABC
-    productVelocity.forEach((p, index) => {
-      const percentile = (index + 1) / totalItems;
-      let idealZone = 'C';
-      let reason = 'Hàng bán chậm, nên để ở Zone C (xa cửa)';
-
-      if (percentile <= 0.2) { 
-        idealZone = 'A';
-        reason = 'Hàng bán chạy (Top 20%), cần chuyển về Zone A (gần cửa)';
-      } else if (percentile <= 0.5) {
-        idealZone = 'B';
-        reason = 'Sức mua trung bình, phù hợp Zone B';
-      }
-
-      const currentZone = p.location ? p.location.charAt(0).toUpperCase() : 'Unknown';
-      const validZones = ['A', 'B', 'C'];
+  const analyzeWarehouse = async () => {
+    try {
+      const plan = await warehouseApi.getSlottingPlan();
+      const zoneCount = (zone: string) => plan.currentZones[zone] || 0;
+
+      setCurrentZoneStats([
+        { name: 'Zone A', value: zoneCount('A'), color: '#ef4444' },
+        { name: 'Zone B', value: zoneCount('B'), color: '#f59e0b' },
+        { name: 'Zone C', value: zoneCount('C'), color: '#3b82f6' },
+        { name: 'Khác', value: zoneCount('Khác'), color: '#94a3b8' },
+      ]);
+      setSuggestions(plan.moves);
+      setEfficiency(plan.efficiency);
+      setIdealZoneStats([
+        { name: 'Zone A (Hot)', count: plan.idealZones['A'] || 0, color: '#ef4444' },
+        { name: 'Zone B (Warm)', count: plan.idealZones['B'] || 0, color: '#f59e0b' },
+        { name: 'Zone C (Cold)', count: plan.idealZones['C'] || 0, color: '#3b82f6' },
+      ]);
+    } catch (error) {
+      console.error("Lỗi phân tích vị trí kho:", error);
+      showToast('error', 'Không thể phân tích vị trí kho');
+    }
+  };
 
-      if (validZones.includes(idealZone)) idealCounts[idealZone as keyof typeof idealCounts]++;
+  // Áp dụng 1 hoặc nhiều đề xuất bằng 1 request (server ghi vị trí + lịch sử theo lô)
+  const applyMoves = async (moves: SlottingMove[]) => {
+    const logs = await warehouseApi.applySlottingMoves(moves);
+    const moved = new Set(logs.map(l => l.productId));
 
-      if (currentZone !== idealZone && validZones.includes(currentZone)) {
-        moves.push({ product: p, currentZone, idealZone, velocityScore: p.exportCount, reason });
-      } else if (currentZone === idealZone) {
-        correctPlacements++;
+    logs.forEach(log => {
+      const product = products.find(p => p.id === log.productId);
+      if (product) {
+        onUpdateProduct({ ...product, location: log.toLocation, lastUpdated: new Date().toISOString() });
       }
     });
-
-    setSuggestions(moves);
-    setEfficiency(totalItems > 0 ? Math.round((correctPlacements / totalItems) * 100) : 0);
-    setIdealZoneStats([
-      { name: 'Zone A (Hot)', count: idealCounts.A, color: '#ef4444' },
-      { name: 'Zone B (Warm)', count: idealCounts.B, color: '#f59e0b' },
-      { name: 'Zone C (Cold)', count: idealCounts.C, color: '#3b82f6' },
-    ]);
+    setSuggestions(prev => prev.filter(s => !moved.has(s.productId)));
+    return logs;
   };
 
-  const handleApplyMove = async (suggestion: MoveSuggestion) => {
-    const randomShelf = Math.floor(Math.random() * 100) + 1;
-    const newLocation = `${suggestion.idealZone}-${randomShelf.toString().padStart(2, '0')}`;
-
+  const handleApplyMove = async (suggestion: SlottingMove) => {
     try {
-      const updatedProduct = { 
-        ...suggestion.product, 
-        location: newLocation, 
-        lastUpdated: new Date().toISOString()
-      };
-      
-      await warehouseApi.updateProduct(updatedProduct);
-
-      await warehouseApi.addMovement({
-        productId: suggestion.product.id,
-        productName: suggestion.product.name,
-        sku: suggestion.product.sku,
-        fromLocation: suggestion.product.location,
-        toLocation: newLocation,
-        date: new Date().toISOString()
-      });
-
-      onUpdateProduct(updatedProduct);
-      setSuggestions(prev => prev.filter(s => s.product.id !== suggestion.product.id));
+      const logs = await applyMoves([suggestion]);
+      if (logs.length === 0) {
+        showToast('error', `Vị trí của "${suggestion.productName}" vừa thay đổi, hãy phân tích lại.`);
+        return;
+      }
       setEfficiency(prev => Math.min(100, prev + 1));
       
       // Hiện thông báo thành công
-      showToast('success', `Đã chuyển "${suggestion.product.name}" sang vị trí ${newLocation}`);
+      showToast('success', `Đã chuyển "${suggestion.productName}" sang vị trí ${suggestion.toLocation}`);
+
+    } catch (error) {
+      console.error("Lỗi khi di chuyển hàng:", error);
+      showToast('error', 'Lỗi kết nối! Không thể cập nhật vị trí.');
+    }
+  };
 
+  const handleApplyAll = async () => {
+    try {
+      setApplyingAll(true);
+      const logs = await applyMoves(suggestions);
+      showToast('success', `Đã chuyển ${logs.length}/${suggestions.length} sản phẩm`);
     } catch (error) {
       console.error("Lỗi khi di chuyển hàng:", error);
       showToast('error', 'Lỗi kết nối! Không thể cập nhật vị trí.');
+    } finally {
+      setApplyingAll(false);
     }
   };
 
@@ -271,9 +231,20 @@ const StorageOptimization: React.FC<StorageOptimizationProps> = ({ products, tra
             <div className="lg:col-span-2 bg-white rounded-2xl shadow-sm border border-slate-100 flex flex-col h-[500px]">
               <div className="p-5 border-b border-slate-100 bg-slate-50 rounded-t-2xl flex justify-between items-center">
                 <h3 className="font-bold text-lg text-slate-800">Đề Xuất Tối Ưu ({suggestions.length})</h3>
-                <button onClick={analyzeWarehouse} className="text-indigo-600 hover:bg-indigo-50 p-2 rounded-lg transition-colors">
-                  <RefreshCw size={18} />
-                </button>
+                <div className="flex items-center gap-2">
+                  {suggestions.length > 0 && (
+                    <button
+                      onClick={handleApplyAll}
+                      disabled={applyingAll}
+                      className="bg-indigo-600 text-white px-3 py-1.5 rounded-lg text-sm font-medium hover:bg-indigo-700 transition-colors disabled:opacity-50"
+                    >
+                      {applyingAll ? 'Đang chuyển...' : 'Chuyển tất cả'}
+                    </button>
+                  )}
+                  <button onClick={analyzeWarehouse} className="text-indigo-600 hover:bg-indigo-50 p-2 rounded-lg transition-colors">
+                    <RefreshCw size={18} />
+                  </button>
+                </div>
               </div>
               
               <div className="flex-1 overflow-y-auto p-4 space-y-3">
@@ -283,16 +254,16 @@ const StorageOptimization: React.FC<StorageOptimizationProps> = ({ products, tra
                       <p>Kho hàng đã được sắp xếp tối ưu!</p>
                   </div>
                 ) : (
-                  suggestions.map((item, idx) => (
-                    <div key={idx} className="flex flex-col md:flex-row md:items-center justify-between p-4 bg-white border border-slate-200 rounded-xl hover:shadow-md transition-all group gap-4">
+                  suggestions.map((item) => (
+                    <div key={item.productId} className="flex flex-col md:flex-row md:items-center justify-between p-4 bg-white border border-slate-200 rounded-xl hover:shadow-md transition-all group gap-4">
                         <div className="flex items-center gap-4">
                           <div className={`w-10 h-10 rounded-lg flex items-center justify-center font-bold text-white shrink-0
-                              ${item.idealZone === 'A' ? 'bg-red-500' : item.idealZone === 'B' ? 'bg-amber-500' : 'bg-blue-500'}
+                              ${item.toZone === 'A' ? 'bg-red-500' : item.toZone === 'B' ? 'bg-amber-500' : 'bg-blue-500'}
                           `}>
-                              {item.idealZone}
+                              {item.toZone}
                           </div>
                           <div>
-                              <h4 className="font-bold text-slate-800">{item.product.name}</h4>
+                              <h4 className="font-bold text-slate-800">{item.productName}</h4>
                               <p className="text-xs text-slate-500 flex items-center gap-1">
                                 <Box size={12} /> {item.reason}
                               </p>
@@ -301,9 +272,9 @@ const StorageOptimization: React.FC<StorageOptimizationProps> = ({ products, tra
                         
                         <div className="flex items-center justify-between md:justify-end gap-4 min-w-[200px]">
                           <div className="flex items-center gap-2 text-sm font-mono bg-slate-100 px-3 py-1 rounded-full">
-                            <span className="text-slate-500 line-through">{item.currentZone}</span>
+                            <span className="text-slate-500 line-through">{item.fromLocation}</span>
                             <ArrowRight size={14} className="text-slate-400" />
-                            <span className="font-bold text-slate-800">{item.idealZone}</span>
+                            <span className="font-bold text-slate-800">{item.toLocation}</span>
                           </div>
                           <button 
                             onClick={() => handleApplyMove(item)}
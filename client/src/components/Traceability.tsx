@@ -1,6 +1,6 @@
 import React, { useState } from 'react';
 import { warehouseApi, TimelineEvent } from '../services/api';
-import { Search, Clock, ArrowDownCircle, ArrowUpCircle, Wrench, AlertCircle, SearchX } from 'lucide-react';
+import { Search, Clock, ArrowDownCircle, ArrowUpCircle, Wrench, AlertCircle, SearchX, MapPin, ClipboardCheck } from 'lucide-react';
 
 const Traceability: React.FC = () => {
   const [imei, setImei] = useState('');
@@ -30,6 +30,12 @@ const Traceability: React.FC = () => {
     if (event.type === 'WARRANTY') {
       return { icon: Wrench, color: 'text-amber-600', bg: 'bg-amber-100', border: 'border-amber-200' };
     }
+    if (event.type === 'MOVEMENT') {
+      return { icon: MapPin, color: 'text-violet-600', bg: 'bg-violet-100', border: 'border-violet-200' };
+    }
+    if (event.type === 'STOCKTAKE') {
+      return { icon: ClipboardCheck, color: 'text-slate-600', bg: 'bg-slate-100', border: 'border-slate-200' };
+    }
     if (event.sub_type === 'IMPORT') {
       return { icon: ArrowDownCircle, color: 'text-green-600', bg: 'bg-green-100', border: 'border-green-200' };
     }
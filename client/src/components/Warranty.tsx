@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { WarrantyTicket, WarrantyStatus } from '../types';
-import { warehouseApi } from '../services/api';
+import { warehouseApi, applyFeedEvent } from '../services/api';
 import { Wrench, Plus, Edit2, Search, CheckCircle, Clock, Smartphone, User, FileText } from 'lucide-react';
 
 const Warranty: React.FC = () => {
@@ -27,7 +27,22 @@ const Warranty: React.FC = () => {
     } catch (e) { console.error(e); }
   };
 
-  useEffect(() => { fetchTickets(); }, []);
+  // Tải 1 lần rồi nhận thay đổi phiếu bảo hành qua change feed
+  useEffect(() => {
+    let unsubscribe: (() => void) | null = null;
+    const load = async () => {
+      try {
+        const token = await warehouseApi.getFeedToken();
+        await fetchTickets();
+        unsubscribe?.();
+        unsubscribe = warehouseApi.subscribeFeed(
+          ['warranty'], (event) => setTickets(prev => applyFeedEvent(prev, event)), load, token
+        );
+      } catch (e) { console.error(e); }
+    };
+    load();
+    return () => unsubscribe?.();
+  }, []);
 
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault();
@@ -40,7 +55,6 @@ const Warranty: React.FC = () => {
         await warehouseApi.addTicket(formData);
       }
       
-      fetchTickets();
       setIsModalOpen(false);
       // Reset form về chuỗi rỗng
       setFormData({ 
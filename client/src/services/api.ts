@@ -3,6 +3,7 @@ import {
   Product, 
   Transaction, 
   StocktakeSession, 
+  StocktakeItem,
   AIAnalysisResult, 
   MovementLog, 
   SystemLog,
@@ -49,13 +50,236 @@ export interface DashboardStats {
   topProducts: { name: string; quantity: number }[];
 }
 
+// Phân trang keyset: server trả cursor trang kế tiếp trong header X-Next-Cursor
+export interface Page<T> {
+  items: T[];
+  nextCursor: string | null;
+}
+
+export interface ListQuery {
+  limit?: number;
+  cursor?: string | null;
+  q?: string;
+  [filter: string]: string | number | null | undefined;
+}
+
+const PAGE_SIZE = 50;
+
+const getPage = async <T>(url: string, params: ListQuery = {}): Promise<Page<T>> => {
+  const response = await api.get(url, { params: { limit: PAGE_SIZE, ...params } });
+  return {
+    items: response.data.map(mapId),
+    nextCursor: response.headers['x-next-cursor'] || null,
+  };
+};
+
 export interface TimelineEvent {
   date: string;
-  type: 'TRANSACTION' | 'WARRANTY';
+  type: 'TRANSACTION' | 'MOVEMENT' | 'STOCKTAKE' | 'WARRANTY';
   sub_type: string;
   title: string;
   description: string;
   ref_id: string;
+  productId?: string | null;
+}
+
+// Vòng đời đầy đủ của 1 IMEI (truy vết hàng loạt)
+export interface SerialTrace {
+  imei: string;
+  productId: string | null;
+  productName: string | null;
+  sku: string | null;
+  status: string | null;
+  location: string | null;
+  events: TimelineEvent[];
+}
+
+// Tồn kho tại 1 thời điểm (server tính từ lần chốt gần nhất + sổ kho)
+export interface StockPosition {
+  productId: string;
+  productName: string;
+  sku: string | null;
+  category: string | null;
+  quantity: number;
+  price: number;
+  value: number;
+}
+
+export interface InventoryAsOf {
+  date: string;
+  snapshotDate: string | null;
+  entriesScanned: number;
+  totalQuantity: number;
+  totalValue: number;
+  items: StockPosition[];
+}
+
+// Phân tích nhập/xuất theo kỳ (server gộp theo ngày/tuần/tháng + nhóm, có so sánh kỳ trước)
+export type AnalyticsGranularity = 'day' | 'week' | 'month';
+export type AnalyticsGroupBy = 'product' | 'brand' | 'category' | 'partner';
+
+export interface AnalyticsTotals {
+  importQuantity: number;
+  exportQuantity: number;
+  importCount: number;
+  exportCount: number;
+  importCost: number;
+  exportCost: number;
+}
+
+export interface AnalyticsSeries {
+  key: string;
+  label: string;
+  totals: AnalyticsTotals;
+  previous: AnalyticsTotals | null;
+  exportChange: number | null;
+  points: (AnalyticsTotals & { bucket: string })[];
+}
+
+export interface AnalyticsReport {
+  date_from: string;
+  date_to: string;
+  granularity: AnalyticsGranularity;
+  group_by: AnalyticsGroupBy | null;
+  compare_from: string | null;
+  compare_to: string | null;
+  buckets: string[];
+  totals: AnalyticsTotals;
+  previous: AnalyticsTotals | null;
+  series: AnalyticsSeries[];
+}
+
+export interface AnalyticsQuery {
+  date_from?: string;
+  date_to?: string;
+  granularity?: AnalyticsGranularity;
+  group_by?: AnalyticsGroupBy;
+  compare?: 'previous' | 'year';
+  limit?: number;
+}
+
+// Giá trị tồn kho theo giá vốn (FIFO / bình quân)
+export interface ProductValuation {
+  productId: string;
+  productName: string;
+  sku: string | null;
+  category: string | null;
+  quantity: number;
+  value: number;
+  avgCost: number;
+  cogs: number;
+}
+
+export interface ValuationReport {
+  method: 'fifo' | 'average';
+  totalQuantity: number;
+  totalValue: number;
+  totalCogs: number;
+  items: ProductValuation[];
+}
+
+// Báo cáo chạy nền trên server
+export type ReportKind = 'transactions' | 'inventory' | 'stocktake-variance' | 'warranty';
+
+export interface ReportJobRequest {
+  kind: ReportKind;
+  format?: 'xlsx' | 'csv';
+  date_from?: string;
+  date_to?: string;
+  type?: string;
+  category?: string;
+}
+
+export interface ReportJob {
+  id: string;
+  kind: ReportKind;
+  format: string;
+  status: 'PENDING' | 'RUNNING' | 'DONE' | 'FAILED';
+  reused: boolean;
+  fileName: string;
+  createdAt: string;
+  finishedAt?: string;
+  error?: string;
+}
+
+// Tối ưu vị trí kho
+export interface SlottingConfig {
+  days?: number;
+  zones?: { zone: string; distance: number; share: number; slots?: number }[];
+  includeUnzoned?: boolean;
+}
+
+export interface SlottingMove {
+  productId: string;
+  productName: string;
+  sku: string;
+  fromLocation: string;
+  toLocation: string;
+  fromZone?: string;
+  toZone?: string;
+  velocity: number;
+  reason?: string;
+}
+
+// Change feed: server đẩy từng thay đổi qua SSE, client chỉ tải danh sách 1 lần rồi áp dụng
+export type FeedTopic = 'product' | 'transaction' | 'stocktake' | 'movement' | 'warranty' | 'log';
+
+export interface FeedEvent {
+  seq: number;
+  topic: FeedTopic;
+  op: 'insert' | 'update' | 'delete' | 'delta';
+  id: string;
+  data: any;
+  ts: string;
+}
+
+// Áp dụng 1 sự kiện vào danh sách (theo id); insert đưa lên đầu, delta/update gộp vào bản ghi cũ
+export const applyFeedEvent = <T extends { id: string }>(list: T[], event: FeedEvent): T[] => {
+  if (event.op === 'delete') return list.filter(item => item.id !== event.id);
+  const { delta, ...fields } = event.data || {};
+  const index = list.findIndex(item => item.id === event.id);
+  if (index === -1) {
+    // Bản ghi chưa có trong danh sách: chỉ thêm khi có đủ dữ liệu
+    return event.op === 'delta' ? list : [mapId(fields) as T, ...list];
+  }
+  const next = [...list];
+  next[index] = { ...list[index], ...fields, id: event.id };
+  return next;
+};
+
+// Kết quả tìm kiếm trên server (không dấu, xếp theo độ khớp)
+export type SearchType = 'product' | 'partner' | 'warranty';
+
+export interface SearchHit {
+  type: SearchType;
+  id: string;
+  title: string;
+  subtitle: string | null;
+  score: number;
+}
+
+// Cảnh báo tồn kho thấp (server theo dõi tăng dần, đẩy thay đổi qua SSE)
+export interface LowStockAlert {
+  productId: string;
+  name: string;
+  sku: string;
+  category: string;
+  quantity: number;
+  minStock: number;
+  shortage: number;
+  since: string;
+}
+
+export interface SlottingPlan {
+  generatedAt: string;
+  totalProducts: number;
+  correctlyPlaced: number;
+  efficiency: number;
+  travelCostBefore: number;
+  travelCostAfter: number;
+  currentZones: Record<string, number>;
+  idealZones: Record<string, number>;
+  moves: SlottingMove[];
 }
 
 export const warehouseApi = {
@@ -64,6 +288,73 @@ export const warehouseApi = {
     const response = await api.get('/reports/dashboard-stats');
     return response.data;
   },
+  // --- Report jobs ---
+  createReportJob: async (req: ReportJobRequest): Promise<ReportJob> => {
+    const response = await api.post('/reports/jobs', req);
+    return response.data;
+  },
+  getReportJob: async (id: string): Promise<ReportJob> => {
+    const response = await api.get(`/reports/jobs/${id}`);
+    return response.data;
+  },
+  downloadReportJob: async (job: ReportJob): Promise<Blob> => {
+    const response = await api.get(`/reports/jobs/${job.id}/download`, { responseType: 'blob' });
+    return response.data;
+  },
+  // --- Change feed ---
+  // Lấy token TRƯỚC khi tải danh sách, tải xong thì subscribeFeed(..., token) để không lỡ thay đổi nào
+  getFeedToken: async (): Promise<string> => {
+    const response = await api.get('/feed/token');
+    return response.data.token;
+  },
+  // onReset: token quá cũ / server khởi động lại -> cần tải lại danh sách. Trả về hàm hủy theo dõi
+  subscribeFeed: (
+    topics: FeedTopic[],
+    onEvent: (event: FeedEvent) => void,
+    onReset: () => void,
+    resume?: string
+  ): (() => void) => {
+    const params = new URLSearchParams({ token: localStorage.getItem('smartwms_token') || '', topics: topics.join(',') });
+    if (resume) params.set('resume', resume);
+    const source = new EventSource(`${API_URL}/feed?${params}`);
+    source.addEventListener('change', (e) => onEvent(JSON.parse((e as MessageEvent).data)));
+    source.addEventListener('reset', () => onReset());
+    return () => source.close();
+  },
+  // --- Cảnh báo tồn kho thấp ---
+  getLowStockAlerts: async (): Promise<LowStockAlert[]> => {
+    const response = await api.get('/alerts/low-stock');
+    return response.data;
+  },
+  // Nhận danh sách đầy đủ khi kết nối rồi cập nhật theo từng thay đổi; trả về hàm hủy theo dõi
+  subscribeLowStock: (onChange: (alerts: LowStockAlert[]) => void): (() => void) => {
+    const source = new EventSource(`${API_URL}/alerts/low-stock/stream`);
+    const alerts = new Map<string, LowStockAlert>();
+    const emit = () => onChange(Array.from(alerts.values()).sort((a, b) => b.shortage - a.shortage));
+
+    source.addEventListener('snapshot', (e) => {
+      alerts.clear();
+      (JSON.parse((e as MessageEvent).data) as LowStockAlert[]).forEach(a => alerts.set(a.productId, a));
+      emit();
+    });
+    const upsert = (e: Event) => {
+      const alert: LowStockAlert = JSON.parse((e as MessageEvent).data);
+      alerts.set(alert.productId, alert);
+      emit();
+    };
+    source.addEventListener('low', upsert);
+    source.addEventListener('update', upsert);
+    source.addEventListener('resolved', (e) => {
+      alerts.delete(JSON.parse((e as MessageEvent).data).productId);
+      emit();
+    });
+    return () => source.close();
+  },
+  // --- Tìm kiếm ---
+  search: async (q: string, types?: SearchType[], limit = 20): Promise<SearchHit[]> => {
+    const response = await api.get('/search', { params: { q, types: types?.join(','), limit } });
+    return response.data;
+  },
   // --- Brands ---
   getBrands: async (): Promise<Brand[]> => {
     const response = await api.get('/brands');
@@ -87,6 +378,8 @@ export const warehouseApi = {
     const res = await api.get('/products');
     return res.data.map(mapId);
   },
+  // Lấy 1 trang sản phẩm (lọc: category, brand, q)
+  getProductsPage: (params?: ListQuery): Promise<Page<Product>> => getPage<Product>('/products', params),
   addProduct: async (p: Product): Promise<Product> => {
     // Loại bỏ id giả nếu có trước khi gửi
     const { id, ...data } = p; 
@@ -100,24 +393,59 @@ export const warehouseApi = {
   deleteProduct: async (id: string): Promise<void> => {
     await api.delete(`/products/${id}`);
   },
+  getAnalytics: async (params?: AnalyticsQuery): Promise<AnalyticsReport> => {
+    const res = await api.get('/reports/analytics', { params });
+    return res.data;
+  },
+  // Giá trị tồn kho theo giá vốn; có kỳ (date_from/date_to) thì cogs là giá vốn hàng bán trong kỳ
+  getValuation: async (params?: { date_from?: string; date_to?: string }): Promise<ValuationReport> => {
+    const res = await api.get('/reports/valuation', { params });
+    return res.data;
+  },
+  // Tồn kho toàn kho tại 1 thời điểm (VD: cuối tháng trước)
+  getInventoryAsOf: async (date: string): Promise<InventoryAsOf> => {
+    const res = await api.get('/inventory/as-of', { params: { date } });
+    return res.data;
+  },
+  // Danh sách IMEI đang tồn kho của 1 sản phẩm
+  getProductImeis: async (id: string): Promise<string[]> => {
+    const res = await api.get(`/products/${id}/imeis`);
+    return res.data;
+  },
 
   // Hàm tra cứu IMEI
   traceImei: async (imei: string): Promise<TimelineEvent[]> => {
     const response = await api.get(`/trace/${imei}`);
     return response.data;
   },
+  // Truy vết nhiều IMEI cùng lúc (thu hồi theo lô)
+  traceImeis: async (imeis: string[]): Promise<SerialTrace[]> => {
+    const response = await api.post('/trace/bulk', { imeis });
+    return response.data;
+  },
 
   // --- Transactions ---
   getTransactions: async (): Promise<Transaction[]> => {
     const res = await api.get('/transactions');
     return res.data.map(mapId);
   },
+  // Lấy 1 trang giao dịch (lọc: type, productId, partner, brand, category, date_from, date_to, q)
+  getTransactionsPage: (params?: ListQuery): Promise<Page<Transaction>> => getPage<Transaction>('/transactions', params),
   addTransaction: async (t: Transaction): Promise<Transaction> => {
     const { id, ...data } = t;
     const res = await api.post('/transactions', data);
     return mapId(res.data);
   },
 
+  // Phiếu nhiều dòng: lỗi ở 1 dòng thì server không ghi dòng nào
+  addTransactionBatch: async (
+    transactions: Omit<Transaction, 'id' | 'date'>[],
+    options: { partner?: string; notes?: string } = {}
+  ): Promise<Transaction[]> => {
+    const res = await api.post('/transactions/batch', { ...options, transactions });
+    return res.data.map(mapId);
+  },
+
   // --- Stocktakes ---
   getStocktakes: async (): Promise<StocktakeSession[]> => {
     const res = await api.get('/stocktakes');
@@ -128,6 +456,15 @@ export const warehouseApi = {
     const res = await api.post('/stocktakes', data);
     return mapId(res.data);
   },
+  // Phiếu nháp: chỉ gửi các dòng vừa đếm/sửa, không gửi lại cả phiếu
+  patchStocktakeItems: async (id: string, items: StocktakeItem[], remove: string[] = []): Promise<StocktakeSession> => {
+    const res = await api.patch(`/stocktakes/${id}/items`, { items, remove });
+    return mapId(res.data);
+  },
+  completeStocktake: async (id: string): Promise<StocktakeSession> => {
+    const res = await api.post(`/stocktakes/${id}/complete`);
+    return mapId(res.data);
+  },
 
   // --- Movement Logs ---
   getMovements: async (): Promise<MovementLog[]> => {
@@ -140,6 +477,16 @@ export const warehouseApi = {
     return mapId(response.data);
   },
 
+  // --- Slotting (tối ưu vị trí, tính trên server) ---
+  getSlottingPlan: async (config?: SlottingConfig): Promise<SlottingPlan> => {
+    const response = await api.post('/slotting/plan', config ?? null);
+    return response.data;
+  },
+  applySlottingMoves: async (moves: SlottingMove[]): Promise<MovementLog[]> => {
+    const response = await api.post('/slotting/apply', { moves });
+    return response.data.map(mapId);
+  },
+
   // --- AI ---
   analyzeInventory: async (): Promise<AIAnalysisResult> => {
     const res = await api.get('/ai/analyze');
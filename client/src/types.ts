@@ -14,7 +14,8 @@ export enum Category {
     category: Category | string;
     brand?: string;
     quantity: number;
-    imeis?: string[];
+    imeis?: string[]; // Tải riêng qua /products/{id}/imeis
+    imeiCount?: number;
     minStock: number;
     price: number;
     location: string;
@@ -36,6 +37,13 @@ export enum Category {
     partner?: string; // Tên nhà cung cấp hoặc khách hàng
     date: string;
     notes?: string;
+    unitCost?: number; // Nhập: giá nhập / đơn vị; Xuất: giá vốn / đơn vị (server tính)
+    costAmount?: number; // Thành tiền theo giá vốn (server tính)
+    // Thông tin sản phẩm lúc ghi phiếu (server điền, không đổi khi sửa sản phẩm)
+    sku?: string;
+    brand?: string;
+    category?: string;
+    unitPrice?: number;
   }
 
 export interface MovementLog {
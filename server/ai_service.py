@@ -1,8 +1,15 @@
+import asyncio
+import hashlib
 import os
+import random
+import time
 import google.generativeai as genai
 import json
-from typing import List, Optional
-from models import Product, AIAnalysisResult
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from cachetools import TTLCache
+from fastapi import HTTPException
+from models import Product, AIAnalysisResult, ForecastResult
 from dotenv import load_dotenv
 from models import Product, Transaction, TransactionType
 
@@ -13,24 +20,200 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if GOOGLE_API_KEY:
     genai.configure(api_key=GOOGLE_API_KEY)
 
-async def analyze_inventory_service(products: List[Product]) -> Optional[AIAnalysisResult]:
-    if not GOOGLE_API_KEY:
+# --- CẤU HÌNH GỌI MODEL ---
+# - Cache kết quả theo "dấu vân tay" trạng thái kho (TTL), cùng câu hỏi + kho không đổi -> không gọi lại Gemini
+# - Nhiều request giống nhau đến cùng lúc chỉ gọi model 1 lần (coalescing)
+# - Giới hạn số lần gọi model mỗi phút (AI_RATE_PER_MINUTE), vượt quá trả 429
+# - Dữ liệu đưa vào prompt được cắt gọn theo ngân sách token (AI_PROMPT_TOKENS)
+# - AI_FAKE_MODEL=true: dùng model giả trong máy (không cần API key, dùng khi chạy thử / check_ai_cache.py)
+MODEL_NAME = "gemini-2.5-flash"
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", "600"))
+AI_RATE_PER_MINUTE = int(os.getenv("AI_RATE_PER_MINUTE", "15"))
+AI_PROMPT_TOKENS = int(os.getenv("AI_PROMPT_TOKENS", "8000"))
+AI_FAKE_MODEL = os.getenv("AI_FAKE_MODEL", "false").lower() == "true"
+CHAT_TRANSACTIONS = 50  # Số giao dịch gần nhất đưa vào ngữ cảnh chat
+
+_cache = TTLCache(maxsize=256, ttl=AI_CACHE_TTL)
+_inflight: Dict[str, asyncio.Future] = {}
+_calls = deque()  # Thời điểm các lần gọi model trong 60 giây gần nhất
+_stats = {"hits": 0, "misses": 0, "coalesced": 0, "modelCalls": 0, "rateLimited": 0, "promptTokens": 0, "sampledPrompts": 0}
+
+
+class FakeGenerativeModel:
+    """
+    Model giả thay cho genai.GenerativeModel: trả kết quả cố định, có độ trễ giả lập.
+    Đủ để chạy thử cache / coalescing / ngân sách token mà không tốn quota Gemini.
+    """
+    delay = float(os.getenv("AI_FAKE_DELAY", "0.2"))
+
+    class _Response:
+        def __init__(self, text: str):
+            self.text = text
+
+    def __init__(self, model_name: str, generation_config: Optional[dict] = None):
+        self.schema = (generation_config or {}).get("response_schema")
+
+    async def generate_content_async(self, prompt: str):
+        await asyncio.sleep(self.delay)
+        if self.schema is AIAnalysisResult:
+            return self._Response(AIAnalysisResult(
+                summary=f"[fake] Prompt dài {len(prompt)} ký tự.",
+                lowStockItems=[],
+                restockRecommendations=[],
+                valueAnalysis="[fake] Không phân tích.",
+            ).model_dump_json())
+        return self._Response(f"[fake] Đã nhận câu hỏi ({len(prompt)} ký tự ngữ cảnh).")
+
+
+def _model(generation_config: Optional[dict] = None):
+    factory = FakeGenerativeModel if AI_FAKE_MODEL else genai.GenerativeModel
+    return factory(model_name=MODEL_NAME, generation_config=generation_config)
+
+
+def estimate_tokens(text: str) -> int:
+    # Ước lượng thô: ~4 ký tự / token
+    return len(text) // 4 + 1
+
+
+def get_stats() -> dict:
+    return {**_stats, "cacheSize": len(_cache), "inflight": len(_inflight), "fakeModel": AI_FAKE_MODEL}
+
+
+def _check_rate():
+    now = time.monotonic()
+    while _calls and now - _calls[0] > 60:
+        _calls.popleft()
+    if len(_calls) >= AI_RATE_PER_MINUTE:
+        _stats["rateLimited"] += 1
+        raise HTTPException(
+            status_code=429,
+            detail="AI đang nhận quá nhiều yêu cầu, vui lòng thử lại sau ít phút",
+            headers={"Retry-After": str(int(60 - (now - _calls[0])) + 1)},
+        )
+    _calls.append(now)
+
+
+async def _cached(key: str, produce: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Trả kết quả đã cache, hoặc chờ chung lời gọi đang chạy, hoặc gọi produce() (có giới hạn tần suất)
+    """
+    if key in _cache:
+        _stats["hits"] += 1
+        return _cache[key]
+    if key in _inflight:
+        _stats["coalesced"] += 1
+        return await asyncio.shield(_inflight[key])
+
+    _stats["misses"] += 1
+    _check_rate()
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        _stats["modelCalls"] += 1
+        result = await produce()
+        if result is not None:
+            _cache[key] = result
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        # Tránh cảnh báo "exception was never retrieved" khi không có request nào chờ chung
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+
+# --- DỮ LIỆU ĐẦU VÀO ---
+
+async def inventory_fingerprint() -> str:
+    """
+    Dấu vân tay trạng thái kho: đổi khi thêm/xóa/sửa sản phẩm hoặc tồn kho thay đổi
+    (mọi thao tác ghi sản phẩm đều cập nhật lastUpdated)
+    """
+    cursor = await Product.get_pymongo_collection().aggregate([{"$group": {
+        "_id": None, "n": {"$sum": 1}, "qty": {"$sum": "$quantity"},
+        "lastId": {"$max": "$_id"}, "last": {"$max": "$lastUpdated"},
+    }}])
+    rows = await cursor.to_list()
+    return hashlib.sha256(json.dumps(rows, default=str).encode()).hexdigest()[:24]
+
+
+async def _load_products() -> List[dict]:
+    projection = {"name": 1, "category": 1, "quantity": 1, "minStock": 1, "price": 1}
+    return await Product.get_pymongo_collection().find({}, projection).to_list()
+
+
+def _product_row(p: dict) -> dict:
+    return {
+        "name": p.get("name"),
+        "category": p.get("category"),
+        "quantity": p.get("quantity", 0),
+        "minStock": p.get("minStock", 0),
+        "price": p.get("price", 0),
+    }
+
+
+def budget_products(products: List[dict], max_tokens: int) -> dict:
+    """
+    Đưa dữ liệu sản phẩm vào prompt trong giới hạn max_tokens.
+    Vừa thì gửi đủ danh sách; không vừa thì gửi tổng hợp theo danh mục + ưu tiên
+    hàng sắp hết, hàng giá trị tồn cao nhất, rồi lấy mẫu ngẫu nhiên (cố định seed) phần còn lại.
+    """
+    rows = [_product_row(p) for p in products]
+    full = {"products": rows}
+    if estimate_tokens(json.dumps(full, ensure_ascii=False)) <= max_tokens:
+        return full
+
+    _stats["sampledPrompts"] += 1
+    categories: Dict[str, dict] = {}
+    for r in rows:
+        c = categories.setdefault(str(r["category"]), {"category": r["category"], "products": 0, "quantity": 0, "value": 0.0, "lowStock": 0})
+        c["products"] += 1
+        c["quantity"] += r["quantity"]
+        c["value"] += r["quantity"] * r["price"]
+        c["lowStock"] += r["quantity"] <= r["minStock"]
+
+    low = [r for r in rows if r["quantity"] <= r["minStock"]]
+    rest = sorted((r for r in rows if r["quantity"] > r["minStock"]), key=lambda r: -r["quantity"] * r["price"])
+    top, tail = rest[:50], rest[50:]
+    random.Random(len(rows)).shuffle(tail)
+
+    payload = {
+        "note": f"Kho có {len(rows)} sản phẩm, chỉ gửi tổng hợp và một phần danh sách do giới hạn độ dài.",
+        "categories": list(categories.values()),
+        "products": [],
+    }
+    used = estimate_tokens(json.dumps(payload, ensure_ascii=False))
+    for r in low + top + tail:
+        cost = estimate_tokens(json.dumps(r, ensure_ascii=False)) + 1
+        if used + cost > max_tokens:
+            break
+        payload["products"].append(r)
+        used += cost
+    payload["note"] += f" Đã gửi {len(payload['products'])} sản phẩm (ưu tiên hàng sắp hết và giá trị cao)."
+    return payload
+
+
+async def analyze_inventory_service() -> Optional[AIAnalysisResult]:
+    if not GOOGLE_API_KEY and not AI_FAKE_MODEL:
         print("Error: Lỗi GOOGLE_API_KEY")
         return None
 
+    async def produce():
+        products = await _load_products()
+        if not products:
+            return AIAnalysisResult(summary="Kho hàng đang trống.", lowStockItems=[], restockRecommendations=[], valueAnalysis="Chưa có dữ liệu.")
+        return await _analyze(products)
+
+    return await _cached(f"analyze:{await inventory_fingerprint()}", produce)
+
+
+async def _analyze(products: List[dict]) -> Optional[AIAnalysisResult]:
     try:
-        # 1. Chuẩn bị dữ liệu input (Rút gọn để tiết kiệm token)
+        # 1. Chuẩn bị dữ liệu input (cắt gọn theo ngân sách token)
         # Chỉ lấy các trường cần thiết để AI phân tích
-        inventory_data = [
-            {
-                "name": p.name,
-                "category": p.category.value, # Lấy giá trị string của Enum
-                "quantity": p.quantity,
-                "minStock": p.minStock,
-                "price": p.price
-            }
-            for p in products
-        ]
+        inventory_data = budget_products(products, AI_PROMPT_TOKENS)
 
         # 2. Tạo Prompt
         prompt = f"""
@@ -44,11 +227,11 @@ async def analyze_inventory_service(products: List[Product]) -> Optional[AIAnaly
         3. restockRecommendations: Đề xuất nhập hàng (tên, số lượng đề xuất, lý do).
         4. valueAnalysis: Phân tích phân bổ giá trị tồn kho.
         """
+        _stats["promptTokens"] += estimate_tokens(prompt)
 
         # 3. Cấu hình Model & Gọi API
         # Sử dụng gemini-1.5-flash cho tốc độ nhanh và chi phí thấp (tương đương 2.5-flash ở bản preview)
-        model = genai.GenerativeModel(
-            model_name="gemini-2.5-flash",
+        model = _model(
             generation_config={
                 "response_mime_type": "application/json",
                 "response_schema": AIAnalysisResult, # Truyền trực tiếp Pydantic Model vào đây
@@ -57,7 +240,7 @@ async def analyze_inventory_service(products: List[Product]) -> Optional[AIAnaly
 
         # Gọi hàm async generate
         response = await model.generate_content_async(prompt)
-        
+
         # 4. Parse kết quả
         # Vì đã dùng response_schema, Gemini đảm bảo trả về đúng cấu trúc JSON khớp với Model
         result = AIAnalysisResult.model_validate_json(response.text)
@@ -67,114 +250,103 @@ async def analyze_inventory_service(products: List[Product]) -> Optional[AIAnaly
     except Exception as e:
         print(f"Gemini Analysis Failed: {e}")
         return None
-    
-# async def forecast_demand_service(products: List[Product], transactions: List[Transaction]) -> Optional[ForecastResult]:
-#     if not GOOGLE_API_KEY:
-#         return None
-
-#     try:
-#         # 1. TỔNG HỢP DỮ LIỆU BÁN HÀNG (Pre-processing)
-#         # Tính tổng số lượng xuất kho trong 30 ngày qua cho từng sản phẩm
-#         sales_data = {}
-#         thirty_days_ago = datetime.now() - timedelta(days=30)
-        
-#         for t in transactions:
-#             # Chỉ lấy giao dịch XUẤT và trong 30 ngày gần nhất
-#             if t.type == TransactionType.EXPORT and t.date >= thirty_days_ago:
-#                 if t.productId not in sales_data:
-#                     sales_data[t.productId] = 0
-#                 sales_data[t.productId] += t.quantity
-
-#         # 2. CHUẨN BỊ DATA GỬI CHO AI
-#         ai_input = []
-#         for p in products:
-#             sold_qty = sales_data.get(str(p.id), 0) # Lấy số đã bán, nếu không có thì là 0
-#             ai_input.append({
-#                 "product": p.name,
-#                 "category": p.category.value if hasattr(p.category, 'value') else p.category,
-#                 "current_stock": p.quantity,
-#                 "min_stock": p.minStock,
-#                 "sales_last_30_days": sold_qty
-#             })
-
-#         # 3. TẠO PROMPT
-#         prompt = f"""
-#         Bạn là chuyên gia phân tích chuỗi cung ứng. Dựa vào dữ liệu bán hàng 30 ngày qua (sales_last_30_days), hãy dự báo nhu cầu tháng tới.
-        
-#         Dữ liệu đầu vào (JSON):
-#         {json.dumps(ai_input, ensure_ascii=False)}
-
-#         Yêu cầu trả về JSON theo schema:
-#         - summary: Nhận định chung về xu hướng tiêu thụ (Tiếng Việt).
-#         - forecasts: Danh sách dự báo cho từng sản phẩm:
-#             + predictedSalesNextMonth: Dự đoán số lượng sẽ bán tháng tới (Dựa trên sales_last_30_days, có thể tăng nhẹ theo xu hướng).
-#             + restockSuggestion: Số lượng CẦN NHẬP THÊM (Công thức gợi ý: Dự đoán - Tồn kho hiện tại + Mức an toàn. Nếu âm thì ghi 0).
-#             + analysis: Giải thích ngắn gọn tại sao (Tiếng Việt).
-#         """
-
-#         # 4. GỌI GEMINI 2.5 FLASH (Hoặc 1.5 Flash)
-#         model = genai.GenerativeModel(
-#             model_name="gemini-2.5-flash", 
-#             generation_config={
-#                 "response_mime_type": "application/json",
-#                 "response_schema": ForecastResult,
-#             }
-#         )
-
-#         response = await model.generate_content_async(prompt)
-#         return ForecastResult.model_validate_json(response.text)
-
-#     except Exception as e:
-#         print(f"🔥 Forecast Error: {e}")
-#         return None
-async def ask_gemini_service(question: str, products: List[Product], transactions: List[Transaction]) -> str:
-    if not GOOGLE_API_KEY:
+
+async def forecast_narrative_service(result: ForecastResult) -> Optional[str]:
+    """
+    Nhận định bằng lời cho kết quả dự báo (số liệu do forecast_service tính trong máy, AI chỉ viết nhận xét)
+    """
+    if not GOOGLE_API_KEY and not AI_FAKE_MODEL:
+        return None
+
+    async def produce():
+        top = [
+            {"product": f.productName, "current_stock": f.currentStock, "sales_last_30_days": f.salesLast30Days,
+             "predicted_next_30_days": f.predictedSalesNextMonth, "restock": f.restockSuggestion}
+            for f in result.forecasts[:20]
+        ]
+        prompt = f"""
+        Bạn là chuyên gia phân tích chuỗi cung ứng. Dưới đây là kết quả dự báo nhu cầu 30 ngày tới
+        (đã tính sẵn, KHÔNG tính lại số liệu):
+        {result.summary}
+        Các sản phẩm cần chú ý nhất (JSON):
+        {json.dumps(top, ensure_ascii=False)}
+
+        Hãy viết nhận định chung về xu hướng tiêu thụ và ưu tiên nhập hàng (Tiếng Việt, tối đa 5 câu).
+        """
+        _stats["promptTokens"] += estimate_tokens(prompt)
+        try:
+            response = await _model().generate_content_async(prompt)
+            return response.text
+        except Exception as e:
+            print(f"🔥 Forecast Error: {e}")
+            return None
+
+    key = f"forecast:{result.generatedAt}:{result.leadTimeDays}:{result.serviceLevel}"
+    return await _cached(key, produce)
+
+async def ask_gemini_service(question: str) -> str:
+    if not GOOGLE_API_KEY and not AI_FAKE_MODEL:
         return "Chưa cấu hình API Key."
 
+    # Cùng câu hỏi + kho và giao dịch không đổi -> dùng lại câu trả lời
+    latest = await Transaction.get_pymongo_collection().find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    key = "chat:" + hashlib.sha256(json.dumps(
+        [" ".join(question.lower().split()), await inventory_fingerprint(), str(latest and latest["_id"])]
+    ).encode()).hexdigest()[:24]
+
+    async def produce():
+        products = await _load_products()
+        # Chỉ lấy 50 giao dịch gần nhất (không tải toàn bộ collection)
+        transactions = await Transaction.find_all().sort("-date").limit(CHAT_TRANSACTIONS).to_list()
+        return await _ask(question, products, transactions)
+
+    answer = await _cached(key, produce)
+    return answer or "Xin lỗi, tôi đang gặp sự cố khi suy nghĩ câu trả lời."
+
+
+async def _ask(question: str, products: List[dict], transactions: List[Transaction]) -> Optional[str]:
     try:
         # 1. Chuẩn bị dữ liệu ngữ cảnh (Context)
-        # Rút gọn dữ liệu để tiết kiệm token, nhưng Gemini 1.5/2.5 Flash xử lý tốt lượng lớn data.
-        
-        # Data Sản phẩm (Chỉ lấy tên, tồn kho, giá)
-        prod_context = [
-            f"{p.name} (Tồn: {p.quantity}, Giá: {p.price})" 
-            for p in products
-        ]
-        
         # Data Giao dịch (Lấy 50 giao dịch gần nhất để phân tích xu hướng ngắn hạn)
         trans_context = [
             f"{t.date.strftime('%Y-%m-%d')}: {t.type} {t.quantity} cái {t.productName} ({t.partner or 'N/A'})"
-            for t in transactions[:50] 
+            for t in transactions
         ]
 
+        # Data Sản phẩm: phần ngân sách token còn lại sau giao dịch
+        trans_tokens = estimate_tokens(json.dumps(trans_context, ensure_ascii=False))
+        prod_context = budget_products(products, max(AI_PROMPT_TOKENS - trans_tokens, AI_PROMPT_TOKENS // 4))
+
         # 2. Tạo Prompt
         prompt = f"""
         Bạn là trợ lý ảo của hệ thống quản lý kho CÔNG NGHỆ (Laptop, Điện thoại) SmartWMS .
         Dưới đây là dữ liệu hiện tại của kho hàng:
-        
+
         --- DANH SÁCH SẢN PHẨM ---
         {json.dumps(prod_context, ensure_ascii=False)}
-        
+
         --- LỊCH SỬ GIAO DỊCH GẦN ĐÂY ---
         {json.dumps(trans_context, ensure_ascii=False)}
-        
+
         --- CÂU HỎI CỦA NGƯỜI DÙNG ---
         "{question}"
-        
+
         --- YÊU CẦU ---
-        Hãy trả lời câu hỏi trên dựa vào dữ liệu đã cung cấp. 
+        Hãy trả lời câu hỏi trên dựa vào dữ liệu đã cung cấp.
         - Trả lời ngắn gọn, súc tích bằng tiếng Việt.
         - Nếu câu hỏi liên quan đến tính toán (tổng tiền, tổng số lượng), hãy tính toán chính xác.
         - Nếu không tìm thấy thông tin trong dữ liệu, hãy nói "Tôi không tìm thấy thông tin này trong dữ liệu hiện tại".
         - Giọng điệu chuyên nghiệp, thân thiện.
         """
+        _stats["promptTokens"] += estimate_tokens(prompt)
 
         # 3. Gọi Model
-        model = genai.GenerativeModel("gemini-2.5-flash") # Hoặc 1.5-flash
+        model = _model()
         response = await model.generate_content_async(prompt)
-        
+
         return response.text
 
     except Exception as e:
         print(f"🔥 Chat Error: {e}")
-        return "Xin lỗi, tôi đang gặp sự cố khi suy nghĩ câu trả lời."
\ No newline at end of file
+        # Trả None để câu trả lời lỗi không bị cache
+        return None
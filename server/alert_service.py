@@ -0,0 +1,236 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from beanie import PydanticObjectId
+from bson.errors import InvalidId
+from pydantic import BaseModel
+
+import shutdown_service
+from models import Product
+
+# Theo dõi hàng sắp hết (quantity <= minStock) tăng dần, không quét lại toàn bộ sản phẩm:
+# - Khởi động: quét 1 lần để dựng tập hàng sắp hết trong bộ nhớ
+# - Mỗi lần nhập/xuất/kiểm kê/sửa sản phẩm chỉ xét lại các sản phẩm vừa đổi
+# - /api/alerts/low-stock đọc thẳng từ bộ nhớ (O(số cảnh báo))
+# - Thay đổi được đẩy tới dashboard qua Server-Sent Events (/api/alerts/low-stock/stream)
+# - Định kỳ (ALERT_RESYNC_INTERVAL giây) đối chiếu lại với DB để bắt các thay đổi
+#   từ script chạy tay hoặc tiến trình server khác
+# Phiên bản của sản phẩm là lastUpdated: bản đọc cũ hơn bản đã xét thì bỏ qua (tránh ghi đè khi chạy song song).
+
+ALERT_RESYNC_INTERVAL = float(os.getenv("ALERT_RESYNC_INTERVAL", "300"))
+ALERT_HEARTBEAT = float(os.getenv("ALERT_HEARTBEAT", "15"))
+ALERT_SUBSCRIBER_QUEUE = 100
+
+_PROJECTION = {"name": 1, "sku": 1, "category": 1, "quantity": 1, "minStock": 1, "lastUpdated": 1}
+_LOW_FILTER = {"$expr": {"$lte": ["$quantity", "$minStock"]}}
+
+
+class LowStockAlert(BaseModel):
+    productId: str
+    name: str
+    sku: str
+    category: str
+    quantity: int
+    minStock: int
+    shortage: int  # Số lượng còn thiếu để đạt minStock
+    since: datetime  # Thời điểm bắt đầu rơi xuống dưới minStock
+
+
+class _Subscriber:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=ALERT_SUBSCRIBER_QUEUE)
+        self.resync = False  # Hàng đợi bị tràn -> gửi lại toàn bộ danh sách thay vì từng thay đổi
+
+
+_low: Dict[str, LowStockAlert] = {}
+_versions: Dict[str, datetime] = {}
+_subscribers: Set[_Subscriber] = set()
+_resync_task: Optional[asyncio.Task] = None
+
+
+def _row(product: Product) -> dict:
+    return {
+        "_id": product.id, "name": product.name, "sku": product.sku, "category": product.category,
+        "quantity": product.quantity, "minStock": product.minStock, "lastUpdated": product.lastUpdated,
+    }
+
+
+def _category(value) -> str:
+    return value.value if hasattr(value, "value") else str(value)
+
+
+def _publish(event: str, data):
+    for sub in _subscribers:
+        if sub.resync:
+            continue
+        try:
+            sub.queue.put_nowait((event, data))
+        except asyncio.QueueFull:
+            sub.resync = True
+
+
+def _apply(doc: dict):
+    """
+    Xét lại 1 sản phẩm (dict từ MongoDB) và phát sự kiện nếu trạng thái cảnh báo thay đổi
+    """
+    pid = str(doc["_id"])
+    version = doc.get("lastUpdated")
+    if version is not None:
+        if pid in _versions and version < _versions[pid]:
+            return
+        _versions[pid] = version
+
+    quantity, min_stock = doc.get("quantity", 0), doc.get("minStock", 0)
+    current = _low.get(pid)
+    if quantity > min_stock:
+        if current:
+            _low.pop(pid)
+            _publish("resolved", {"productId": pid})
+        return
+
+    alert = LowStockAlert(
+        productId=pid, name=doc.get("name", ""), sku=doc.get("sku", ""), category=_category(doc.get("category", "")),
+        quantity=quantity, minStock=min_stock, shortage=min_stock - quantity,
+        since=current.since if current else datetime.now(),
+    )
+    if alert != current:
+        _low[pid] = alert
+        _publish("low" if current is None else "update", alert.model_dump(mode="json"))
+
+
+def track(products: Iterable[Product]):
+    """
+    Cập nhật theo các sản phẩm vừa ghi (bản mới nhất trả về từ lệnh update)
+    """
+    for product in products:
+        if product is not None and product.id is not None:
+            _apply(_row(product))
+
+
+async def refresh(product_ids: Iterable[str]):
+    """
+    Đọc lại các sản phẩm vừa đổi từ DB (khi không có sẵn bản mới nhất) rồi cập nhật
+    """
+    ids = {str(pid) for pid in product_ids}
+    oids = []
+    for pid in ids:
+        try:
+            oids.append(PydanticObjectId(pid))
+        except (InvalidId, TypeError):
+            pass
+    if not oids:
+        return
+    docs = await Product.get_pymongo_collection().find({"_id": {"$in": oids}}, _PROJECTION).to_list()
+    for doc in docs:
+        _apply(doc)
+    for pid in ids - {str(d["_id"]) for d in docs}:
+        remove(pid)
+
+
+def remove(product_id: str):
+    """
+    Sản phẩm đã bị xóa
+    """
+    _versions.pop(product_id, None)
+    if _low.pop(product_id, None):
+        _publish("resolved", {"productId": product_id})
+
+
+def list_alerts() -> List[LowStockAlert]:
+    # Thiếu nhiều nhất lên đầu
+    return sorted(_low.values(), key=lambda a: (-a.shortage, a.name))
+
+
+async def load():
+    """
+    Dựng lại tập hàng sắp hết từ DB (khởi động + đối chiếu định kỳ)
+    """
+    started = datetime.now()
+    docs = await Product.get_pymongo_collection().find(_LOW_FILTER, _PROJECTION).to_list()
+    found = set()
+    for doc in docs:
+        found.add(str(doc["_id"]))
+        _apply(doc)
+    # Không còn sắp hết (hoặc đã bị xóa) -> bỏ, trừ khi vừa được ghi nhận sau lúc bắt đầu quét
+    for pid in [pid for pid in _low if pid not in found]:
+        if _versions.get(pid, started) <= started:
+            _low.pop(pid)
+            _publish("resolved", {"productId": pid})
+
+
+async def _resync_loop():
+    while True:
+        await asyncio.sleep(ALERT_RESYNC_INTERVAL)
+        try:
+            await load()
+        except Exception as e:
+            print(f"⚠️  Không đối chiếu được cảnh báo tồn kho: {e}")
+
+
+async def start_tracker():
+    global _resync_task
+    await load()
+    print(f"🔔 Theo dõi tồn kho thấp: {len(_low)} sản phẩm dưới mức tối thiểu")
+    if ALERT_RESYNC_INTERVAL > 0:
+        _resync_task = asyncio.create_task(_resync_loop())
+
+
+async def stop_tracker():
+    global _resync_task
+    if _resync_task:
+        _resync_task.cancel()
+        _resync_task = None
+    close_streams()
+
+
+def close_streams():
+    # Đóng các kết nối SSE đang mở (gọi ngay khi server nhận tín hiệu tắt, xem shutdown_service)
+    for sub in list(_subscribers):
+        sub.resync = False
+        while sub.queue.full():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _snapshot() -> str:
+    return _sse("snapshot", [a.model_dump(mode="json") for a in list_alerts()])
+
+
+async def stream() -> AsyncIterator[str]:
+    """
+    Luồng SSE: gửi toàn bộ danh sách khi mới kết nối, sau đó chỉ gửi thay đổi
+    (low / update / resolved). Client chậm làm tràn hàng đợi thì nhận lại snapshot.
+    """
+    if shutdown_service.stopping():
+        return
+    sub = _Subscriber()
+    _subscribers.add(sub)
+    try:
+        yield _snapshot()
+        while True:
+            if sub.resync:
+                sub.queue = asyncio.Queue(maxsize=ALERT_SUBSCRIBER_QUEUE)
+                sub.resync = False
+                yield _snapshot()
+            try:
+                item = await asyncio.wait_for(sub.queue.get(), timeout=ALERT_HEARTBEAT)
+            except asyncio.TimeoutError:
+                # Giữ kết nối qua proxy
+                yield ": ping\n\n"
+                continue
+            if item is None:
+                return
+            yield _sse(*item)
+    finally:
+        _subscribers.discard(sub)
+
+
+def get_stats() -> dict:
+    return {"lowStock": len(_low), "tracked": len(_versions), "subscribers": len(_subscribers)}
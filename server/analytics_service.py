@@ -0,0 +1,273 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+import mongo_service
+from models import DailyStat, Product, Transaction, TransactionType
+from stats_service import day_key
+
+# Báo cáo nhập/xuất theo kỳ bất kỳ, gộp theo ngày/tuần/tháng và theo sản phẩm/thương hiệu/danh mục/đối tác,
+# có so sánh với kỳ trước. Phần gộp chạy trong MongoDB, Python chỉ ghép kết quả đã gộp:
+# - Sản phẩm / thương hiệu / danh mục: đọc daily_stats (đã gộp theo ngày x sản phẩm x loại lúc ghi)
+#   -> $group theo (kỳ, sản phẩm, loại); thương hiệu / danh mục tra từ sản phẩm (O(số sản phẩm))
+# - Đối tác: daily_stats không có đối tác -> $group thẳng trên transactions theo (kỳ, đối tác, loại), đi theo index date
+# Phiếu điều chỉnh kiểm kê không tính vào nhập/xuất (giống Dashboard). Đọc theo read preference của báo cáo.
+
+MAX_DAYS = 3660
+MAX_GROUPS = 100
+
+
+class Granularity(str, Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
+
+class GroupBy(str, Enum):
+    PRODUCT = "product"
+    BRAND = "brand"
+    CATEGORY = "category"
+    PARTNER = "partner"
+
+
+class Compare(str, Enum):
+    PREVIOUS = "previous"  # Kỳ liền trước, cùng số ngày
+    YEAR = "year"          # Cùng kỳ năm trước
+
+
+class AnalyticsTotals(BaseModel):
+    importQuantity: int = 0
+    exportQuantity: int = 0
+    importCount: int = 0
+    exportCount: int = 0
+    importCost: float = 0   # Giá trị nhập kho (giá vốn)
+    exportCost: float = 0   # Giá vốn hàng xuất
+
+
+class AnalyticsPoint(AnalyticsTotals):
+    bucket: str
+
+
+class AnalyticsSeries(BaseModel):
+    key: str
+    label: str
+    totals: AnalyticsTotals
+    previous: Optional[AnalyticsTotals] = None
+    exportChange: Optional[float] = None  # % thay đổi số lượng xuất so với kỳ so sánh (None = kỳ trước bằng 0)
+    points: List[AnalyticsPoint] = []
+
+
+class AnalyticsReport(BaseModel):
+    date_from: datetime
+    date_to: datetime
+    granularity: Granularity
+    group_by: Optional[GroupBy] = None
+    compare_from: Optional[datetime] = None
+    compare_to: Optional[datetime] = None
+    buckets: List[str]
+    totals: AnalyticsTotals
+    previous: Optional[AnalyticsTotals] = None
+    series: List[AnalyticsSeries]
+
+
+# Khóa gộp: (kỳ, nhóm) -> [nhập SL, xuất SL, số phiếu nhập, số phiếu xuất, giá trị nhập, giá vốn xuất]
+_Rows = Dict[Tuple[str, str], List[float]]
+
+
+def bucket_of(day: datetime, granularity: Granularity) -> str:
+    if granularity == Granularity.MONTH:
+        return day.strftime("%Y-%m")
+    if granularity == Granularity.WEEK:
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    return day_key(day)
+
+
+def _buckets(start: datetime, end: datetime, granularity: Granularity) -> List[str]:
+    labels, day = [], start
+    while day <= end:
+        label = bucket_of(day, granularity)
+        if not labels or labels[-1] != label:
+            labels.append(label)
+        day += timedelta(days=1)
+    return labels
+
+
+def _bucket_expr(granularity: Granularity, date_expr) -> dict:
+    # date_expr: biểu thức ngày kiểu Date trong pipeline
+    fmt = {Granularity.DAY: "%Y-%m-%d", Granularity.WEEK: "%G-W%V", Granularity.MONTH: "%Y-%m"}[granularity]
+    return {"$dateToString": {"format": fmt, "date": date_expr}}
+
+
+def _add(rows: _Rows, bucket: str, key: str, type: str, quantity: int, count: int, cost: float):
+    row = rows.setdefault((bucket, key), [0, 0, 0, 0, 0.0, 0.0])
+    offset = 0 if type == TransactionType.IMPORT.value else 1
+    row[offset] += quantity
+    row[2 + offset] += count
+    row[4 + offset] += cost or 0
+
+
+async def _product_rows(start: datetime, end: datetime, granularity: Granularity, group_by: Optional[GroupBy]) -> Tuple[_Rows, Dict[str, str]]:
+    """
+    Gộp daily_stats theo (kỳ, sản phẩm, loại) trong MongoDB, rồi theo thương hiệu / danh mục nếu cần
+    """
+    per_product = group_by is not None
+    if granularity == Granularity.DAY:
+        bucket = "$day"
+    elif granularity == Granularity.MONTH:
+        bucket = {"$substrBytes": ["$day", 0, 7]}
+    else:
+        bucket = _bucket_expr(granularity, {"$dateFromString": {"dateString": "$day", "format": "%Y-%m-%d"}})
+    group_id = {"bucket": bucket, "type": "$type"}
+    if per_product:
+        group_id["productId"] = "$productId"
+
+    cursor = await mongo_service.reports(DailyStat).aggregate([
+        {"$match": {"day": {"$gte": day_key(start), "$lte": day_key(end)}}},
+        {"$group": {
+            "_id": group_id,
+            "productName": {"$last": "$productName"},
+            "quantity": {"$sum": "$quantity"},
+            "count": {"$sum": "$transactionCount"},
+            "cost": {"$sum": {"$ifNull": ["$cost", 0]}},
+        }},
+    ])
+    raw = await cursor.to_list()
+
+    labels: Dict[str, str] = {}
+    attribute = {}
+    if group_by in (GroupBy.BRAND, GroupBy.CATEGORY):
+        field = group_by.value
+        docs = await mongo_service.reports(Product).find({}, {field: 1}).to_list()
+        attribute = {str(d["_id"]): d.get(field) or "" for d in docs}
+
+    rows: _Rows = {}
+    for r in raw:
+        key = ""
+        if group_by == GroupBy.PRODUCT:
+            key = r["_id"]["productId"]
+            labels[key] = r.get("productName") or key
+        elif group_by in (GroupBy.BRAND, GroupBy.CATEGORY):
+            key = attribute.get(r["_id"]["productId"], "")
+            labels[key] = key or ("Không có thương hiệu" if group_by == GroupBy.BRAND else "Không rõ")
+        _add(rows, r["_id"]["bucket"], key, r["_id"]["type"], r["quantity"], r["count"], r["cost"])
+    return rows, labels
+
+
+async def _partner_rows(start: datetime, end: datetime, granularity: Granularity) -> Tuple[_Rows, Dict[str, str]]:
+    cursor = await mongo_service.reports(Transaction).aggregate([
+        {"$match": {"date": {"$gte": start, "$lt": end + timedelta(days=1)}, "stocktakeId": None}},
+        {"$group": {
+            "_id": {"bucket": _bucket_expr(granularity, "$date"), "partner": "$partner", "type": "$type"},
+            "quantity": {"$sum": "$quantity"},
+            "count": {"$sum": 1},
+            "cost": {"$sum": {"$ifNull": ["$costAmount", 0]}},
+        }},
+    ])
+    rows: _Rows = {}
+    labels: Dict[str, str] = {}
+    async for r in cursor:
+        key = r["_id"].get("partner") or ""
+        labels[key] = key or "Không rõ"
+        _add(rows, r["_id"]["bucket"], key, r["_id"]["type"], r["quantity"], r["count"], r["cost"])
+    return rows, labels
+
+
+async def _collect(start: datetime, end: datetime, granularity: Granularity, group_by: Optional[GroupBy]):
+    if group_by == GroupBy.PARTNER:
+        return await _partner_rows(start, end, granularity)
+    return await _product_rows(start, end, granularity, group_by)
+
+
+def _totals(values: List[float]) -> AnalyticsTotals:
+    return AnalyticsTotals(
+        importQuantity=values[0], exportQuantity=values[1], importCount=values[2], exportCount=values[3],
+        importCost=round(values[4], 2), exportCost=round(values[5], 2),
+    )
+
+
+def _sum_by_key(rows: _Rows) -> Dict[str, List[float]]:
+    sums: Dict[str, List[float]] = defaultdict(lambda: [0, 0, 0, 0, 0.0, 0.0])
+    for (_, key), values in rows.items():
+        total = sums[key]
+        for i, v in enumerate(values):
+            total[i] += v
+    return sums
+
+
+def _overall(sums: Dict[str, List[float]]) -> List[float]:
+    return [sum(v[i] for v in sums.values()) for i in range(6)]
+
+
+def _compare_range(start: datetime, end: datetime, compare: Compare) -> Tuple[datetime, datetime]:
+    if compare == Compare.PREVIOUS:
+        length = end - start + timedelta(days=1)
+        return start - length, start - timedelta(days=1)
+
+    def last_year(day: datetime) -> datetime:
+        try:
+            return day.replace(year=day.year - 1)
+        except ValueError:  # 29/02
+            return day.replace(year=day.year - 1, day=28)
+    return last_year(start), last_year(end)
+
+
+async def analytics(
+    date_from: datetime,
+    date_to: datetime,
+    granularity: Granularity = Granularity.DAY,
+    group_by: Optional[GroupBy] = None,
+    compare: Optional[Compare] = None,
+    limit: int = 10,
+) -> AnalyticsReport:
+    """
+    Nhập/xuất trong [date_from, date_to] (theo ngày, gồm cả 2 đầu), gộp theo kỳ + nhóm, kèm kỳ so sánh.
+    Chỉ giữ `limit` nhóm xuất nhiều nhất; totals tính trên tất cả các nhóm.
+    """
+    start = date_from.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = date_to.replace(hour=0, minute=0, second=0, microsecond=0)
+    if end < start:
+        raise HTTPException(status_code=400, detail="date_to phải sau date_from")
+    if (end - start).days + 1 > MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Khoảng thời gian tối đa {MAX_DAYS} ngày")
+    limit = max(1, min(limit, MAX_GROUPS))
+
+    rows, labels = await _collect(start, end, granularity, group_by)
+    sums = _sum_by_key(rows)
+
+    previous_sums, compare_from, compare_to = None, None, None
+    if compare:
+        compare_from, compare_to = _compare_range(start, end, compare)
+        previous_rows, previous_labels = await _collect(compare_from, compare_to, Granularity.MONTH, group_by)
+        previous_sums = _sum_by_key(previous_rows)
+        for key, label in previous_labels.items():
+            labels.setdefault(key, label)
+
+    buckets = _buckets(start, end, granularity)
+    if group_by is None:
+        keys = [""]  # 1 chuỗi "Tổng" kể cả khi không có dữ liệu
+    else:
+        keys = sorted(sums, key=lambda k: (-sums[k][1], -sums[k][0], labels.get(k, k)))[:limit]
+    series = []
+    for key in keys:
+        points = [AnalyticsPoint(bucket=b, **_totals(rows.get((b, key), [0, 0, 0, 0, 0.0, 0.0])).model_dump())
+                  for b in buckets]
+        item = AnalyticsSeries(key=key, label=labels.get(key, key) if group_by else "Tổng",
+                               totals=_totals(sums.get(key, [0, 0, 0, 0, 0.0, 0.0])), points=points)
+        if previous_sums is not None:
+            before = previous_sums.get(key, [0, 0, 0, 0, 0.0, 0.0])
+            item.previous = _totals(before)
+            item.exportChange = round((sums[key][1] - before[1]) * 100 / before[1], 1) if before[1] else None
+        series.append(item)
+
+    return AnalyticsReport(
+        date_from=start, date_to=end, granularity=granularity, group_by=group_by,
+        compare_from=compare_from, compare_to=compare_to, buckets=buckets,
+        totals=_totals(_overall(sums)),
+        previous=_totals(_overall(previous_sums)) if previous_sums is not None else None,
+        series=series,
+    )
@@ -1,50 +1,92 @@
 import os
-import io
 from bson import ObjectId
 from datetime import datetime, timedelta
 from typing import List, Optional
 from contextlib import asynccontextmanager
 
 # Third-party imports
-import motor.motor_asyncio
-import pandas as pd
-from fastapi import FastAPI, HTTPException, Depends, status, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, status, BackgroundTasks, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse 
+from fastapi.responses import StreamingResponse, FileResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from beanie import init_beanie, PydanticObjectId
+from beanie import init_beanie, PydanticObjectId, UpdateResponse
+from pymongo import AsyncMongoClient
+from pymongo.errors import DuplicateKeyError
 from pydantic import BaseModel, EmailStr
 from dotenv import load_dotenv
 
 # --- Import Models & Logic ---
 # Đảm bảo các file models.py, auth.py, log_service.py, ai_service.py nằm cùng thư mục
-from auth import get_password_hash, verify_password, create_access_token, get_current_user
-from log_service import create_log
+import auth
+from auth import get_password_hash_async, verify_password_async, create_access_token, get_current_user, get_token_user, invalidate_user
+import log_service
+from log_service import create_log, create_logs
+import ai_service
 from ai_service import analyze_inventory_service, ask_gemini_service
+import stats_service
+import query_service
+import index_service
+import shutdown_service
+import serial_service
+import stock_service
+import export_service
+import report_service
+import slotting_service
+import forecast_service
+import alert_service
+import feed_service
+import trace_service
+import search_service
+import cache_service
+import ledger_service
+import cost_service
+import analytics_service
+import mongo_service
+from slotting_service import SlottingApply, SlottingConfig, SlottingPlan
+from report_service import ReportJob, ReportKind
+from alert_service import LowStockAlert
+from trace_service import SerialTrace, TraceEvent
+from search_service import SearchHit
+from ledger_service import InventoryAsOf
+from cost_service import ValuationReport
+from analytics_service import AnalyticsReport, Compare, Granularity, GroupBy
+import stocktake_service
 
 from models import (
     User,
     Role,
     SystemLog,
     Product, 
+    Category,
+    SerialUnit,
     Transaction, 
     StocktakeSession, 
+    StocktakeItem,
     TransactionType, 
     StocktakeStatus,
     MovementLog, 
     AIAnalysisResult,
+    ForecastResult,
     Partner,
+    PartnerType,
     WarrantyTicket,
     WarrantyStatus,
-    Brand
+    Brand,
+    DailyStat,
+    StatCounter,
+    StockLedgerEntry,
+    StockSnapshot,
+    CostLayer,
+    ProductCost
 )
 
 # Load biến môi trường
 load_dotenv()
 
 # --- Cấu hình Database ---
-MONGO_URL = "mongodb://localhost:27017"
-DB_NAME = "warehouse"
+# URL, pool, timeout: xem mongo_service (MONGO_URL, MONGO_MAX_POOL_SIZE, ...)
+MONGO_URL = mongo_service.MONGO_URL
+DB_NAME = os.getenv("DB_NAME", "warehouse")
 
 # ==========================================
 # 👇 SCHEMAS (Khai báo ở đầu để tránh lỗi NameError)
@@ -67,6 +109,42 @@ class UserUpdate(BaseModel):
     role: Optional[str] = None
     password: Optional[str] = None
 
+# Schema tạo/sửa Sản phẩm: IMEI được lưu sang collection serial_units, Product chỉ giữ imeiCount
+class ProductCreate(BaseModel):
+    name: str
+    sku: str
+    category: Category
+    brand: Optional[str] = None
+    quantity: int = 0
+    minStock: int = 0
+    price: float = 0.0
+    location: str
+    imeis: Optional[List[str]] = None # None = không thay đổi danh sách IMEI
+
+# Schema phiếu nhập/xuất nhiều dòng (1 phiếu = nhiều sản phẩm / IMEI)
+class TransactionBatch(BaseModel):
+    partner: Optional[str] = None
+    notes: Optional[str] = None
+    transactions: List[Transaction]
+
+# Schema cập nhật từng phần phiếu kiểm kê nháp
+class StocktakePatch(BaseModel):
+    items: List[StocktakeItem] = []
+    remove: List[str] = [] # productId cần bỏ khỏi phiếu
+
+# Schema tạo job báo cáo chạy nền (tham số không dùng cho loại báo cáo sẽ bị bỏ qua)
+class ReportJobRequest(BaseModel):
+    kind: ReportKind
+    format: str = "xlsx" # xlsx | csv
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    type: Optional[TransactionType] = None
+    category: Optional[Category] = None
+
+# Schema truy vết nhiều IMEI cùng lúc
+class TraceBulkRequest(BaseModel):
+    imeis: List[str]
+
 # 👇 ĐÂY LÀ CLASS BẠN ĐANG THIẾU 👇
 class ChangePasswordSchema(BaseModel):
     current_password: str
@@ -74,22 +152,58 @@ class ChangePasswordSchema(BaseModel):
 
 # ==========================================
 
+# --- KẾT NỐI DATABASE ---
+DOCUMENT_MODELS = [
+    User, Product, Transaction, StocktakeSession, MovementLog, SystemLog, Partner, WarrantyTicket, Brand,
+    DailyStat, StatCounter, SerialUnit, StockLedgerEntry, StockSnapshot,
+    CostLayer, ProductCost
+]
+
+# Dùng chung cho Server và các script chạy tay (VD: python stats_service.py)
+# Beanie 2.x làm việc với AsyncMongoClient của pymongo (cursor của motor không await được khi aggregate)
+async def connect_database(db_name: str = DB_NAME) -> AsyncMongoClient:
+    client = AsyncMongoClient(MONGO_URL, **mongo_service.client_options())
+    database = client[db_name]
+
+    # Dữ liệu cũ có thể còn giá trị trùng (email, SKU, username...) -> xử lý trước khi Beanie tạo index unique
+    await index_service.dedupe_user_emails(database)
+    await index_service.check_unique_indexes(database, DOCUMENT_MODELS)
+    await init_beanie(database=database, document_models=DOCUMENT_MODELS)
+    return client
+
 # --- LIFESPAN (Vòng đời ứng dụng) ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("🚀 Đang khởi động Server...")
-    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
-    database = client[DB_NAME]
-    
-    await init_beanie(
-        database=database,
-        document_models=[
-            User, Product, Transaction, StocktakeSession, MovementLog, SystemLog, Partner, WarrantyTicket, Brand
-        ]
-    )
+    client = await connect_database()
     print(f"✅ Đã kết nối thành công đến MongoDB: {DB_NAME}")
+
+    # Báo cáo các truy vấn còn COLLSCAN (index được Beanie tạo từ Settings.indexes)
+    try:
+        await index_service.print_index_report()
+    except Exception as e:
+        print(f"⚠️  Không kiểm tra được index: {e}")
+
+    # Nhật ký hệ thống ghi nền theo lô
+    await log_service.start_writer()
+    # Worker tạo báo cáo chạy nền
+    await report_service.start_workers()
+    # Tập hàng sắp hết trong bộ nhớ (cập nhật theo từng giao dịch)
+    await alert_service.start_tracker()
+    # Uvicorn chỉ chạy phần shutdown bên dưới khi mọi response đã đóng -> đóng các luồng SSE ngay khi nhận tín hiệu
+    shutdown_service.on_signal(alert_service.close_streams)
+    shutdown_service.on_signal(feed_service.close_all)
+    shutdown_service.install()
+    # Chốt tồn kho định kỳ (sổ kho, tồn kho tại thời điểm bất kỳ)
+    await ledger_service.start_snapshots()
     yield
     print("🛑 Server đang tắt...")
+    await ledger_service.stop_snapshots()
+    shutdown_service.trigger()
+    await alert_service.stop_tracker()
+    await report_service.stop_workers()
+    await log_service.stop_writer()
+    await client.close()
 
 # --- Khởi tạo App ---
 app = FastAPI(lifespan=lifespan)
@@ -101,90 +215,164 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[query_service.NEXT_CURSOR_HEADER, "ETag"],
 )
 
 # ================= DASHBOARD STATS API (MỚI) =================
 @app.get("/api/reports/dashboard-stats")
-async def get_dashboard_stats():
-    # 1. Lấy dữ liệu thô từ DB
-    products = await Product.find_all().to_list()
-    transactions = await Transaction.find_all().to_list()
-    
-    # Nếu chưa có dữ liệu thì trả về rỗng để không lỗi Frontend
-    if not products:
-        return {
-            "categoryData": [],
-            "trendData": [],
-            "topProducts": []
-        }
-
-    # --- A. BIỂU ĐỒ TRÒN (Pie): Tỷ lệ tồn kho theo Danh mục ---
-    cat_stats = {}
-    for p in products:
-        # Lấy giá trị chuỗi của Enum hoặc string
-        cat = p.category.value if hasattr(p.category, 'value') else str(p.category)
-        cat_stats[cat] = cat_stats.get(cat, 0) + p.quantity
-    
-    category_data = [{"name": k, "value": v} for k, v in cat_stats.items()]
+async def get_dashboard_stats(request: Request):
+    # Đọc từ bảng thống kê cộng dồn (daily_stats, stat_counters) thay vì quét toàn bộ Transaction
+    return await cache_service.cached(request, [cache_service.STATS], stats_service.get_dashboard_stats)
+
+@app.post("/api/reports/dashboard-stats/rebuild")
+async def rebuild_dashboard_stats(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Chỉ Admin mới có quyền tính lại thống kê")
+
+    result = await stats_service.rebuild_stats()
+    cache_service.bump(cache_service.STATS)
+    await create_log(current_user.username, "REBUILD_STATS", "Dashboard", f"Tính lại thống kê: {result}")
+    return result
 
-    # --- B. BIỂU ĐỒ ĐƯỜNG (Area): Xu hướng Nhập/Xuất 7 ngày qua ---
-    trend_data = []
-    today = datetime.now()
-    
-    # Tạo khung dữ liệu cho 7 ngày gần nhất (để biểu đồ luôn đủ 7 cột)
-    for i in range(6, -1, -1):
-        date_obj = today - timedelta(days=i)
-        date_label = date_obj.strftime("%d/%m")
-        trend_data.append({"date": date_label, "import": 0, "export": 0})
+# Phân tích nhập/xuất theo kỳ bất kỳ: gộp theo ngày/tuần/tháng, theo nhóm, so sánh với kỳ trước
+# Mặc định: 30 ngày gần nhất theo ngày
+@app.get("/api/reports/analytics", response_model=AnalyticsReport)
+async def get_analytics(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    granularity: Granularity = Granularity.DAY,
+    group_by: Optional[GroupBy] = None,
+    compare: Optional[Compare] = None,
+    limit: int = Query(10, ge=1, le=analytics_service.MAX_GROUPS),
+):
+    date_to = date_to or datetime.now()
+    date_from = date_from or date_to - timedelta(days=29)
+    return await analytics_service.analytics(date_from, date_to, granularity, group_by, compare, limit)
+
+# ================= CẢNH BÁO TỒN KHO THẤP =================
+# Đọc từ tập hàng sắp hết trong bộ nhớ (alert_service), không quét danh sách sản phẩm
+@app.get("/api/alerts/low-stock", response_model=List[LowStockAlert])
+async def get_low_stock_alerts():
+    return alert_service.list_alerts()
+
+# Server-Sent Events: snapshot khi kết nối, sau đó chỉ đẩy thay đổi (low / update / resolved)
+@app.get("/api/alerts/low-stock/stream")
+async def stream_low_stock_alerts():
+    return StreamingResponse(
+        alert_service.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    # Điền dữ liệu transaction vào khung
-    for t in transactions:
-        # Chỉ tính giao dịch trong vòng 7 ngày qua
-        if (today - t.date).days <= 7:
-            t_date = t.date.strftime("%d/%m")
-            for day in trend_data:
-                if day["date"] == t_date:
-                    if t.type == TransactionType.IMPORT:
-                        day["import"] += t.quantity
-                    elif t.type == TransactionType.EXPORT:
-                        day["export"] += t.quantity
-
-    # --- C. BIỂU ĐỒ CỘT (Bar): Top 5 Sản phẩm bán chạy (Xuất kho nhiều nhất) ---
-    export_counts = {}
-    for t in transactions:
-        if t.type == TransactionType.EXPORT:
-            # Cộng dồn số lượng xuất theo tên sản phẩm
-            export_counts[t.productName] = export_counts.get(t.productName, 0) + t.quantity
-    
-    # Sắp xếp giảm dần và lấy Top 5
-    sorted_products = sorted(export_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-    top_products = [{"name": name, "quantity": qty} for name, qty in sorted_products]
+# ================= SỔ KHO & TỒN KHO TẠI THỜI ĐIỂM =================
+# Tồn kho ngày bất kỳ = lần chốt gần nhất + sổ kho kể từ đó (ledger_service), không phát lại toàn bộ lịch sử
+@app.get("/api/inventory/as-of", response_model=InventoryAsOf)
+async def get_inventory_as_of(date: datetime):
+    return await ledger_service.inventory_as_of(date)
+
+# Sổ kho của 1 sản phẩm / toàn kho (mới nhất trước, phân trang như các danh sách khác)
+@app.get("/api/inventory/ledger", response_model=List[StockLedgerEntry])
+async def get_stock_ledger(
+    response: Response,
+    productId: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    format: str = "json",
+):
+    filters = query_service.combine(
+        {"productId": productId} if productId else {},
+        query_service.date_filter("date", date_from, date_to),
+    )
+    return await query_service.fetch_page(
+        StockLedgerEntry, filters, response, sort_field="date", limit=limit, cursor=cursor, format=format
+    )
 
-    return {
-        "categoryData": category_data,
-        "trendData": trend_data,
-        "topProducts": top_products
-    }
+# Chốt tồn kho ngay (VD: khóa sổ cuối tháng) thay vì chờ lần chốt định kỳ
+@app.post("/api/inventory/snapshots")
+async def create_stock_snapshot(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Chỉ Admin mới có quyền chốt tồn kho")
+
+    result = await ledger_service.take_snapshot()
+    await create_log(current_user.username, "SNAPSHOT", "Toàn kho", f"Chốt tồn kho: {result['products']} sản phẩm")
+    return result
+
+# ================= CHANGE FEED (SSE) =================
+# Client: lấy token trước khi tải danh sách, tải xong thì mở /api/feed?resume=<token> để nhận phần thay đổi
+@app.get("/api/feed/token")
+async def get_feed_token(current_user: User = Depends(get_token_user)):
+    return {"token": feed_service.current_token()}
+
+@app.get("/api/feed/stats")
+async def get_feed_stats(current_user: User = Depends(get_token_user)):
+    return feed_service.get_stats()
+
+# Kiểm tra sống cho load balancer / giám sát: ping MongoDB, pool kết nối, server (503 khi mất kết nối DB)
+@app.get("/api/health")
+async def get_health(response: Response):
+    result = await mongo_service.health(User.get_pymongo_collection().database)
+    if result["status"] != "ok":
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return result
+
+# Độ trễ MongoDB theo collection / lệnh (histogram) + các lệnh chậm gần nhất
+@app.get("/api/health/stats")
+async def get_health_stats(current_user: User = Depends(get_token_user)):
+    return mongo_service.get_stats()
+
+# Tình trạng cache phản hồi: hit / miss / 304, số entry, phiên bản dữ liệu
+@app.get("/api/cache/stats")
+async def get_cache_stats(current_user: User = Depends(get_token_user)):
+    return cache_service.get_stats()
+
+# EventSource không gửi được header Authorization -> nhận token qua query
+@app.get("/api/feed")
+async def stream_feed(request: Request, token: str, topics: Optional[str] = None, resume: Optional[str] = None):
+    await get_current_user(token)
+    selected = set(topics.split(",")) if topics else feed_service.TOPICS
+    if not selected <= feed_service.TOPICS:
+        raise HTTPException(status_code=400, detail=f"Topic không hợp lệ: {', '.join(sorted(selected - feed_service.TOPICS))}")
+
+    # Trình duyệt tự kết nối lại kèm Last-Event-ID (token mới nhất đã nhận) -> ưu tiên hơn resume ban đầu
+    resume = request.headers.get("last-event-id") or resume
+    return StreamingResponse(
+        feed_service.stream(selected, resume),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # ==========================================
 # 1. AUTHENTICATION API
 # ==========================================
 
+async def _save_user(write):
+    # Index unique trên username/email: request song song vượt qua bước kiểm tra vẫn bị chặn ở đây
+    try:
+        await write
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username hoặc email đã được sử dụng")
+
 @app.post("/api/auth/register", response_model=User)
 async def register_user(user_data: User):
     existing = await User.find_one(User.username == user_data.username)
     if existing:
         raise HTTPException(status_code=400, detail="Username đã tồn tại")
+
+    existing_email = await User.find_one(User.email == user_data.email)
+    if existing_email:
+        raise HTTPException(status_code=400, detail="Email này đã được sử dụng")
     
-    user_data.password_hash = get_password_hash(user_data.password_hash)
-    await user_data.create()
+    user_data.password_hash = await get_password_hash_async(user_data.password_hash)
+    await _save_user(user_data.create())
     await create_log("System", "REGISTER", user_data.username, f"Tạo tài khoản mới: {user_data.full_name}")
     return user_data
 
 @app.post("/api/auth/login")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     user = await User.find_one(User.username == form_data.username)
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if not user or not await verify_password_async(form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Sai tài khoản hoặc mật khẩu",
@@ -210,6 +398,13 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 async def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
 
+# Số lần trúng/trượt cache xác thực token
+@app.get("/api/auth/cache-stats")
+async def get_auth_cache_stats(current_user: User = Depends(get_token_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Chỉ Admin mới xem được thống kê xác thực")
+    return auth.get_cache_stats()
+
 # ==========================================
 # 3. PERSONAL PROFILE API (Cài đặt tài khoản)
 # ==========================================
@@ -230,7 +425,8 @@ async def update_own_profile(
     if user_data.email:
         current_user.email = user_data.email
     
-    await current_user.save()
+    await _save_user(current_user.save())
+    invalidate_user(current_user.username)
     return current_user
 
 # Đổi mật khẩu
@@ -239,11 +435,12 @@ async def change_password(
     password_data: ChangePasswordSchema,
     current_user: User = Depends(get_current_user)
 ):
-    if not verify_password(password_data.current_password, current_user.password_hash):
+    if not await verify_password_async(password_data.current_password, current_user.password_hash):
         raise HTTPException(status_code=400, detail="Mật khẩu hiện tại không đúng")
     
-    current_user.password_hash = get_password_hash(password_data.new_password)
+    current_user.password_hash = await get_password_hash_async(password_data.new_password)
     await current_user.save()
+    invalidate_user(current_user.username)
     
     return {"message": "Đổi mật khẩu thành công"}
 
@@ -252,7 +449,7 @@ async def change_password(
 # ==========================================
 
 @app.get("/api/users", response_model=List[User])
-async def get_users(current_user: User = Depends(get_current_user)):
+async def get_users(current_user: User = Depends(get_token_user)):
     # Có thể thêm check if current_user.role != 'admin' raise HTTPException...
     users = await User.find_all().to_list()
     return users
@@ -269,7 +466,7 @@ async def create_user(user_data: UserCreate, current_user: User = Depends(get_cu
         raise HTTPException(status_code=400, detail="Email này đã được sử dụng")
     
     # Tạo User
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     new_user = User(
         username=user_data.username,
         email=user_data.email,
@@ -277,7 +474,7 @@ async def create_user(user_data: UserCreate, current_user: User = Depends(get_cu
         role=user_data.role,
         password_hash=hashed_password
     )
-    await new_user.insert()
+    await _save_user(new_user.insert())
     await create_log(current_user.username, "CREATE_USER", new_user.username, "Admin tạo nhân viên mới")
     return new_user
 
@@ -296,7 +493,7 @@ async def update_user(user_id: PydanticObjectId, user_data: UserUpdate, current_
     
     # Xử lý mật khẩu nếu có
     if "password" in update_data and update_data["password"]:
-        user.password_hash = get_password_hash(update_data.pop("password"))
+        user.password_hash = await get_password_hash_async(update_data.pop("password"))
     elif "password" in update_data:
         del update_data["password"]
 
@@ -305,7 +502,8 @@ async def update_user(user_id: PydanticObjectId, user_data: UserUpdate, current_
     if "email" in update_data: user.email = update_data["email"]
     if "role" in update_data: user.role = update_data["role"]
         
-    await user.save()
+    await _save_user(user.save())
+    invalidate_user(user.username)
     await create_log(current_user.username, "UPDATE_USER", user.username, "Admin cập nhật thông tin")
     return user
 
@@ -325,6 +523,7 @@ async def delete_user(user_id: PydanticObjectId, current_user: User = Depends(ge
     
     username_backup = user.username
     await user.delete()
+    invalidate_user(username_backup)
     await create_log(current_user.username, "DELETE_USER", username_backup, "Admin xóa nhân viên")
     return {"message": "Đã xóa thành công"}
 
@@ -333,8 +532,8 @@ async def delete_user(user_id: PydanticObjectId, current_user: User = Depends(ge
 # ==========================================
 
 @app.get("/api/brands", response_model=List[Brand])
-async def get_brands():
-    return await Brand.find_all().to_list()
+async def get_brands(request: Request):
+    return await cache_service.cached(request, [cache_service.BRANDS], Brand.find_all().to_list)
 
 @app.post("/api/brands", response_model=Brand)
 async def create_brand(brand: Brand):
@@ -342,6 +541,7 @@ async def create_brand(brand: Brand):
     if existing:
         raise HTTPException(status_code=400, detail="Thương hiệu đã tồn tại")
     await brand.create()
+    cache_service.bump(cache_service.BRANDS)
     return brand
 
 @app.put("/api/brands/{id}", response_model=Brand)
@@ -352,6 +552,7 @@ async def update_brand(id: str, data: Brand):
     
     # Cập nhật dữ liệu
     await brand.update({"$set": data.dict(exclude={"id"})})
+    cache_service.bump(cache_service.BRANDS)
     return brand
 
 @app.delete("/api/brands/{id}")
@@ -360,6 +561,7 @@ async def delete_brand(id: str):
     if not brand:
         raise HTTPException(status_code=404, detail="Không tìm thấy thương hiệu")
     await brand.delete()
+    cache_service.bump(cache_service.BRANDS)
     return {"message": "Đã xóa thương hiệu"}
 
 # ==========================================
@@ -367,29 +569,118 @@ async def delete_brand(id: str):
 # ==========================================
 
 @app.get("/api/products", response_model=List[Product])
-async def get_products():
-    return await Product.find_all().to_list()
+async def get_products(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    brand: Optional[str] = None,
+    q: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    format: str = "json",
+):
+    filters = query_service.combine(
+        {"category": category} if category else {},
+        {"brand": brand} if brand else {},
+        query_service.text_filter(q, ["name", "sku", "brand"]),
+    )
+    return await cache_service.cached(request, [cache_service.PRODUCTS], lambda: query_service.fetch_page(
+        Product, filters, response, descending=False, limit=limit, cursor=cursor, format=format
+    ), response)
+
+# Tìm kiếm sản phẩm / đối tác / phiếu bảo hành (không dấu, xếp theo độ khớp)
+@app.get("/api/search", response_model=List[SearchHit])
+async def search(q: str, types: Optional[str] = None, limit: int = Query(search_service.SEARCH_LIMIT, ge=1, le=search_service.SEARCH_MAX_LIMIT)):
+    kinds = types.split(",") if types else None
+    if kinds and not set(kinds) <= set(search_service.SOURCES):
+        raise HTTPException(status_code=400, detail=f"Loại không hợp lệ, chọn trong: {', '.join(search_service.SOURCES)}")
+    return await search_service.search(q, kinds, limit)
+
+async def _validate_new_imeis(imeis: List[str], product_id: Optional[str] = None):
+    duplicates = serial_service.find_duplicates(imeis)
+    if duplicates:
+        raise HTTPException(status_code=400, detail=f"IMEI {duplicates[0]} bị nhập trùng!")
+
+    in_stock = await serial_service.find_in_stock(imeis)
+    if product_id:
+        # Khi sửa sản phẩm, IMEI đang thuộc chính sản phẩm này thì hợp lệ
+        own = set(await serial_service.list_in_stock(product_id))
+        in_stock = [i for i in in_stock if i not in own]
+    if in_stock:
+        raise HTTPException(status_code=400, detail=f"IMEI {in_stock[0]} đã tồn tại trong kho!")
+
+async def _save_product(write):
+    # Index unique trên SKU: 2 request cùng SKU vượt qua bước kiểm tra vẫn bị chặn ở đây
+    try:
+        return await write
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Mã SKU này đã tồn tại")
 
 @app.post("/api/products", response_model=Product)
-async def create_product(product: Product, current_user: User = Depends(get_current_user)):
-    existing = await Product.find_one(Product.sku == product.sku)
+async def create_product(data: ProductCreate, current_user: User = Depends(get_current_user)):
+    existing = await Product.find_one(Product.sku == data.sku)
     if existing:
         raise HTTPException(status_code=400, detail="Mã SKU này đã tồn tại")
-    
-    await product.create()
+
+    imeis = data.imeis or []
+    await _validate_new_imeis(imeis)
+
+    product = Product(**data.dict(exclude={"imeis"}), imeiCount=len(imeis))
+    await _save_product(product.create())
+    await serial_service.receive_units(imeis, product)
+    await stats_service.adjust_category(product.category, product.quantity)
+    await ledger_service.record_products([(product, product.quantity)])
+    await cost_service.record_adjustment(product, product.quantity)
+    alert_service.track([product])
+    await search_service.index_document(Product, product.id, product)
+    feed_service.publish("product", "insert", product.id, product)
+    cache_service.bump(cache_service.PRODUCTS, cache_service.STATS)
     await create_log(current_user.username, "CREATE", product.name, f"Thêm SP mới (SKU: {product.sku})")
     return product
 
 @app.put("/api/products/{id}", response_model=Product)
-async def update_product(id: str, data: Product, current_user: User = Depends(get_current_user)):
+async def update_product(id: str, data: ProductCreate, current_user: User = Depends(get_current_user)):
     product = await Product.get(id)
     if not product:
         raise HTTPException(404, "Không tìm thấy sản phẩm")
+    if data.sku != product.sku and await Product.find_one(Product.sku == data.sku):
+        raise HTTPException(status_code=400, detail="Mã SKU này đã tồn tại")
     
-    update_data = data.dict(exclude={"id"})
+    update_data = data.dict(exclude={"imeis"})
     update_data['lastUpdated'] = datetime.now()
-    
-    await product.update({"$set": update_data})
+    if data.imeis is not None:
+        await _validate_new_imeis(data.imeis, product_id=str(product.id))
+
+    # Chỉ ghi khi tồn kho chưa đổi kể từ lúc đọc (quantity + ledgerSeq): không ghi đè giao dịch chạy song song,
+    # chênh lệch ghi sổ kho / giá vốn đúng bằng phần form sửa
+    old_category, old_quantity = product.category, product.quantity
+    delta = data.quantity - old_quantity
+    update = {"$set": update_data}
+    if delta:
+        update["$inc"] = {"ledgerSeq": 1}
+    updated = await _save_product(Product.find_one(
+        {"_id": product.id, "quantity": old_quantity, "ledgerSeq": stock_service.seq_filter(product)}
+    ).update(update, response_type=UpdateResponse.NEW_DOCUMENT))
+    if updated is None:
+        raise HTTPException(status_code=409, detail="Tồn kho sản phẩm vừa thay đổi, vui lòng tải lại và sửa lại")
+    product = updated
+
+    # Chỉ đồng bộ IMEI khi client gửi danh sách (form sửa sản phẩm)
+    if data.imeis is not None:
+        imei_count = await serial_service.sync_product_units(product, data.imeis)
+        await product.set({Product.imeiCount: imei_count})
+
+    # Đồng bộ tồn kho theo danh mục nếu đổi số lượng / danh mục
+    if data.category != old_category or delta:
+        await stats_service.adjust_category(old_category, -old_quantity)
+        await stats_service.adjust_category(data.category, data.quantity)
+
+    await ledger_service.record_products([(product, delta)])
+    await cost_service.record_adjustment(product, delta)
+    await alert_service.refresh([id])
+    await search_service.index_document(Product, product.id, data)
+    feed_service.publish("product", "update", product.id, product)
+    cache_service.bump(cache_service.PRODUCTS, cache_service.STATS)
     await create_log(current_user.username, "UPDATE", product.name, "Cập nhật thông tin")
     return product
 
@@ -404,250 +695,362 @@ async def delete_product(id: str, current_user: User = Depends(get_current_user)
     
     name_backup = product.name
     await product.delete()
+    await serial_service.delete_product_units(str(product.id))
+    await stats_service.adjust_category(product.category, -product.quantity)
+    await ledger_service.record_products([
+        (product.model_copy(update={"quantity": 0, "ledgerSeq": product.ledgerSeq + 1}), -product.quantity)
+    ])
+    await cost_service.remove(str(product.id))
+    alert_service.remove(str(product.id))
+    feed_service.publish("product", "delete", product.id)
+    cache_service.bump(cache_service.PRODUCTS, cache_service.STATS)
     await create_log(current_user.username, "DELETE", name_backup, "Xóa sản phẩm khỏi hệ thống")
     return {"message": "Đã xóa sản phẩm thành công"}
 
+@app.get("/api/products/{id}/imeis", response_model=List[str])
+async def get_product_imeis(id: str):
+    # Danh sách IMEI đang tồn kho của sản phẩm
+    return await serial_service.list_in_stock(id)
+
 # ==========================================
 # 6. TRANSACTIONS API
 # ==========================================
 
 @app.get("/api/transactions", response_model=List[Transaction])
-async def get_transactions():
-    return await Transaction.find_all().sort("-date").to_list()
+async def get_transactions(
+    response: Response,
+    type: Optional[TransactionType] = None,
+    productId: Optional[str] = None,
+    partner: Optional[str] = None,
+    brand: Optional[str] = None,
+    category: Optional[Category] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    q: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    format: str = "json",
+):
+    # brand / category: theo thông tin sản phẩm chép vào phiếu lúc ghi (không tra bảng sản phẩm)
+    filters = query_service.combine(
+        {"type": type.value} if type else {},
+        {"productId": productId} if productId else {},
+        {"partner": partner} if partner else {},
+        {"brand": brand} if brand else {},
+        {"category": category.value} if category else {},
+        query_service.date_filter("date", date_from, date_to),
+        query_service.text_filter(q, ["productName", "sku", "partner", "notes", "imeis"]),
+    )
+    return await query_service.fetch_page(
+        Transaction, filters, response, sort_field="date", limit=limit, cursor=cursor, format=format
+    )
+
+def _transaction_log(trans: Transaction, product: Product) -> tuple:
+    action_type = "IMPORT" if trans.type == TransactionType.IMPORT else "EXPORT"
+
+    # Tạo nội dung log chi tiết
+    imei_info = f" (IMEI: {', '.join(trans.imeis)})" if trans.imeis else ""
+    partner_info = f" - Đối tác: {trans.partner}" if trans.partner else ""
+
+    return action_type, product.name, f"{action_type} {trans.quantity} cái{imei_info}{partner_info}"
 
 @app.post("/api/transactions", response_model=Transaction)
 async def create_transaction(trans: Transaction, current_user: User = Depends(get_current_user)):
-    # 1. Validate cơ bản: Nếu có nhập IMEI, số lượng IMEI phải khớp với số lượng tổng
-    if trans.imeis and len(trans.imeis) != trans.quantity:
-        raise HTTPException(status_code=400, detail=f"Số lượng là {trans.quantity} nhưng danh sách chứa {len(trans.imeis)} mã IMEI.")
+    # 1. Cập nhật tồn kho + IMEI + lưu phiếu (nguyên tử, không bán âm, không phiếu mồ côi)
+    product = await stock_service.apply_transaction(trans)
+    await stats_service.record_transaction(trans, product)
+    await ledger_service.record_transactions([trans], {trans.productId: product})
+    await cost_service.record_transactions([trans], {trans.productId: product})
+    alert_service.track([product])
+    feed_service.publish("transaction", "insert", trans.id, trans)
+    feed_service.publish_stock(product, trans.quantity if trans.type == TransactionType.IMPORT else -trans.quantity)
+    cache_service.bump(cache_service.PRODUCTS, cache_service.STATS)
+
+    # 2. Ghi Log hệ thống
+    await create_log(current_user.username, *_transaction_log(trans, product))
 
-    # 2. Lưu transaction vào lịch sử
-    await trans.create()
-    
-    # 3. Cập nhật Sản phẩm (Product)
-    product = await Product.get(trans.productId)
-    if product:
-        # === TRƯỜNG HỢP NHẬP KHO ===
-        if trans.type == TransactionType.IMPORT:
-            # Nếu có IMEI, thêm vào danh sách
-            if trans.imeis:
-                # Kiểm tra xem IMEI đã tồn tại trong kho chưa (tránh trùng lặp)
-                for imei in trans.imeis:
-                    if imei in product.imeis:
-                        raise HTTPException(status_code=400, detail=f"IMEI {imei} đã tồn tại trong kho!")
-                
-                # Thêm mới vào danh sách
-                product.imeis.extend(trans.imeis)
-            
-            # Cộng số lượng
-            product.quantity += trans.quantity
-
-        # === TRƯỜNG HỢP XUẤT KHO (SỬA Ở ĐÂY) ===
-        elif trans.type == TransactionType.EXPORT:
-            # Kiểm tra đủ số lượng không
-            if product.quantity < trans.quantity:
-                 raise HTTPException(status_code=400, detail="Lỗi: Không đủ hàng trong kho để xuất!")
-            
-            # Nếu giao dịch có kèm IMEI (VD: Bán điện thoại)
-            if trans.imeis:
-                for imei_to_remove in trans.imeis:
-                    # Kiểm tra IMEI này có thực sự ở trong kho không
-                    if imei_to_remove not in product.imeis:
-                        raise HTTPException(status_code=400, detail=f"Lỗi: IMEI {imei_to_remove} không có trong kho để xuất!")
-                    
-                    # XÓA IMEI KHỎI DANH SÁCH TỒN KHO
-                    product.imeis.remove(imei_to_remove)
-            
-            # Trừ số lượng
-            product.quantity -= trans.quantity
-            
-        # Cập nhật thời gian và lưu lại
-        product.lastUpdated = datetime.now()
-        await product.save()
-        
-        # 4. Ghi Log hệ thống
-        action_type = "IMPORT" if trans.type == TransactionType.IMPORT else "EXPORT"
-        
-        # Tạo nội dung log chi tiết
-        imei_info = f" (IMEI: {', '.join(trans.imeis)})" if trans.imeis else ""
-        partner_info = f" - Đối tác: {trans.partner}" if trans.partner else ""
-        
-        log_detail = f"{action_type} {trans.quantity} cái{imei_info}{partner_info}"
-        
-        await create_log(current_user.username, action_type, product.name, log_detail)
-        
     return trans
 
+def _publish_transactions(transactions: List[Transaction], products: dict):
+    # Change feed: các phiếu mới + tồn kho mới của từng sản phẩm (products: bản sau khi cập nhật)
+    feed_service.publish_many("transaction", "insert", transactions)
+    deltas = {}
+    for t in transactions:
+        deltas[t.productId] = deltas.get(t.productId, 0) + (t.quantity if t.type == TransactionType.IMPORT else -t.quantity)
+    for pid, delta in deltas.items():
+        if pid in products:
+            feed_service.publish_stock(products[pid], delta)
+
+@app.post("/api/transactions/batch", response_model=List[Transaction])
+async def create_transaction_batch(batch: TransactionBatch, current_user: User = Depends(get_current_user)):
+    if not batch.transactions:
+        raise HTTPException(status_code=400, detail="Phiếu không có dòng nào")
+
+    # Đối tác / ghi chú chung của phiếu áp dụng cho các dòng chưa có
+    for t in batch.transactions:
+        t.partner = t.partner or batch.partner
+        t.notes = t.notes or batch.notes
+
+    # Kiểm tra toàn bộ phiếu trước, lỗi 1 dòng thì không dòng nào được ghi
+    products = await stock_service.apply_batch(batch.transactions)
+    await stats_service.record_transactions(batch.transactions, products)
+    await ledger_service.record_transactions(batch.transactions, products)
+    await cost_service.record_transactions(batch.transactions, products)
+    alert_service.track(products.values())
+    _publish_transactions(batch.transactions, products)
+    cache_service.bump(cache_service.PRODUCTS, cache_service.STATS)
+    await create_logs(current_user.username, [
+        _transaction_log(t, products[t.productId]) for t in batch.transactions
+    ])
+    return batch.transactions
+
 # ==========================================
 # 7. STOCKTAKES & MOVEMENTS & LOGS
 # ==========================================
 
 @app.get("/api/stocktakes", response_model=List[StocktakeSession])
-async def get_stocktakes():
-    return await StocktakeSession.find_all().sort("-date").to_list()
+async def get_stocktakes(
+    response: Response,
+    status: Optional[StocktakeStatus] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    format: str = "json",
+):
+    filters = query_service.combine(
+        {"status": status.value} if status else {},
+        query_service.date_filter("date", date_from, date_to),
+    )
+    return await query_service.fetch_page(
+        StocktakeSession, filters, response, sort_field="date", limit=limit, cursor=cursor, format=format
+    )
+
+async def _apply_stocktake(session: StocktakeSession, current_user: User):
+    # Cập nhật tồn kho hàng loạt + ghi phiếu điều chỉnh cho phần chênh lệch
+    adjustments, products, unapplied = await stocktake_service.complete_session(session)
+    # Ghi nhận đủ thống kê / sổ kho / giá vốn cho các sản phẩm đã ghi, kể cả khi còn sản phẩm chưa ghi được
+    await stats_service.record_transactions(adjustments, products)
+    # products là bản trước khi kiểm kê -> tồn kho mới = số đếm thực tế
+    counts = {item.productId: item.actualQuantity for item in session.items}
+    counted = {pid: p.model_copy(update={"quantity": counts[pid], "ledgerSeq": p.ledgerSeq + 1})
+               for pid, p in products.items() if pid in counts}
+    await ledger_service.record_transactions(adjustments, counted)
+    await cost_service.record_transactions(adjustments, counted)
+    await alert_service.refresh(products)
+    cache_service.bump(cache_service.PRODUCTS, cache_service.STATS)
+    _publish_transactions(adjustments, counted)
+    stocktake_service.ensure_applied(unapplied)
+
+    feed_service.publish("stocktake", "update", session.id, session)
+    await create_log(current_user.username, "STOCKTAKE", "Toàn kho", f"Hoàn tất kiểm kê. Chênh lệch: {session.totalDifference}")
+
+async def _complete_stocktake(id: str, current_user: User) -> StocktakeSession:
+    session = await stocktake_service.complete_draft(id)
+    try:
+        await _apply_stocktake(session, current_user)
+    except Exception:
+        # Chưa áp dụng được thì trả phiếu về trạng thái nháp để hoàn tất lại
+        await session.set({StocktakeSession.status: StocktakeStatus.DRAFT})
+        feed_service.publish("stocktake", "update", session.id, session)
+        raise
+    return session
 
 @app.post("/api/stocktakes", response_model=StocktakeSession)
 async def create_stocktake(session: StocktakeSession, current_user: User = Depends(get_current_user)):
+    # Luôn lưu dạng nháp trước, phiếu hoàn tất ngay đi qua cùng luồng hoàn tất phiếu nháp
+    complete = session.status == StocktakeStatus.COMPLETED
+    session.status = StocktakeStatus.DRAFT
     await session.create()
-    
-    if session.status == StocktakeStatus.COMPLETED:
-        for item in session.items:
-            product = await Product.get(item.productId)
-            if product:
-                product.quantity = item.actualQuantity
-                product.lastUpdated = datetime.now()
-                await product.save()
-        await create_log(current_user.username, "STOCKTAKE", "Toàn kho", f"Hoàn tất kiểm kê. Chênh lệch: {session.totalDifference}")
+    feed_service.publish("stocktake", "insert", session.id, session)
+
+    if complete:
+        session = await _complete_stocktake(str(session.id), current_user)
+    return session
+
+# Phiếu nháp: gửi từng phần item đã đếm (thêm/sửa theo productId, xóa theo productId)
+@app.patch("/api/stocktakes/{id}/items", response_model=StocktakeSession)
+async def patch_stocktake_items(id: str, data: StocktakePatch, current_user: User = Depends(get_current_user)):
+    session = await stocktake_service.patch_items(id, data.items, data.remove)
+    feed_service.publish("stocktake", "update", session.id, session)
     return session
 
+@app.post("/api/stocktakes/{id}/complete", response_model=StocktakeSession)
+async def complete_stocktake(id: str, current_user: User = Depends(get_current_user)):
+    return await _complete_stocktake(id, current_user)
+
 @app.get("/api/movements", response_model=List[MovementLog])
-async def get_movements():
-    return await MovementLog.find_all().sort("-date").to_list()
+async def get_movements(
+    response: Response,
+    productId: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    q: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    format: str = "json",
+):
+    filters = query_service.combine(
+        {"productId": productId} if productId else {},
+        query_service.date_filter("date", date_from, date_to),
+        query_service.text_filter(q, ["productName", "sku", "fromLocation", "toLocation"]),
+    )
+    return await query_service.fetch_page(
+        MovementLog, filters, response, sort_field="date", limit=limit, cursor=cursor, format=format
+    )
 
 @app.post("/api/movements", response_model=MovementLog)
 async def create_movement(log: MovementLog, current_user: User = Depends(get_current_user)):
     await log.create()
+    await serial_service.move_units(log.productId, log.toLocation)
+    feed_service.publish("movement", "insert", log.id, log)
     await create_log(current_user.username, "MOVE", log.productName, f"Từ {log.fromLocation} -> {log.toLocation}")
     return log
 
+# --- Tối ưu vị trí kho (slotting) ---
+@app.post("/api/slotting/plan", response_model=SlottingPlan)
+async def get_slotting_plan(config: Optional[SlottingConfig] = None):
+    # Không gửi body -> dùng mô hình mặc định Zone A/B/C (20% / 30% / 50%)
+    return await slotting_service.plan(config or SlottingConfig())
+
+@app.post("/api/slotting/apply", response_model=List[MovementLog])
+async def apply_slotting_plan(data: SlottingApply, current_user: User = Depends(get_current_user)):
+    logs = await slotting_service.apply_moves(data.moves)
+    feed_service.publish_many("movement", "insert", logs)
+    for log in logs:
+        feed_service.publish("product", "update", log.productId, {"location": log.toLocation})
+    cache_service.bump(cache_service.PRODUCTS)
+    await create_log(current_user.username, "MOVE", "Toàn kho", f"Áp dụng tối ưu vị trí: chuyển {len(logs)}/{len(data.moves)} sản phẩm")
+    return logs
+
 @app.get("/api/logs", response_model=List[SystemLog])
-async def get_system_logs(current_user: User = Depends(get_current_user)):
+async def get_system_logs(current_user: User = Depends(get_token_user)):
     return await SystemLog.find_all().sort("-timestamp").limit(200).to_list()
 
+# Tình trạng bộ ghi nhật ký nền: số log đang chờ, bị trễ (ghi tạm ra file), bị mất
+@app.get("/api/logs/metrics")
+async def get_log_metrics(current_user: User = Depends(get_token_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Chỉ Admin mới xem được tình trạng ghi nhật ký")
+    return log_service.get_metrics()
+
 # ==========================================
 # 8. AI & REPORTS & SEED
 # ==========================================
 
 @app.get("/api/ai/analyze", response_model=AIAnalysisResult)
 async def analyze_inventory():
-    products = await Product.find_all().to_list()
-    if not products:
-        return AIAnalysisResult(summary="Kho hàng đang trống.", lowStockItems=[], restockRecommendations=[], valueAnalysis="Chưa có dữ liệu.")
-    result = await analyze_inventory_service(products)
+    # Kết quả được cache theo trạng thái kho, kho không đổi thì không gọi lại Gemini
+    result = await analyze_inventory_service()
+    if result is None:
+        raise HTTPException(status_code=503, detail="Không phân tích được dữ liệu bằng AI, vui lòng thử lại sau")
     return result
 
 @app.post("/api/ai/chat")
 async def chat_with_ai(req: ChatRequest):
-    products = await Product.find_all().to_list()
-    transactions = await Transaction.find_all().sort("-date").to_list()
-    answer = await ask_gemini_service(req.question, products, transactions)
+    answer = await ask_gemini_service(req.question)
     return {"answer": answer}
 
+# Dự báo nhu cầu: tính trong máy (Holt + mùa vụ theo tuần), cache theo ngày.
+# narrative=true: nhờ AI viết thêm nhận định (không bắt buộc, lỗi AI vẫn trả số liệu)
+@app.get("/api/ai/forecast", response_model=ForecastResult)
+async def forecast_demand(
+    lead_time: Optional[int] = Query(None, ge=1, le=365),
+    service_level: Optional[float] = Query(None, gt=0.5, lt=1),
+    narrative: bool = False,
+):
+    result = await forecast_service.get_forecast(lead_time, service_level)
+    if narrative:
+        try:
+            text = await ai_service.forecast_narrative_service(result)
+        except HTTPException:
+            text = None
+        if text:
+            result = result.model_copy(update={"summary": f"{result.summary}\n\n{text}"})
+    return result
+
+# Số lần trúng cache / gọi model / bị giới hạn tần suất của AI
+@app.get("/api/ai/stats")
+async def get_ai_stats(current_user: User = Depends(get_token_user)):
+    return ai_service.get_stats()
+
+# Xuất báo cáo dạng stream (đọc cursor theo lô), format = xlsx | csv
 @app.get("/api/reports/inventory-excel")
-async def export_inventory_excel():
-    products = await Product.find_all().to_list()
-    data = []
-    for p in products:
-        data.append({
-            "Mã SKU": p.sku, "Tên Sản Phẩm": p.name, "Danh Mục": p.category,
-            "Vị Trí": p.location, "Số Lượng Tồn": p.quantity,
-            "Định Mức Tối Thiểu": p.minStock, "Đơn Giá": p.price,
-            "Tổng Giá Trị": p.quantity * p.price
-        })
-    df = pd.DataFrame(data)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='TonKho')
-    output.seek(0)
-    headers = {'Content-Disposition': f'attachment; filename="BaoCao.xlsx"'}
-    return StreamingResponse(output, headers=headers, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+async def export_inventory_excel(category: Optional[Category] = None, format: str = "xlsx"):
+    rows = export_service.inventory_rows(category.value if category else None)
+    return await export_service.export_response(
+        format, "BaoCao", "TonKho", export_service.INVENTORY_COLUMNS, rows
+    )
 
 @app.get("/api/reports/transactions-excel")
-async def export_transactions_excel():
-    # 1. Lấy dữ liệu
-    transactions = await Transaction.find_all().sort("-date").to_list()
-    products = await Product.find_all().to_list()
-    
-    # Tạo từ điển để tra cứu SKU nhanh từ productId
-    product_map = {str(p.id): p.sku for p in products}
-    
-    # 2. Chuyển đổi dữ liệu
-    data = []
-    total_import = 0
-    total_export = 0
+async def export_transactions_excel(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    type: Optional[TransactionType] = None,
+    format: str = "xlsx",
+):
+    # Tổng nhập/xuất được cộng dồn trong lúc ghi, thêm vào cuối file
+    totals = {"import": 0, "export": 0}
+    filters = export_service.transaction_filter(date_from, date_to, type)
+    rows = export_service.transaction_rows(filters, totals)
+
+    filename = f"BaoCaoNhapXuat_{datetime.now().strftime('%Y%m%d')}"
+    return await export_service.export_response(
+        format, filename, "LichSuGiaoDich", export_service.TRANSACTION_COLUMNS, rows,
+        footer=lambda: export_service.transaction_footer(totals),
+    )
 
-    for t in transactions:
-        sku = product_map.get(t.productId, "N/A") # Lấy SKU, nếu không có thì N/A
-        
-        # Dịch loại giao dịch sang Tiếng Việt
-        trans_type = "Nhập Kho" if t.type == TransactionType.IMPORT else "Xuất Kho"
-        
-        # Cộng dồn tổng
-        if t.type == TransactionType.IMPORT:
-            total_import += t.quantity
-        else:
-            total_export += t.quantity
-
-        data.append({
-            "Ngày Giao Dịch": t.date.strftime("%d/%m/%Y"),
-            "Giờ": t.date.strftime("%H:%M"),
-            "Loại Phiếu": trans_type,
-            "Mã SKU": sku,
-            "Tên Sản Phẩm": t.productName,
-            "Số Lượng": t.quantity,
-            "Đối Tác": t.partner or "",
-            "Ghi Chú": t.notes or ""
-        })
-    
-    df = pd.DataFrame(data)
-    
-    if not data:
-        df = pd.DataFrame(columns=["Ngày Giao Dịch", "Loại Phiếu", "Tên Sản Phẩm", "Số Lượng"])
+# Giá trị tồn kho theo giá vốn (FIFO / bình quân) + giá vốn hàng bán, đọc từ số liệu đã tính lúc ghi
+@app.get("/api/reports/valuation", response_model=ValuationReport)
+async def get_valuation_report(date_from: Optional[datetime] = None, date_to: Optional[datetime] = None):
+    return await cost_service.valuation(date_from, date_to)
 
-    # 3. Thêm dòng tổng kết
-    if len(df) > 0:
-        # Dòng trống để cách ra
-        df = pd.concat([df, pd.DataFrame([{"Tên Sản Phẩm": ""}])], ignore_index=True)
-        
-        # Dòng tổng nhập
-        df = pd.concat([df, pd.DataFrame([{
-            "Tên Sản Phẩm": "TỔNG NHẬP:", 
-            "Số Lượng": total_import
-        }])], ignore_index=True)
-        
-        # Dòng tổng xuất
-        df = pd.concat([df, pd.DataFrame([{
-            "Tên Sản Phẩm": "TỔNG XUẤT:", 
-            "Số Lượng": total_export
-        }])], ignore_index=True)
-
-    # 4. Xuất file Excel
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='LichSuGiaoDich')
-        
-        workbook = writer.book
-        worksheet = writer.sheets['LichSuGiaoDich']
-        
-        # Format Header
-        header_fmt = workbook.add_format({'bold': True, 'bg_color': '#BDD7EE', 'border': 1})
-        worksheet.set_row(0, None, header_fmt)
-        
-        # Chỉnh độ rộng cột
-        worksheet.set_column('A:B', 12) # Ngày giờ
-        worksheet.set_column('C:C', 15) # Loại
-        worksheet.set_column('D:D', 15) # SKU
-        worksheet.set_column('E:E', 30) # Tên SP
-        worksheet.set_column('F:F', 10) # Số lượng
-        worksheet.set_column('G:G', 25) # Đối tác
-        worksheet.set_column('H:H', 30) # Ghi chú
-
-    output.seek(0)
-    
-    filename = f"BaoCaoNhapXuat_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
-    return StreamingResponse(output, headers=headers, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+# --- Báo cáo chạy nền: tạo job -> hỏi trạng thái -> tải file ---
+@app.post("/api/reports/jobs", response_model=ReportJob, status_code=202)
+async def create_report_job(req: ReportJobRequest, current_user: User = Depends(get_current_user)):
+    params = req.model_dump(exclude={"kind", "format"})
+    return await report_service.submit(req.kind, req.format, params, current_user.username)
+
+@app.get("/api/reports/jobs", response_model=List[ReportJob])
+async def get_report_jobs(current_user: User = Depends(get_token_user)):
+    return report_service.list_jobs()
+
+@app.get("/api/reports/jobs/{job_id}", response_model=ReportJob)
+async def get_report_job(job_id: str, current_user: User = Depends(get_token_user)):
+    return report_service.get_job(job_id)
+
+@app.get("/api/reports/jobs/{job_id}/download")
+async def download_report_job(job_id: str, current_user: User = Depends(get_token_user)):
+    path, filename = report_service.artifact(job_id)
+    media_type = export_service.XLSX_MEDIA_TYPE if filename.endswith(".xlsx") else "text/csv; charset=utf-8"
+    return FileResponse(path, filename=filename, media_type=media_type)
 
 # ==========================================
 # 9. PARTNERS API
 # ==========================================
 @app.get("/api/partners", response_model=List[Partner])
-async def get_partners():
-    return await Partner.find_all().to_list()
+async def get_partners(
+    request: Request,
+    response: Response,
+    type: Optional[PartnerType] = None,
+    q: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    format: str = "json",
+):
+    filters = query_service.combine(
+        {"type": type.value} if type else {},
+        query_service.text_filter(q, ["name", "phone", "email", "tax_code"]),
+    )
+    return await cache_service.cached(request, [cache_service.PARTNERS], lambda: query_service.fetch_page(
+        Partner, filters, response, descending=False, limit=limit, cursor=cursor, format=format
+    ), response)
 
 @app.post("/api/partners", response_model=Partner)
 async def create_partner(partner: Partner):
     await partner.create()
+    await search_service.index_document(Partner, partner.id, partner)
+    cache_service.bump(cache_service.PARTNERS)
     return partner
 
 @app.put("/api/partners/{id}", response_model=Partner)
@@ -656,6 +1059,8 @@ async def update_partner(id: str, data: Partner):
     if not partner:
         raise HTTPException(404)
     await partner.update({"$set": data.dict(exclude={"id"})})
+    await search_service.index_document(Partner, partner.id, data)
+    cache_service.bump(cache_service.PARTNERS)
     return partner
 
 @app.delete("/api/partners/{id}")
@@ -664,14 +1069,31 @@ async def delete_partner(id: str):
     if not partner:
         raise HTTPException(404)
     await partner.delete()
+    cache_service.bump(cache_service.PARTNERS)
     return {"message": "Deleted"}
 
 # ==========================================
 # 10. WARRANTY API
 # ==========================================
 @app.get("/api/warranty", response_model=List[WarrantyTicket])
-async def get_tickets():
-    return await WarrantyTicket.find_all().sort("-received_date").to_list()
+async def get_tickets(
+    response: Response,
+    status: Optional[WarrantyStatus] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    q: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    format: str = "json",
+):
+    filters = query_service.combine(
+        {"status": status.value} if status else {},
+        query_service.date_filter("received_date", date_from, date_to),
+        query_service.text_filter(q, ["ticket_code", "customer_name", "customer_phone", "imei", "product_name"]),
+    )
+    return await query_service.fetch_page(
+        WarrantyTicket, filters, response, sort_field="received_date", limit=limit, cursor=cursor, format=format
+    )
 
 @app.post("/api/warranty", response_model=WarrantyTicket)
 async def create_ticket(ticket: WarrantyTicket):
@@ -682,6 +1104,10 @@ async def create_ticket(ticket: WarrantyTicket):
         ticket.ticket_code = f"BH-{datetime.now().strftime('%y%m%d-%H%M%S')}"
 
     await ticket.create()
+    if ticket.status != WarrantyStatus.RETURNED:
+        await serial_service.set_warranty(ticket.imei, True)
+    await search_service.index_document(WarrantyTicket, ticket.id, ticket)
+    feed_service.publish("warranty", "insert", ticket.id, ticket)
     return ticket
 
 @app.put("/api/warranty/{id}", response_model=WarrantyTicket)
@@ -692,12 +1118,16 @@ async def update_ticket(id: str, data: WarrantyTicket):
     
     # Loại bỏ id khỏi dữ liệu update để tránh lỗi đè id
     update_data = data.dict(exclude={"id"})
+    update_data['updated_at'] = datetime.now()
     
     # Cập nhật ngày trả nếu trạng thái là Đã trả khách
     if data.status == WarrantyStatus.RETURNED and ticket.status != WarrantyStatus.RETURNED:
         update_data['returned_date'] = datetime.now()
+        await serial_service.set_warranty(ticket.imei, False)
         
     await ticket.update({"$set": update_data})
+    await search_service.index_document(WarrantyTicket, ticket.id, update_data)
+    feed_service.publish("warranty", "update", ticket.id, ticket)
     return ticket
 
 @app.delete("/api/warranty/{id}")
@@ -706,49 +1136,29 @@ async def delete_ticket(id: str):
     if not ticket:
         raise HTTPException(404)
     await ticket.delete()
+    feed_service.publish("warranty", "delete", ticket.id)
     return {"message": "Deleted"}
 
 # ==========================================
 # 11. TRACEABILITY API (TRA CỨU IMEI)
 # ==========================================
 
-@app.get("/api/trace/{imei}")
+@app.get("/api/trace/{imei}", response_model=List[TraceEvent])
 async def trace_imei(imei: str):
-    timeline = []
+    # Dòng thời gian của 1 IMEI: nhập/xuất, di chuyển, kiểm kê, bảo hành (mới nhất lên đầu)
+    return (await trace_service.trace(imei)).events
 
-    # 1. Tìm trong lịch sử Giao dịch (Nhập / Xuất)
-    # Lưu ý: Transaction lưu 'imeis' là một danh sách (List)
-    # Beanie/MongoDB hỗ trợ tìm kiếm: nếu 'imeis' chứa giá trị 'imei' -> khớp.
-    transactions = await Transaction.find({"imeis": imei}).to_list()
-    
-    for t in transactions:
-        action_name = "Nhập Kho" if t.type == TransactionType.IMPORT else "Xuất Kho"
-        timeline.append({
-            "date": t.date,
-            "type": "TRANSACTION",
-            "sub_type": t.type, # IMPORT / EXPORT
-            "title": f"Giao dịch: {action_name}",
-            "description": f"Sản phẩm: {t.productName}. Đối tác: {t.partner or 'Không rõ'}",
-            "ref_id": str(t.id)
-        })
-
-    # 2. Tìm trong lịch sử Bảo hành
-    warranties = await WarrantyTicket.find(WarrantyTicket.imei == imei).to_list()
-    
-    for w in warranties:
-        timeline.append({
-            "date": w.received_date,
-            "type": "WARRANTY",
-            "sub_type": w.status,
-            "title": "Tiếp nhận Bảo hành / Sửa chữa",
-            "description": f"Khách: {w.customer_name}. Lỗi: {w.issue_description}",
-            "ref_id": str(w.id)
-        })
-
-    # 3. Sắp xếp theo thời gian (Mới nhất lên đầu)
-    timeline.sort(key=lambda x: x["date"], reverse=True)
-    
-    return timeline
+@app.get("/api/trace/{imei}/detail", response_model=SerialTrace)
+async def trace_imei_detail(imei: str):
+    # Kèm sản phẩm, trạng thái và vị trí hiện tại của máy
+    return await trace_service.trace(imei)
+
+# Truy vết hàng loạt (VD: thu hồi theo lô IMEI), tối đa TRACE_BULK_LIMIT IMEI mỗi lần
+@app.post("/api/trace/bulk", response_model=List[SerialTrace])
+async def trace_imei_bulk(req: TraceBulkRequest, current_user: User = Depends(get_current_user)):
+    if len(req.imeis) > trace_service.TRACE_BULK_LIMIT:
+        raise HTTPException(status_code=400, detail=f"Tối đa {trace_service.TRACE_BULK_LIMIT} IMEI mỗi lần truy vết")
+    return await trace_service.trace_many(req.imeis)
 
 # ==========================================
 # 12. SEED DATA API
@@ -809,5 +1219,12 @@ async def seed_data():
     
     for p in products:
         await p.create()
+        await search_service.index_document(Product, p.id, p)
+    await ledger_service.record_products([(p, p.quantity) for p in products])
+    for p in products:
+        await cost_service.record_adjustment(p, p.quantity)
+        await stats_service.adjust_category(p.category, p.quantity)
+    alert_service.track(products)
+    cache_service.bump(cache_service.PRODUCTS)
     
     return {"message": "Đã tạo dữ liệu Laptop & Điện thoại mẫu thành công!"}
@@ -1,6 +1,10 @@
+import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
+from cachetools import TTLCache
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
@@ -28,6 +32,32 @@ def get_password_hash(password):
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+# --- BCRYPT CHẠY NGOÀI EVENT LOOP ---
+# Mỗi lần băm/kiểm tra bcrypt mất ~200-300ms CPU -> chạy trong thread pool riêng (bcrypt nhả GIL)
+# để event loop vẫn phục vụ request khác. BCRYPT_WORKERS giới hạn số phép băm chạy cùng lúc,
+# BCRYPT_MAX_PENDING giới hạn số request được xếp hàng chờ, quá thì trả 503 thay vì dồn ứ.
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "64"))
+
+_bcrypt_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_bcrypt_slots = asyncio.Semaphore(BCRYPT_MAX_PENDING)
+
+async def _run_bcrypt(func, *args):
+    if _bcrypt_slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Hệ thống đang bận xử lý đăng nhập, vui lòng thử lại sau giây lát",
+            headers={"Retry-After": "1"},
+        )
+    async with _bcrypt_slots:
+        return await asyncio.get_running_loop().run_in_executor(_bcrypt_pool, func, *args)
+
+async def get_password_hash_async(password):
+    return await _run_bcrypt(get_password_hash, password)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_bcrypt(verify_password, plain_password, hashed_password)
+
 
 # Hàm tạo Token
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -40,8 +70,32 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# Dependency: Lấy User hiện tại từ Token gửi lên
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+# --- CACHE XÁC THỰC TOKEN ---
+# Token hợp lệ -> User, giữ trong bộ nhớ (LRU + TTL) để không phải tìm User trong DB ở mọi request.
+# Khi user bị sửa/xóa/đổi mật khẩu thì gọi invalidate_user(); với nhiều tiến trình server,
+# tiến trình khác sẽ thấy thay đổi sau tối đa AUTH_CACHE_TTL giây.
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))
+# Cho phép các API chỉ đọc tin role trong token (không tra DB)
+AUTH_TRUST_TOKEN_ROLE = os.getenv("AUTH_TRUST_TOKEN_ROLE", "false").lower() == "true"
+
+_user_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+_cache_stats = {"hits": 0, "misses": 0, "trusted": 0, "invalidations": 0}
+
+def invalidate_user(username: str):
+    """
+    Xóa mọi token đã cache của user (gọi sau khi sửa/xóa user hoặc đổi mật khẩu)
+    """
+    for token, (_, user) in list(_user_cache.items()):
+        if user.username == username:
+            _user_cache.pop(token, None)
+            _cache_stats["invalidations"] += 1
+
+def get_cache_stats() -> dict:
+    return {**_cache_stats, "size": len(_user_cache), "maxsize": AUTH_CACHE_SIZE, "ttl": AUTH_CACHE_TTL,
+            "trustTokenRole": AUTH_TRUST_TOKEN_ROLE}
+
+def _decode_token(token: str) -> dict:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -54,8 +108,36 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-        
-    user = await User.find_one(User.username == username)
+    return payload
+
+# Dependency: Lấy User hiện tại từ Token gửi lên
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    cached = _user_cache.get(token)
+    if cached is not None and cached[0] > time.time():
+        _cache_stats["hits"] += 1
+        # Trả bản sao: handler có thể sửa current_user
+        return cached[1].model_copy()
+
+    _cache_stats["misses"] += 1
+    payload = _decode_token(token)
+    user = await User.find_one(User.username == payload["sub"])
     if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    # Lưu kèm thời điểm hết hạn của token (exp: epoch UTC, so với time.time()): hết hạn thì phải giải mã lại (trả 401)
+    _user_cache[token] = (payload.get("exp", 0), user.model_copy())
+    return user
+
+# Dependency cho API chỉ đọc: khi bật AUTH_TRUST_TOKEN_ROLE thì lấy username/role ngay từ token
+# (chữ ký JWT đã đảm bảo token không bị sửa), không tra DB. Đổi role có hiệu lực khi token hết hạn.
+async def get_token_user(token: str = Depends(oauth2_scheme)):
+    if not AUTH_TRUST_TOKEN_ROLE:
+        return await get_current_user(token)
+    payload = _decode_token(token)
+    if "role" not in payload:
+        return await get_current_user(token)
+    _cache_stats["trusted"] += 1
+    return User.model_construct(username=payload["sub"], role=payload["role"])
@@ -0,0 +1,108 @@
+# backend/bench_analytics.py
+# Đo /api/reports/analytics trên nhiều phiếu giả lập: so với cách cũ (tải phiếu về rồi cộng dồn bằng vòng lặp Python).
+#
+# Chạy (cần MongoDB local): python bench_analytics.py [số_phiếu] [số_sản_phẩm]
+# Dữ liệu ghi vào database riêng "<DB_NAME>_bench" và bị xóa sau khi chạy.
+import asyncio
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app import connect_database, DB_NAME
+from models import Product, Transaction, TransactionType
+import analytics_service
+import stats_service
+from analytics_service import Compare, Granularity, GroupBy
+
+TRANSACTIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+PRODUCTS = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+DAYS = 730
+BRANDS = ["Apple", "Samsung", "Dell", "Asus", "Lenovo", "Xiaomi", "Sony", "HP"]
+PARTNERS = [f"Đối tác {i}" for i in range(200)]
+
+CASES = [
+    ("30 ngày, theo ngày", 30, Granularity.DAY, None, None),
+    ("90 ngày, theo tuần, theo sản phẩm", 90, Granularity.WEEK, GroupBy.PRODUCT, Compare.PREVIOUS),
+    ("1 năm, theo tháng, theo thương hiệu", 365, Granularity.MONTH, GroupBy.BRAND, Compare.YEAR),
+    ("1 năm, theo tháng, theo danh mục", 365, Granularity.MONTH, GroupBy.CATEGORY, Compare.PREVIOUS),
+    ("90 ngày, theo tháng, theo đối tác", 90, Granularity.MONTH, GroupBy.PARTNER, Compare.PREVIOUS),
+]
+
+
+async def seed():
+    random.seed(7)
+    start = datetime.now() - timedelta(days=DAYS)
+    products = [{"_id": ObjectId(), "name": f"Sản phẩm {i}", "sku": f"AN-{i:05d}", "brand": random.choice(BRANDS),
+                 "category": random.choice(["Laptop", "Điện thoại"]), "location": "A-01", "quantity": 0,
+                 "imeiCount": 0, "minStock": 0, "price": 0.0, "lastUpdated": start}
+                for i in range(PRODUCTS)]
+    await Product.get_pymongo_collection().insert_many(products)
+
+    step = DAYS * 24 * 3600 / TRANSACTIONS
+    batch = []
+    for n in range(TRANSACTIONS):
+        product = random.choice(products)
+        quantity = random.randint(1, 10)
+        batch.append({"productId": str(product["_id"]), "productName": product["name"],
+                      "type": random.choice([TransactionType.IMPORT.value, TransactionType.EXPORT.value]),
+                      "quantity": quantity, "imeis": [], "partner": random.choice(PARTNERS),
+                      "costAmount": quantity * 1000000.0, "date": start + timedelta(seconds=n * step)})
+        if len(batch) >= 10000:
+            await Transaction.get_pymongo_collection().insert_many(batch)
+            batch = []
+    if batch:
+        await Transaction.get_pymongo_collection().insert_many(batch)
+    # Bảng daily_stats như khi ghi từng phiếu
+    await stats_service.rebuild_stats()
+    return {str(p["_id"]): p for p in products}
+
+
+async def naive(products: dict, days: int, granularity: Granularity, group_by) -> dict:
+    # Cách cũ: tải các phiếu trong kỳ rồi cộng dồn từng dòng bằng Python
+    date_to = datetime.now()
+    date_from = (date_to - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    totals = defaultdict(lambda: [0, 0])
+    cursor = Transaction.get_pymongo_collection().find({"date": {"$gte": date_from}}, batch_size=5000)
+    async for t in cursor:
+        if group_by == GroupBy.PARTNER:
+            key = t.get("partner")
+        elif group_by in (GroupBy.BRAND, GroupBy.CATEGORY):
+            key = products[t["productId"]].get(group_by.value)
+        else:
+            key = t["productId"] if group_by else ""
+        bucket = analytics_service.bucket_of(t["date"], granularity)
+        totals[(bucket, key)][0 if t["type"] == TransactionType.IMPORT.value else 1] += t["quantity"]
+    return totals
+
+
+async def main():
+    bench_db = f"{DB_NAME}_bench"
+    client = await connect_database(bench_db)
+    try:
+        start = time.perf_counter()
+        products = await seed()
+        print(f"\n📊 Phân tích nhập/xuất: {TRANSACTIONS:,} phiếu, {PRODUCTS:,} sản phẩm (tạo dữ liệu {time.perf_counter() - start:.1f}s)")
+
+        for name, days, granularity, group_by, compare in CASES:
+            start = time.perf_counter()
+            await naive(products, days, granularity, group_by)
+            t_naive = time.perf_counter() - start
+
+            date_to = datetime.now()
+            start = time.perf_counter()
+            report = await analytics_service.analytics(date_to - timedelta(days=days - 1), date_to, granularity, group_by, compare)
+            t_engine = time.perf_counter() - start
+            compared = " (+ kỳ so sánh)" if compare else ""
+            print(f"   {name:38s} vòng lặp Python {t_naive * 1000:8.1f} ms | analytics{compared} {t_engine * 1000:8.1f} ms"
+                  f" | {len(report.series)} nhóm x {len(report.buckets)} kỳ")
+    finally:
+        await client.drop_database(bench_db)
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
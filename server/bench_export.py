@@ -0,0 +1,94 @@
+# backend/bench_export.py
+# Đo bộ nhớ khi xuất báo cáo nhập xuất theo số dòng:
+# với export_service (stream theo lô), đỉnh bộ nhớ phải gần như không đổi khi số dòng tăng.
+#
+# Chạy (cần MongoDB local): python bench_export.py [số_dòng ...]
+# VD: python bench_export.py 10000 100000 500000
+# Dữ liệu ghi vào database riêng "<DB_NAME>_bench" và bị xóa sau khi chạy.
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from app import connect_database, DB_NAME
+from models import Product, Transaction, TransactionType
+import export_service
+
+ROW_COUNTS = [int(n) for n in sys.argv[1:]] or [10000, 50000, 200000]
+SEED_BATCH = 10000
+
+
+async def seed(total: int, current: int, product_ids: list):
+    # Thêm phiếu cho đủ total dòng (ghi thẳng bằng insert_many cho nhanh)
+    collection = Transaction.get_pymongo_collection()
+    start = datetime.now() - timedelta(days=365)
+    while current < total:
+        size = min(SEED_BATCH, total - current)
+        await collection.insert_many([
+            {
+                "productId": product_ids[i % len(product_ids)],
+                "productName": f"Sản phẩm {i % len(product_ids)}",
+                "type": TransactionType.IMPORT.value if i % 3 else TransactionType.EXPORT.value,
+                "quantity": 1 + i % 5,
+                "date": start + timedelta(seconds=i * 30),
+                "partner": "Nhà cung cấp A",
+                "notes": "Phiếu benchmark",
+                "imeis": [],
+            }
+            for i in range(current, current + size)
+        ])
+        current += size
+
+
+async def measure(format: str) -> tuple:
+    totals = {"import": 0, "export": 0}
+    rows = export_service.transaction_rows({}, totals)
+    footer = lambda: export_service.transaction_footer(totals)
+
+    tracemalloc.start()
+    began = time.perf_counter()
+    size = 0
+    if format == "csv":
+        async for chunk in export_service.iter_csv(export_service.TRANSACTION_COLUMNS, rows, footer):
+            size += len(chunk)  # Giống gửi từng khối ra socket rồi bỏ
+    else:
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        try:
+            await export_service.write_xlsx(path, "LichSuGiaoDich", export_service.TRANSACTION_COLUMNS, rows, footer)
+            size = os.path.getsize(path)
+        finally:
+            os.remove(path)
+    elapsed = time.perf_counter() - began
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed, size
+
+
+async def main():
+    bench_db = f"{DB_NAME}_bench"
+    client = await connect_database(bench_db)
+    try:
+        products = [Product(name=f"Sản phẩm {i}", sku=f"BENCH-{i:04d}", category="Laptop", location="A") for i in range(500)]
+        await Product.insert_many(products)
+        product_ids = [str(p.id) for p in await Product.find_all().to_list()]
+
+        print("\n📄 Đỉnh bộ nhớ Python (tracemalloc) khi xuất lịch sử nhập xuất")
+        current = 0
+        for total in sorted(ROW_COUNTS):
+            await seed(total, current, product_ids)
+            current = total
+            for format in export_service.EXPORT_FORMATS:
+                peak, elapsed, size = await measure(format)
+                print(f"   {total:>9,} dòng | {format:<4} | đỉnh {peak / 1024 / 1024:7.1f} MB"
+                      f" | {elapsed:6.2f}s | file {size / 1024 / 1024:7.1f} MB")
+    finally:
+        await client.drop_database(bench_db)
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+# backend/bench_ledger.py
+# So sánh tồn kho tại thời điểm: phát lại toàn bộ phiếu nhập/xuất vs lần chốt gần nhất + sổ kho.
+#
+# Chạy (cần MongoDB local): python bench_ledger.py [số_phiếu] [số_sản_phẩm]
+# Dữ liệu ghi vào database riêng "<DB_NAME>_bench" và bị xóa sau khi chạy.
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app import connect_database, DB_NAME
+from models import Product, Transaction, TransactionType
+import ledger_service
+
+TRANSACTIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+PRODUCTS = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+DAYS = 730
+RUNS = 5
+
+
+async def seed():
+    random.seed(7)
+    start = datetime.now() - timedelta(days=DAYS)
+    products = [{"_id": ObjectId(), "name": f"Sản phẩm {i}", "sku": f"LG-{i:05d}", "category": "Laptop",
+                 "location": "A-01", "quantity": 0, "imeiCount": 0, "minStock": 0, "price": float(random.randint(1, 50) * 100000),
+                 "lastUpdated": start}
+                for i in range(PRODUCTS)]
+    stock = {str(p["_id"]): 0 for p in products}
+    step = DAYS * 24 * 3600 / TRANSACTIONS
+    batch = []
+    for n in range(TRANSACTIONS):
+        product = random.choice(products)
+        pid = str(product["_id"])
+        if stock[pid] > 0 and random.random() < 0.5:
+            quantity, type = random.randint(1, stock[pid]), TransactionType.EXPORT
+            stock[pid] -= quantity
+        else:
+            quantity, type = random.randint(1, 10), TransactionType.IMPORT
+            stock[pid] += quantity
+        batch.append({"productId": pid, "productName": product["name"], "type": type.value, "quantity": quantity,
+                      "imeis": [], "date": start + timedelta(seconds=n * step)})
+        if len(batch) >= 10000:
+            await Transaction.get_pymongo_collection().insert_many(batch)
+            batch = []
+    if batch:
+        await Transaction.get_pymongo_collection().insert_many(batch)
+    for p in products:
+        p["quantity"] = stock[str(p["_id"])]
+    await Product.get_pymongo_collection().insert_many(products)
+
+
+async def replay(date: datetime) -> dict:
+    # Cách cũ: cộng dồn mọi phiếu trước thời điểm date
+    cursor = await Transaction.get_pymongo_collection().aggregate([
+        {"$match": {"date": {"$lte": date}}},
+        {"$group": {"_id": "$productId", "quantity": {"$sum": {"$cond": [
+            {"$eq": ["$type", TransactionType.IMPORT.value]}, "$quantity", {"$multiply": ["$quantity", -1]},
+        ]}}}},
+    ])
+    return {row["_id"]: row["quantity"] async for row in cursor if row["quantity"]}
+
+
+async def main():
+    bench_db = f"{DB_NAME}_bench"
+    client = await connect_database(bench_db)
+    try:
+        await seed()
+        start = time.perf_counter()
+        rebuilt = await ledger_service.rebuild()
+        t_rebuild = time.perf_counter() - start
+
+        now = datetime.now()
+        dates = [(now - timedelta(days=d)).replace(day=1, hour=0, minute=0, second=0, microsecond=0) - timedelta(seconds=1)
+                 for d in range(30, 30 * (RUNS + 1), 30)]
+        t_replay = t_ledger = 0.0
+        for date in dates:
+            start = time.perf_counter()
+            expected = await replay(date)
+            t_replay += time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = await ledger_service.inventory_as_of(date)
+            t_ledger += time.perf_counter() - start
+            assert {i.productId: i.quantity for i in result.items} == expected, f"Sai lệch tại {date}"
+
+        print(f"\n📒 Tồn kho tại thời điểm: {TRANSACTIONS:,} phiếu, {PRODUCTS:,} sản phẩm")
+        print(f"   Dựng lại sổ kho:        {t_rebuild:6.2f}s ({rebuilt['entries']:,} dòng, {rebuilt['snapshots']} lần chốt)")
+        print(f"   Phát lại toàn bộ phiếu: {t_replay / len(dates) * 1000:8.1f} ms / truy vấn")
+        print(f"   Lần chốt + sổ kho:      {t_ledger / len(dates) * 1000:8.1f} ms / truy vấn (kết quả khớp)")
+    finally:
+        await client.drop_database(bench_db)
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
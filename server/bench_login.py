@@ -0,0 +1,87 @@
+# backend/bench_login.py
+# Đo ảnh hưởng của đợt đăng nhập dồn dập lên các API khác:
+# - Đo độ trễ (p50/p99) của 1 API không liên quan khi server rảnh
+# - Đo lại trong lúc có N request đăng nhập chạy song song liên tục
+# Nếu bcrypt chặn event loop, p99 khi có đăng nhập sẽ tăng lên hàng trăm ms.
+#
+# Chạy (server phải đang chạy):
+#   python bench_login.py <username> <password> [số_login_song_song] [số_lần_đo] [base_url]
+# VD: python bench_login.py admin 123456 20 200 http://localhost:8000
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+USERNAME = sys.argv[1] if len(sys.argv) > 1 else "admin"
+PASSWORD = sys.argv[2] if len(sys.argv) > 2 else "123456"
+CONCURRENT_LOGINS = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+PROBES = int(sys.argv[4]) if len(sys.argv) > 4 else 200
+BASE_URL = sys.argv[5] if len(sys.argv) > 5 else "http://localhost:8000"
+
+PROBE_PATH = "/api/brands"  # API đọc nhẹ, không liên quan đến đăng nhập
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def probe_latencies(session: requests.Session) -> list:
+    latencies = []
+    for _ in range(PROBES):
+        start = time.perf_counter()
+        session.get(BASE_URL + PROBE_PATH).raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def login_loop(stop: threading.Event, results: dict, lock: threading.Lock):
+    session = requests.Session()
+    while not stop.is_set():
+        start = time.perf_counter()
+        res = session.post(BASE_URL + "/api/auth/login", data={"username": USERNAME, "password": PASSWORD})
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            results.setdefault(res.status_code, []).append(elapsed)
+
+
+def report(label: str, latencies: list):
+    print(f"   {label:<28} p50 {percentile(latencies, 50):8.1f} ms | p99 {percentile(latencies, 99):8.1f} ms"
+          f" | max {max(latencies):8.1f} ms | tb {statistics.mean(latencies):8.1f} ms")
+
+
+def main():
+    session = requests.Session()
+    res = session.post(BASE_URL + "/api/auth/login", data={"username": USERNAME, "password": PASSWORD})
+    if res.status_code != 200:
+        print(f"❌ Không đăng nhập được bằng {USERNAME}: {res.status_code} {res.text}")
+        sys.exit(1)
+
+    print(f"\n🔐 Đo {PROBES} request {PROBE_PATH} khi có {CONCURRENT_LOGINS} đăng nhập song song ({BASE_URL})")
+    session.get(BASE_URL + PROBE_PATH)  # Làm nóng kết nối
+    idle = probe_latencies(session)
+
+    stop, lock, logins = threading.Event(), threading.Lock(), {}
+    with ThreadPoolExecutor(max_workers=CONCURRENT_LOGINS) as pool:
+        for _ in range(CONCURRENT_LOGINS):
+            pool.submit(login_loop, stop, logins, lock)
+        time.sleep(0.5)  # Chờ đợt đăng nhập chạy đều
+        busy = probe_latencies(session)
+        stop.set()
+
+    report("Server rảnh", idle)
+    report("Trong lúc đăng nhập dồn", busy)
+    ok = logins.get(200, [])
+    if ok:
+        report(f"Đăng nhập ({len(ok)} lần OK)", ok)
+    rejected = {code: len(v) for code, v in logins.items() if code != 200}
+    if rejected:
+        print(f"   Đăng nhập bị từ chối: {rejected} (503 = vượt BCRYPT_MAX_PENDING)")
+
+
+if __name__ == "__main__":
+    main()
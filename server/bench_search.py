@@ -0,0 +1,76 @@
+# backend/bench_search.py
+# Đo độ trễ /api/search (search_service) trên số lượng lớn document (mặc định 1.000.000 sản phẩm).
+#
+# Chạy (cần MongoDB local): python bench_search.py [số_sản_phẩm]
+# Dữ liệu ghi vào database riêng "<DB_NAME>_bench" và bị xóa sau khi chạy.
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+from app import connect_database, DB_NAME
+from models import Product
+import search_service
+
+DOCS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+BATCH = 10_000
+RUNS = 200
+
+BRANDS = ["Apple", "Samsung", "Xiaomi", "Oppo", "Dell", "Asus", "Lenovo", "Sony", "Vivo", "Realme"]
+KINDS = ["Điện thoại", "Máy tính bảng", "Laptop", "Tai nghe", "Đồng hồ thông minh", "Sạc dự phòng", "Ốp lưng", "Cáp sạc"]
+WORDS = ["Pro", "Max", "Ultra", "Lite", "Plus", "Mini", "Xanh", "Đen", "Trắng", "Vàng", "Bạc", "Hồng"]
+
+QUERIES = [
+    "dien thoai samsung",   # Không dấu
+    "Điện thoại",           # Có dấu, rất nhiều kết quả
+    "tai nghe sony den",
+    "apple pro max",
+    "SKU-0123456",          # Đúng mã
+    "sku-01234",            # Tiền tố mã
+    "dong ho",
+    "xyz khong co",         # Không có kết quả
+]
+
+
+def _product(i: int) -> dict:
+    brand = random.choice(BRANDS)
+    name = f"{random.choice(KINDS)} {brand} {random.choice(WORDS)} {random.choice(WORDS)} {random.randint(1, 20)}"
+    doc = {"name": name, "sku": f"SKU-{i:07d}", "brand": brand, "category": "Phụ kiện", "location": "A-01",
+           "quantity": 0, "imeiCount": 0, "minStock": 0, "price": 0.0}
+    doc["searchTokens"] = search_service.document_tokens([doc["sku"], doc["name"], doc["brand"]])
+    return doc
+
+
+async def seed():
+    random.seed(19)
+    coll = Product.get_pymongo_collection()
+    for start in range(0, DOCS, BATCH):
+        await coll.insert_many([_product(i) for i in range(start, min(start + BATCH, DOCS))], ordered=False)
+
+
+async def main():
+    bench_db = f"{DB_NAME}_bench"
+    client = await connect_database(bench_db)
+    try:
+        start = time.perf_counter()
+        await seed()
+        print(f"\n🔍 Tìm kiếm trên {DOCS:,} sản phẩm (nạp dữ liệu {time.perf_counter() - start:.1f}s)")
+
+        for q in QUERIES:
+            timings = []
+            for _ in range(RUNS):
+                t = time.perf_counter()
+                hits = await search_service.search(q, ["product"])
+                timings.append((time.perf_counter() - t) * 1000)
+            timings.sort()
+            top = hits[0].title if hits else "-"
+            print(f"   {q!r:24} p50 {statistics.median(timings):7.2f} ms  p99 {timings[int(RUNS * 0.99) - 1]:7.2f} ms"
+                  f"  {len(hits):3} kết quả, đầu tiên: {top}")
+    finally:
+        await client.drop_database(bench_db)
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+# backend/bench_slotting.py
+# Đo thời gian lập + áp dụng kế hoạch tối ưu vị trí kho với số SKU lớn (mặc định 50.000).
+#
+# Chạy (cần MongoDB local): python bench_slotting.py [số_sku] [số_ngày_có_xuất]
+# Dữ liệu ghi vào database riêng "<DB_NAME>_bench" và bị xóa sau khi chạy.
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app import connect_database, DB_NAME
+from models import DailyStat, Product, TransactionType
+import slotting_service
+
+SKUS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+DAYS = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+
+async def seed():
+    random.seed(42)
+    now = datetime.now()
+    products = [
+        {"_id": ObjectId(), "name": f"Sản phẩm {i}", "sku": f"BENCH-{i:06d}", "category": "Laptop",
+         "location": f"{random.choice('ABC')}-{random.randint(1, 99):02d}", "quantity": 100,
+         "imeiCount": 0, "minStock": 0, "price": 0.0, "lastUpdated": now}
+        for i in range(SKUS)
+    ]
+    await Product.get_pymongo_collection().insert_many(products)
+
+    # Tốc độ xuất lệch kiểu Pareto: ít SKU xuất rất nhiều, đa số xuất ít
+    stats = []
+    for p in products:
+        rate = int(random.paretovariate(1.2))
+        for d in random.sample(range(DAYS), k=min(DAYS, 3)):
+            stats.append({"day": (now - timedelta(days=d)).strftime("%Y-%m-%d"), "productId": str(p["_id"]),
+                          "productName": p["name"], "type": TransactionType.EXPORT.value,
+                          "quantity": rate, "transactionCount": 1})
+    await DailyStat.get_pymongo_collection().insert_many(stats)
+
+
+async def main():
+    bench_db = f"{DB_NAME}_bench"
+    client = await connect_database(bench_db)
+    try:
+        await seed()
+        config = slotting_service.SlottingConfig(days=DAYS)
+
+        start = time.perf_counter()
+        velocity = await slotting_service.export_velocity(config.days)
+        t_velocity = time.perf_counter() - start
+
+        plan = await slotting_service.plan(config)
+        t_plan = time.perf_counter() - start
+
+        start = time.perf_counter()
+        logs = await slotting_service.apply_moves(plan.moves)
+        t_apply = time.perf_counter() - start
+
+        print(f"\n🗺️  Tối ưu vị trí cho {SKUS:,} SKU ({len(velocity):,} SKU có xuất trong {DAYS} ngày)")
+        print(f"   Tốc độ xuất (aggregate): {t_velocity:6.2f}s")
+        print(f"   Lập kế hoạch (tổng):     {t_plan:6.2f}s -> {len(plan.moves):,} lượt chuyển, hiệu suất {plan.efficiency}%")
+        print(f"   Chi phí di chuyển:       {plan.travelCostBefore:,.0f} -> {plan.travelCostAfter:,.0f}")
+        print(f"   Áp dụng (bulk write):    {t_apply:6.2f}s -> {len(logs):,} MovementLog")
+
+        after = await slotting_service.plan(config)
+        print(f"   Lập lại sau khi áp dụng: {len(after.moves)} lượt chuyển, hiệu suất {after.efficiency}%")
+    finally:
+        await client.drop_database(bench_db)
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
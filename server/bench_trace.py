@@ -0,0 +1,97 @@
+# backend/bench_trace.py
+# Đo thời gian truy vết IMEI: 1 IMEI (p50/p99) và hàng loạt (thu hồi theo lô).
+#
+# Chạy (cần MongoDB local): python bench_trace.py [số_imei] [số_imei_truy_vết_hàng_loạt]
+# Dữ liệu ghi vào database riêng "<DB_NAME>_bench" và bị xóa sau khi chạy.
+import asyncio
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app import connect_database, DB_NAME
+from models import MovementLog, Product, SerialUnit, StocktakeSession, Transaction, TransactionType, WarrantyTicket
+import trace_service
+
+IMEIS = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+BULK = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+PRODUCTS = 500
+PER_RECEIPT = 20  # Số IMEI mỗi phiếu nhập
+SINGLE_RUNS = 500
+
+
+async def seed():
+    random.seed(7)
+    start = datetime.now() - timedelta(days=365)
+    products = [{"_id": ObjectId(), "name": f"Điện thoại {i}", "sku": f"TR-{i:04d}", "category": "Điện thoại",
+                 "location": "A-01", "quantity": 0, "imeiCount": 0, "minStock": 0, "price": 0.0, "lastUpdated": start}
+                for i in range(PRODUCTS)]
+    await Product.get_pymongo_collection().insert_many(products)
+
+    transactions, units, movements, tickets, stocktakes = [], [], [], [], []
+    for n in range(0, IMEIS, PER_RECEIPT):
+        product = random.choice(products)
+        pid = str(product["_id"])
+        imeis = [f"35{i:013d}" for i in range(n, min(n + PER_RECEIPT, IMEIS))]
+        received = start + timedelta(minutes=random.randint(0, 300 * 24 * 60))
+        transactions.append({"productId": pid, "productName": product["name"], "type": TransactionType.IMPORT.value,
+                             "quantity": len(imeis), "imeis": imeis, "date": received})
+        sold = imeis[: len(imeis) // 2]
+        sold_at = received + timedelta(days=random.randint(1, 60))
+        transactions.append({"productId": pid, "productName": product["name"], "type": TransactionType.EXPORT.value,
+                             "quantity": len(sold), "imeis": sold, "date": sold_at, "partner": "Khách lẻ"})
+        movements.append({"productId": pid, "productName": product["name"], "sku": product["sku"],
+                          "fromLocation": "A-01", "toLocation": "B-02", "date": received + timedelta(hours=5)})
+        units += [{"imei": i, "productId": pid, "status": "SOLD" if i in sold else "IN_STOCK", "location": "B-02",
+                   "updatedAt": sold_at} for i in imeis]
+        if random.random() < 0.2:
+            tickets.append({"customer_name": "Khách", "customer_phone": "0900000000", "product_name": product["name"],
+                            "imei": sold[0], "issue_description": "Lỗi màn hình", "status": "Đã nhận", "cost": 0,
+                            "received_date": sold_at + timedelta(days=10)})
+        if random.random() < 0.05:
+            stocktakes.append({"date": received + timedelta(days=1), "status": "COMPLETED", "totalDifference": 0,
+                               "items": [{"productId": pid, "productName": product["name"], "sku": product["sku"],
+                                          "systemQuantity": 10, "actualQuantity": 10, "difference": 0}]})
+
+    await Transaction.get_pymongo_collection().insert_many(transactions)
+    await SerialUnit.get_pymongo_collection().insert_many(units)
+    await MovementLog.get_pymongo_collection().insert_many(movements)
+    if tickets:
+        await WarrantyTicket.get_pymongo_collection().insert_many(tickets)
+    if stocktakes:
+        await StocktakeSession.get_pymongo_collection().insert_many(stocktakes)
+
+
+async def main():
+    bench_db = f"{DB_NAME}_bench"
+    client = await connect_database(bench_db)
+    try:
+        await seed()
+        all_imeis = [f"35{i:013d}" for i in range(IMEIS)]
+
+        timings = []
+        for imei in random.sample(all_imeis, SINGLE_RUNS):
+            start = time.perf_counter()
+            await trace_service.trace(imei)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+
+        batch = random.sample(all_imeis, min(BULK, IMEIS))
+        start = time.perf_counter()
+        traces = await trace_service.trace_many(batch)
+        t_bulk = time.perf_counter() - start
+        events = sum(len(t.events) for t in traces)
+
+        print(f"\n🔎 Truy vết IMEI trên {IMEIS:,} máy")
+        print(f"   1 IMEI:    p50 {statistics.median(timings):6.2f} ms   p99 {timings[int(len(timings) * 0.99) - 1]:6.2f} ms")
+        print(f"   {len(batch):,} IMEI: {t_bulk:6.2f}s -> {events:,} sự kiện")
+    finally:
+        await client.drop_database(bench_db)
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
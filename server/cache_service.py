@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from cachetools import TTLCache
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+# Cache phản hồi cho các API đọc nhiều, ít thay đổi (brands, partners, products, dashboard stats):
+# - Key = đường dẫn + query string; mỗi entry ghi lại phiên bản (version) của các collection nó phụ thuộc
+# - Handler ghi dữ liệu gọi bump("products", ...) -> version tăng -> entry cũ không còn được dùng (write-through)
+# - ETag = hash nội dung JSON (strong ETag). Client gửi If-None-Match trùng -> 304, không truy vấn DB, không gửi body
+# - LRU + TTL (RESPONSE_CACHE_TTL giây) giới hạn độ cũ khi dữ liệu bị sửa ngoài các handler
+#   (script chạy tay, tiến trình server khác)
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "30"))
+
+# Tên version dùng chung giữa handler ghi và API đọc
+BRANDS = "brands"
+PARTNERS = "partners"
+PRODUCTS = "products"
+STATS = "stats"  # daily_stats + stat_counters (Dashboard)
+
+_versions: Dict[str, int] = {}
+_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+_stats = {"hits": 0, "misses": 0, "notModified": 0, "bumps": 0}
+
+
+def bump(*names: str):
+    """
+    Đánh dấu dữ liệu đã thay đổi (gọi sau khi ghi xong)
+    """
+    for name in names:
+        _versions[name] = _versions.get(name, 0) + 1
+        _stats["bumps"] += 1
+
+
+def _key(request: Request) -> str:
+    query = sorted(request.query_params.multi_items())
+    return request.url.path + "?" + "&".join(f"{k}={v}" for k, v in query)
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in header.split(",")]
+
+
+def _reply(request: Request, body: bytes, etag: str, headers: Dict[str, str]) -> Response:
+    # no-cache: trình duyệt được lưu nhưng phải hỏi lại server (kèm If-None-Match) trước khi dùng
+    headers = {**headers, "ETag": etag, "Cache-Control": "no-cache"}
+    if _matches(request, etag):
+        _stats["notModified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def cached(
+    request: Request,
+    depends_on: Iterable[str],
+    produce: Callable[[], Awaitable[Any]],
+    response: Optional[Response] = None,
+) -> Response:
+    """
+    Trả phản hồi đã cache nếu các collection phụ thuộc chưa đổi, ngược lại gọi produce() rồi cache lại.
+    response: Response mà handler inject (để giữ lại header do produce() đặt, VD: X-Next-Cursor).
+    """
+    key = _key(request)
+    versions = tuple(_versions.get(name, 0) for name in depends_on)
+    entry = _cache.get(key)
+    if entry is not None and entry[0] == versions:
+        _stats["hits"] += 1
+        return _reply(request, *entry[1:])
+
+    _stats["misses"] += 1
+    result = await produce()
+    if isinstance(result, Response):
+        # VD: format=ndjson trả StreamingResponse -> không cache
+        return result
+    body = json.dumps(jsonable_encoder(result), ensure_ascii=False, separators=(",", ":")).encode()
+    headers = {k: v for k, v in (response.headers.items() if response else []) if k.lower() != "content-length"}
+    etag = _etag(body)
+    _cache[key] = (versions, body, etag, headers)
+    return _reply(request, body, etag, headers)
+
+
+def get_stats() -> dict:
+    return {**_stats, "entries": len(_cache), "maxsize": RESPONSE_CACHE_SIZE, "ttl": RESPONSE_CACHE_TTL,
+            "versions": dict(_versions)}
@@ -0,0 +1,77 @@
+# backend/check_ai_cache.py
+# Kiểm tra cache / coalescing / ngân sách token của ai_service bằng model giả (không tốn quota Gemini):
+# - 10 request phân tích giống nhau cùng lúc -> chỉ 1 lần gọi model
+# - Gọi lại khi kho không đổi -> trúng cache
+# - Tồn kho thay đổi -> gọi model lại
+# - Kho lớn -> prompt vẫn nằm trong AI_PROMPT_TOKENS
+#
+# Chạy (cần MongoDB local): python check_ai_cache.py [số_sản_phẩm]
+# Dữ liệu ghi vào database riêng "<DB_NAME>_aicheck" và bị xóa sau khi chạy.
+import asyncio
+import os
+import sys
+
+os.environ["AI_FAKE_MODEL"] = "true"
+
+from app import connect_database, DB_NAME
+from models import Product, Transaction, TransactionType
+import ai_service
+import stock_service
+
+PRODUCTS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+
+async def run_checks() -> bool:
+    products = [
+        Product(name=f"Sản phẩm {i}", sku=f"AI-{i:05d}", category="Laptop", location="A-01",
+                quantity=i % 20, minStock=5, price=1000 + i)
+        for i in range(PRODUCTS)
+    ]
+    await Product.insert_many(products)
+    first = await Product.find_one(Product.sku == "AI-00001")
+
+    checks = {}
+    stats = ai_service.get_stats()
+    await asyncio.gather(*(ai_service.analyze_inventory_service() for _ in range(10)))
+    after = ai_service.get_stats()
+    checks["10 request cùng lúc chỉ gọi model 1 lần"] = after["modelCalls"] - stats["modelCalls"] == 1
+    checks["9 request chờ chung"] = after["coalesced"] - stats["coalesced"] == 9
+
+    await ai_service.analyze_inventory_service()
+    checks["gọi lại khi kho không đổi -> trúng cache"] = ai_service.get_stats()["hits"] == after["hits"] + 1
+
+    await stock_service.apply_transaction(Transaction(
+        productId=str(first.id), productName=first.name, type=TransactionType.IMPORT, quantity=3,
+    ))
+    calls = ai_service.get_stats()["modelCalls"]
+    await ai_service.analyze_inventory_service()
+    checks["tồn kho đổi -> gọi model lại"] = ai_service.get_stats()["modelCalls"] == calls + 1
+
+    tokens = ai_service.get_stats()["promptTokens"]
+    answer = await ai_service.ask_gemini_service("Sản phẩm nào sắp hết hàng?")
+    used = ai_service.get_stats()["promptTokens"] - tokens
+    checks[f"prompt chat trong ngân sách ({used} / {ai_service.AI_PROMPT_TOKENS} token + phần hướng dẫn)"] = \
+        used <= ai_service.AI_PROMPT_TOKENS + 500
+    checks["chat có câu trả lời"] = bool(answer)
+
+    print(f"\n🤖 Kiểm tra ai_service với model giả, {PRODUCTS} sản phẩm")
+    for label, ok in checks.items():
+        print(f"   {'✅' if ok else '❌'} {label}")
+    print(f"   {ai_service.get_stats()}")
+    return all(checks.values())
+
+
+async def main():
+    check_db = f"{DB_NAME}_aicheck"
+    client = await connect_database(check_db)
+    try:
+        ok = await run_checks()
+    finally:
+        await client.drop_database(check_db)
+        await client.close()
+    print("\n✅ ĐẠT" if ok else "\n❌ KHÔNG ĐẠT")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
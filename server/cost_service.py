@@ -0,0 +1,406 @@
+import asyncio
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pydantic import BaseModel
+from pymongo import InsertOne, UpdateOne
+
+import mongo_service
+import stats_service
+from models import CostLayer, DailyStat, Product, ProductCost, Transaction, TransactionType
+
+# Tính giá vốn tồn kho tăng dần ngay khi ghi, không tính lại từ đầu mỗi lần xuất báo cáo:
+# - Mỗi phiếu nhập tạo 1 lô giá vốn (cost_layers); phiếu xuất lấy dần từ lô cũ nhất (FIFO)
+#   hoặc theo giá vốn bình quân di động (COSTING_METHOD=average)
+# - Giá trị tồn + giá vốn hàng bán cộng dồn của từng sản phẩm lưu ở product_costs
+# - Giá vốn của từng phiếu ghi lại vào Transaction (unitCost, costAmount) và cộng vào daily_stats.cost
+#   -> báo cáo giá trị tồn kho O(số sản phẩm), giá vốn hàng bán theo kỳ O(số ngày x số sản phẩm)
+# Phiếu nhập không gửi unitCost: lấy giá vốn bình quân hiện tại, chưa có thì lấy đơn giá sản phẩm.
+# Các thay đổi của cùng 1 sản phẩm được xử lý tuần tự theo đúng thứ tự engine tồn kho đã ghi:
+# mỗi thay đổi mang Product.ledgerSeq sau lệnh cập nhật tồn kho (như sổ kho), product_costs.lastSeq = seq đã tính.
+# Thay đổi đến sớm chờ các seq trước (tối đa COST_ORDER_TIMEOUT giây, VD seq của lệnh hoàn tác không có bước
+# tính giá vốn hoặc do tiến trình khác ghi) rồi mới tính.
+# Tính giá vốn chạy sau khi phiếu đã lưu: lỗi chỉ ghi log (không trả 500 cho phiếu đã lưu), chạy lại cost_service.py để đối soát.
+# Đổi COSTING_METHOD hoặc dữ liệu có trước: chạy python cost_service.py để tính lại từ lịch sử.
+
+COSTING_METHOD = os.getenv("COSTING_METHOD", "fifo").lower()
+FIFO = "fifo"
+AVERAGE = "average"
+COST_ORDER_TIMEOUT = float(os.getenv("COST_ORDER_TIMEOUT", "5"))
+
+_turns: Dict[str, asyncio.Condition] = defaultdict(asyncio.Condition)
+_done: Dict[str, int] = {}  # productId -> seq lớn nhất đã tính (hoặc đã bỏ qua) trong tiến trình này
+
+
+class ProductValuation(BaseModel):
+    productId: str
+    productName: str
+    sku: Optional[str] = None
+    category: Optional[str] = None
+    quantity: int
+    value: float
+    avgCost: float
+    cogs: float  # Giá vốn hàng bán (trong kỳ nếu có date_from/date_to, ngược lại cộng dồn)
+
+
+class ValuationReport(BaseModel):
+    method: str
+    totalQuantity: int = 0
+    totalValue: float = 0
+    totalCogs: float = 0
+    items: List[ProductValuation] = []
+
+
+def _money(value: float) -> float:
+    return round(value, 2)
+
+
+class _CostState:
+    """
+    Giá vốn của 1 sản phẩm trong bộ nhớ: tồn, giá trị, các lô còn hàng (FIFO).
+    Ghi lại những gì đã đổi qua layer_ops().
+    """
+
+    def __init__(self, product_id: str, name: str, doc: Optional[dict] = None, layers: Optional[List[dict]] = None):
+        self.product_id = product_id
+        self.name = name
+        self.quantity = doc.get("quantity", 0) if doc else 0
+        self.value = doc.get("value", 0.0) if doc else 0.0
+        self.cogs = doc.get("cogs", 0.0) if doc else 0.0
+        self.last_seq: Optional[int] = doc.get("lastSeq") if doc else None
+        self.layers = layers or []
+        self._new: Dict[ObjectId, dict] = {}
+        self._touched: Dict[ObjectId, dict] = {}
+
+    def avg_cost(self) -> Optional[float]:
+        return self.value / self.quantity if self.quantity > 0 else None
+
+    def receive(self, quantity: int, unit_cost: float, ref: Optional[str], date: datetime) -> float:
+        amount = quantity * unit_cost
+        self.quantity += quantity
+        self.value = _money(self.value + amount)
+        if COSTING_METHOD == FIFO:
+            layer = {"_id": ObjectId(), "productId": self.product_id, "refId": ref, "date": date,
+                     "quantity": quantity, "remaining": quantity, "unitCost": unit_cost}
+            self.layers.append(layer)
+            self._new[layer["_id"]] = layer
+        return _money(amount)
+
+    def issue(self, quantity: int, fallback: float) -> float:
+        """
+        Xuất quantity đơn vị, trả về giá vốn. Thiếu lô (dữ liệu cũ) thì phần thiếu tính theo giá bình quân / fallback.
+        """
+        cost, left = 0.0, quantity
+        if COSTING_METHOD == FIFO:
+            while left and self.layers:
+                layer = self.layers[0]
+                take = min(left, layer["remaining"])
+                cost += take * layer["unitCost"]
+                layer["remaining"] -= take
+                left -= take
+                if layer["_id"] not in self._new:
+                    self._touched[layer["_id"]] = layer
+                if not layer["remaining"]:
+                    self.layers.pop(0)
+        if left:
+            avg = self.avg_cost()
+            cost += left * (avg if avg is not None else fallback)
+        cost = _money(cost)
+        # Không chặn về 0: số lượng giá vốn phải luôn khớp tồn kho thật
+        self.quantity -= quantity
+        self.value = _money(self.value - cost) if self.quantity > 0 else 0.0
+        return cost
+
+    def layer_ops(self) -> list:
+        ops = [InsertOne(layer) for layer in self._new.values()]
+        ops += [UpdateOne({"_id": _id}, {"$set": {"remaining": layer["remaining"]}}) for _id, layer in self._touched.items()]
+        self._new, self._touched = {}, {}
+        return ops
+
+    def cost_op(self) -> UpdateOne:
+        return UpdateOne({"productId": self.product_id}, {"$set": {
+            "productName": self.name, "method": COSTING_METHOD, "quantity": self.quantity,
+            "value": self.value, "cogs": self.cogs, "lastSeq": self.last_seq, "updatedAt": datetime.now(),
+        }}, upsert=True)
+
+
+async def _load_state(product_id: str, name: str) -> _CostState:
+    doc = await ProductCost.get_pymongo_collection().find_one({"productId": product_id})
+    layers = []
+    if COSTING_METHOD == FIFO:
+        layers = await CostLayer.get_pymongo_collection().find(
+            {"productId": product_id, "remaining": {"$gt": 0}}
+        ).sort([("date", 1), ("_id", 1)]).to_list()
+    return _CostState(product_id, name, doc, layers)
+
+
+def _fallback(state: _CostState, product: Product) -> float:
+    avg = state.avg_cost()
+    return avg if avg is not None else float(product.price or 0)
+
+
+async def _save(states: Iterable[_CostState]):
+    layer_ops, cost_ops = [], []
+    for state in states:
+        layer_ops += state.layer_ops()
+        cost_ops.append(state.cost_op())
+    if layer_ops:
+        await CostLayer.get_pymongo_collection().bulk_write(layer_ops, ordered=True)
+    if cost_ops:
+        await ProductCost.get_pymongo_collection().bulk_write(cost_ops, ordered=False)
+
+
+def _apply(state: _CostState, trans: Transaction, product: Product):
+    # Gán giá vốn cho 1 phiếu (sửa trực tiếp trên trans)
+    if trans.type == TransactionType.IMPORT:
+        unit_cost = trans.unitCost if trans.unitCost is not None else _fallback(state, product)
+        trans.unitCost = unit_cost
+        trans.costAmount = state.receive(trans.quantity, unit_cost, str(trans.id) if trans.id else None, trans.date)
+    else:
+        trans.costAmount = state.issue(trans.quantity, _fallback(state, product))
+        trans.unitCost = _money(trans.costAmount / trans.quantity)
+        if not trans.stocktakeId:
+            state.cogs = _money(state.cogs + trans.costAmount)
+
+
+def _daily_cost_ops(transactions: List[Transaction]) -> list:
+    # Cộng giá vốn vào daily_stats (cùng key với stats_service; phiếu kiểm kê không có dòng thống kê)
+    costs = defaultdict(float)
+    for t in transactions:
+        if not t.stocktakeId and t.costAmount:
+            costs[(stats_service.day_key(t.date), t.productId, t.type.value)] += t.costAmount
+    return [
+        UpdateOne({"day": day, "productId": pid, "type": type}, {"$inc": {"cost": _money(cost)}}, upsert=True)
+        for (day, pid, type), cost in costs.items()
+    ]
+
+
+async def _in_order(product_id: str, name: str, seq: Optional[int], work: Callable[[_CostState], None]):
+    """
+    Chạy work trên giá vốn của sản phẩm theo thứ tự seq (Product.ledgerSeq sau lệnh cập nhật tồn kho)
+    """
+    turn = _turns[product_id]
+    async with turn:
+        state = await _load_state(product_id, name)
+        if product_id not in _done and state.last_seq is not None:
+            _done[product_id] = state.last_seq
+        last = _done.get(product_id)
+        if seq is not None and last is not None and seq > last + 1:
+            try:
+                await asyncio.wait_for(turn.wait_for(lambda: _done.get(product_id, seq) >= seq - 1), COST_ORDER_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"⚠️  Giá vốn {product_id}: chờ seq {_done.get(product_id)} -> {seq} quá lâu, tính tiếp")
+            state = await _load_state(product_id, name)
+        try:
+            work(state)
+            if seq is not None:
+                state.last_seq = max(seq, state.last_seq or seq)
+            await _save([state])
+        finally:
+            # Lỗi cũng đánh dấu đã qua để các thay đổi sau không phải chờ
+            if seq is not None:
+                _done[product_id] = max(seq, _done.get(product_id, seq))
+            turn.notify_all()
+
+
+async def skip(product_id: str, seq: int):
+    """
+    seq không có bước tính giá vốn (VD: lệnh hoàn tác tồn kho) -> các thay đổi sau không phải chờ
+    """
+    turn = _turns[product_id]
+    async with turn:
+        _done[product_id] = max(seq, _done.get(product_id, seq))
+        turn.notify_all()
+
+
+async def record_transactions(transactions: List[Transaction], products: Dict[str, Product]):
+    """
+    Tính giá vốn cho các phiếu vừa áp dụng (theo thứ tự trong phiếu), ghi unitCost / costAmount vào Transaction.
+    products: sản phẩm SAU khi cập nhật tồn kho (ledgerSeq của lệnh cập nhật).
+    """
+    by_product: Dict[str, List[Transaction]] = defaultdict(list)
+    for t in transactions:
+        if t.productId in products:
+            by_product[t.productId].append(t)
+
+    try:
+        for pid, group in by_product.items():
+            def work(state: _CostState, group=group, product=products[pid]):
+                for t in group:
+                    _apply(state, t, product)
+            await _in_order(pid, products[pid].name, products[pid].ledgerSeq, work)
+
+        ops = [
+            UpdateOne({"_id": t.id}, {"$set": {"unitCost": t.unitCost, "costAmount": t.costAmount}})
+            for group in by_product.values() for t in group if t.id
+        ]
+        if ops:
+            await Transaction.get_pymongo_collection().bulk_write(ops, ordered=False)
+        daily_ops = _daily_cost_ops([t for group in by_product.values() for t in group])
+        if daily_ops:
+            await DailyStat.get_pymongo_collection().bulk_write(daily_ops, ordered=False)
+    except Exception as e:
+        # Phiếu đã lưu: không trả lỗi (client sẽ gửi lại -> ghi trùng), chạy python cost_service.py để tính lại
+        print(f"❌ Không tính được giá vốn cho {len(transactions)} phiếu: {e}")
+
+
+async def record_adjustment(product: Product, delta: int):
+    """
+    Số lượng sửa trực tiếp trên sản phẩm (tạo mới, form sửa): tăng -> lô mới theo giá vốn hiện tại / đơn giá,
+    giảm -> xuất như phiếu xuất nhưng không tính vào giá vốn hàng bán
+    """
+    if not delta:
+        return
+
+    def work(state: _CostState):
+        if delta > 0:
+            state.receive(delta, _fallback(state, product), None, datetime.now())
+        else:
+            state.issue(-delta, _fallback(state, product))
+
+    try:
+        await _in_order(str(product.id), product.name, product.ledgerSeq, work)
+    except Exception as e:
+        print(f"❌ Không tính được giá vốn cho {product.name}: {e}")
+
+
+async def remove(product_id: str):
+    # Sản phẩm bị xóa: bỏ giá vốn + các lô còn hàng
+    async with _turns[product_id]:
+        await ProductCost.get_pymongo_collection().delete_one({"productId": product_id})
+        await CostLayer.get_pymongo_collection().delete_many({"productId": product_id})
+    _turns.pop(product_id, None)
+    _done.pop(product_id, None)
+
+
+# --- BÁO CÁO ---
+
+async def valuation(date_from: Optional[datetime] = None, date_to: Optional[datetime] = None) -> ValuationReport:
+    """
+    Giá trị tồn kho theo giá vốn (đọc từ product_costs) + giá vốn hàng bán trong kỳ (daily_stats) nếu có kỳ
+    """
+    costs = await mongo_service.reports(ProductCost).find({}).to_list()
+    period_cogs = None
+    if date_from or date_to:
+        day_range = {}
+        if date_from:
+            day_range["$gte"] = stats_service.day_key(date_from)
+        if date_to:
+            day_range["$lte"] = stats_service.day_key(date_to)
+        cursor = await mongo_service.reports(DailyStat).aggregate([
+            {"$match": {"day": day_range, "type": TransactionType.EXPORT.value}},
+            {"$group": {"_id": "$productId", "cost": {"$sum": "$cost"}}},
+        ])
+        period_cogs = {row["_id"]: row["cost"] async for row in cursor}
+
+    products = {
+        str(d["_id"]): d
+        for d in await mongo_service.reports(Product).find({}, {"sku": 1, "category": 1}).to_list()
+    }
+    report = ValuationReport(method=COSTING_METHOD)
+    for c in costs:
+        product = products.get(c["productId"], {})
+        quantity, value = c.get("quantity", 0), c.get("value", 0.0)
+        cogs = c.get("cogs", 0.0) if period_cogs is None else period_cogs.get(c["productId"], 0.0)
+        report.items.append(ProductValuation(
+            productId=c["productId"], productName=c.get("productName", ""), sku=product.get("sku"),
+            category=product.get("category"), quantity=quantity, value=value,
+            avgCost=_money(value / quantity) if quantity else 0.0, cogs=_money(cogs),
+        ))
+        report.totalQuantity += quantity
+        report.totalValue += value
+        report.totalCogs += cogs
+    report.totalValue, report.totalCogs = _money(report.totalValue), _money(report.totalCogs)
+    report.items.sort(key=lambda i: (i.sku or "", i.productName))
+    return report
+
+
+async def cost_map() -> Dict[str, dict]:
+    # productId -> {quantity, value} cho file xuất tồn kho
+    cursor = mongo_service.reports(ProductCost).find({}, {"productId": 1, "quantity": 1, "value": 1})
+    return {doc["productId"]: doc async for doc in cursor}
+
+
+# --- TÍNH LẠI TỪ LỊCH SỬ ---
+
+async def rebuild(batch_size: int = 5000) -> dict:
+    """
+    Tính lại toàn bộ giá vốn từ lịch sử phiếu nhập/xuất theo COSTING_METHOD.
+    Tồn đầu kỳ (tồn hiện tại - tổng nhập/xuất, phần nhập qua form sản phẩm) tính theo đơn giá sản phẩm.
+    """
+    await CostLayer.find_all().delete()
+    await ProductCost.find_all().delete()
+    await DailyStat.get_pymongo_collection().update_many({}, {"$set": {"cost": 0}})
+
+    products = {
+        str(d["_id"]): Product.model_construct(id=d["_id"], name=d["name"], price=d.get("price", 0.0), quantity=d.get("quantity", 0),
+                                               ledgerSeq=d.get("ledgerSeq", 0))
+        for d in await Product.get_pymongo_collection().find({}, {"name": 1, "price": 1, "quantity": 1, "ledgerSeq": 1}).to_list()
+    }
+    cursor = await Transaction.get_pymongo_collection().aggregate([
+        {"$group": {"_id": "$productId", "net": {"$sum": {"$cond": [
+            {"$eq": ["$type", TransactionType.IMPORT.value]}, "$quantity", {"$multiply": ["$quantity", -1]},
+        ]}}}},
+    ])
+    net = {row["_id"]: row["net"] async for row in cursor}
+
+    states: Dict[str, _CostState] = {}
+    for pid, product in products.items():
+        state = states[pid] = _CostState(pid, product.name)
+        state.last_seq = product.ledgerSeq
+        opening = product.quantity - net.get(pid, 0)
+        if opening > 0:
+            state.receive(opening, float(product.price or 0), None, datetime.min)
+
+    ops, daily, count = [], [], 0
+    coll = Transaction.get_pymongo_collection()
+
+    async def flush():
+        await coll.bulk_write(ops, ordered=False)
+        daily_ops = _daily_cost_ops(daily)
+        if daily_ops:
+            await DailyStat.get_pymongo_collection().bulk_write(daily_ops, ordered=False)
+        # Ghi dần các lô để không giữ toàn bộ lịch sử lô trong bộ nhớ
+        layer_ops = [op for state in states.values() for op in state.layer_ops()]
+        if layer_ops:
+            await CostLayer.get_pymongo_collection().bulk_write(layer_ops, ordered=True)
+        ops.clear()
+        daily.clear()
+    cursor = coll.find({}, batch_size=batch_size).sort([("date", 1), ("_id", 1)])
+    async for doc in cursor:
+        pid = doc["productId"]
+        if pid not in products:
+            continue  # Sản phẩm đã xóa
+        trans = Transaction.model_construct(
+            id=doc["_id"], productId=pid, type=TransactionType(doc["type"]), quantity=doc["quantity"],
+            date=doc["date"], stocktakeId=doc.get("stocktakeId"), unitCost=doc.get("unitCost"),
+        )
+        if trans.type == TransactionType.EXPORT:
+            trans.unitCost = None
+        _apply(states[pid], trans, products[pid])
+        ops.append(UpdateOne({"_id": trans.id}, {"$set": {"unitCost": trans.unitCost, "costAmount": trans.costAmount}}))
+        daily.append(trans)
+        count += 1
+        if len(ops) >= batch_size:
+            await flush()
+    if ops:
+        await flush()
+
+    await _save(states.values())
+    _done.clear()
+    return {"method": COSTING_METHOD, "transactions": count, "products": len(states)}
+
+
+if __name__ == "__main__":
+    # Chạy: python cost_service.py  -> tính lại giá vốn (COSTING_METHOD=fifo|average) từ lịch sử
+    from app import connect_database
+
+    async def main():
+        await connect_database()
+        result = await rebuild()
+        print(f"✅ Đã tính lại giá vốn: {result}")
+
+    asyncio.run(main())
@@ -0,0 +1,254 @@
+import asyncio
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import xlsxwriter
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+import cost_service
+import mongo_service
+import query_service
+from models import Product, StocktakeSession, StocktakeStatus, Transaction, TransactionType, WarrantyTicket
+
+# Xuất báo cáo không giữ toàn bộ dữ liệu trong RAM:
+# - Đọc MongoDB bằng cursor theo lô (BATCH_SIZE), chỉ lấy các trường cần xuất
+# - CSV: gửi dần từng khối CSV_CHUNK_ROWS dòng ngay khi đọc xong
+# - XLSX: xlsxwriter constant_memory ghi từng dòng ra file tạm, gửi file xong thì xóa
+#   (xlsx là file zip nên chỉ gửi được khi đã ghi xong, nhưng bộ nhớ không tăng theo số dòng)
+
+BATCH_SIZE = 2000
+CSV_CHUNK_ROWS = 1000
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_FORMATS = ("xlsx", "csv")
+
+INVENTORY_COLUMNS = [
+    ("Mã SKU", 15), ("Tên Sản Phẩm", 30), ("Danh Mục", 15), ("Vị Trí", 12),
+    ("Số Lượng Tồn", 12), ("Định Mức Tối Thiểu", 12), ("Đơn Giá", 15), ("Giá Vốn BQ", 15), ("Giá Trị Tồn (Giá Vốn)", 18),
+]
+TRANSACTION_COLUMNS = [
+    ("Ngày Giao Dịch", 12), ("Giờ", 12), ("Loại Phiếu", 15), ("Mã SKU", 15),
+    ("Tên Sản Phẩm", 30), ("Số Lượng", 10), ("Đối Tác", 25), ("Ghi Chú", 30),
+]
+
+
+async def _sku_map() -> Dict[str, str]:
+    # Chỉ lấy _id + sku của sản phẩm để tra SKU cho từng phiếu
+    cursor = mongo_service.reports(Product).find({}, {"sku": 1}, batch_size=BATCH_SIZE)
+    return {str(doc["_id"]): doc.get("sku") async for doc in cursor}
+
+
+async def inventory_rows(category: Optional[str] = None) -> AsyncIterator[list]:
+    # Giá trị tồn theo giá vốn đã tính sẵn lúc nhập/xuất (cost_service), không phải số lượng x đơn giá bán
+    costs = await cost_service.cost_map()
+    filters = {"category": category} if category else {}
+    projection = {"sku": 1, "name": 1, "category": 1, "location": 1, "quantity": 1, "minStock": 1, "price": 1}
+    cursor = mongo_service.reports(Product).find(filters, projection, batch_size=BATCH_SIZE).sort("sku", 1)
+    async for p in cursor:
+        cost = costs.get(str(p["_id"]), {})
+        value, costed = cost.get("value", 0.0), cost.get("quantity", 0)
+        yield [p.get("sku"), p.get("name"), p.get("category"), p.get("location"),
+               p.get("quantity", 0), p.get("minStock", 0), p.get("price", 0.0),
+               round(value / costed, 2) if costed else 0, value]
+
+
+def transaction_filter(date_from: Optional[datetime], date_to: Optional[datetime],
+                       type: Optional[TransactionType]) -> dict:
+    return query_service.combine(
+        {"type": type.value} if type else {},
+        query_service.date_filter("date", date_from, date_to),
+    )
+
+
+async def transaction_rows(filters: dict, totals: Dict[str, int]) -> AsyncIterator[list]:
+    """
+    Các dòng lịch sử nhập xuất (mới nhất trước), cộng dồn tổng nhập/xuất vào totals
+    """
+    # SKU đã chép vào phiếu lúc ghi (sản phẩm đã xóa: ""); chỉ phiếu cũ chưa chạy backfill mới phải tra bảng sản phẩm
+    product_map = None
+    projection = {"date": 1, "type": 1, "productId": 1, "productName": 1, "sku": 1, "quantity": 1, "partner": 1, "notes": 1}
+    cursor = mongo_service.reports(Transaction).find(filters, projection, batch_size=BATCH_SIZE).sort("date", -1)
+    async for t in cursor:
+        is_import = t.get("type") == TransactionType.IMPORT.value
+        totals["import" if is_import else "export"] += t.get("quantity", 0)
+        sku = t.get("sku")
+        if sku is None:
+            if product_map is None:
+                product_map = await _sku_map()
+            sku = product_map.get(t.get("productId"))
+        yield [
+            t["date"].strftime("%d/%m/%Y"),
+            t["date"].strftime("%H:%M"),
+            "Nhập Kho" if is_import else "Xuất Kho",
+            sku or "N/A",
+            t.get("productName"),
+            t.get("quantity", 0),
+            t.get("partner") or "",
+            t.get("notes") or "",
+        ]
+
+
+def transaction_footer(totals: Dict[str, int]) -> List[list]:
+    # Dòng trống + tổng nhập + tổng xuất (cột Tên Sản Phẩm / Số Lượng)
+    return [
+        [],
+        ["", "", "", "", "TỔNG NHẬP:", totals["import"]],
+        ["", "", "", "", "TỔNG XUẤT:", totals["export"]],
+    ]
+
+
+STOCKTAKE_VARIANCE_COLUMNS = [
+    ("Ngày Kiểm Kê", 12), ("Mã Phiếu", 26), ("Mã SKU", 15), ("Tên Sản Phẩm", 30),
+    ("Tồn Hệ Thống", 12), ("Thực Tế", 10), ("Chênh Lệch", 10), ("Ghi Chú", 30),
+]
+WARRANTY_COLUMNS = [
+    ("Mã Phiếu", 18), ("Ngày Nhận", 12), ("Khách Hàng", 22), ("SĐT", 14), ("Tên Máy", 25),
+    ("IMEI", 18), ("Mô Tả Lỗi", 30), ("Trạng Thái", 15), ("Chi Phí", 12), ("Ngày Trả", 12),
+]
+
+
+async def stocktake_variance_rows(date_from: Optional[datetime], date_to: Optional[datetime]) -> AsyncIterator[list]:
+    """
+    Các dòng có chênh lệch của phiếu kiểm kê đã hoàn tất (mới nhất trước)
+    """
+    filters = query_service.combine(
+        {"status": StocktakeStatus.COMPLETED.value},
+        query_service.date_filter("date", date_from, date_to),
+    )
+    cursor = mongo_service.reports(StocktakeSession).find(filters, batch_size=100).sort("date", -1)
+    async for session in cursor:
+        for item in session.get("items", []):
+            if not item.get("difference"):
+                continue
+            yield [
+                session["date"].strftime("%d/%m/%Y"), str(session["_id"]), item.get("sku"), item.get("productName"),
+                item.get("systemQuantity"), item.get("actualQuantity"), item.get("difference"), item.get("notes") or "",
+            ]
+
+
+async def warranty_rows(date_from: Optional[datetime], date_to: Optional[datetime]) -> AsyncIterator[list]:
+    filters = query_service.date_filter("received_date", date_from, date_to)
+    cursor = mongo_service.reports(WarrantyTicket).find(filters, batch_size=BATCH_SIZE).sort("received_date", -1)
+    async for t in cursor:
+        returned = t.get("returned_date")
+        yield [
+            t.get("ticket_code") or "", t["received_date"].strftime("%d/%m/%Y"), t.get("customer_name"),
+            t.get("customer_phone"), t.get("product_name"), t.get("imei"), t.get("issue_description"),
+            t.get("status"), t.get("cost", 0), returned.strftime("%d/%m/%Y") if returned else "",
+        ]
+
+
+# --- CSV ---
+
+def _csv_chunk(rows: List[list]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+async def iter_csv(columns: List[tuple], rows: AsyncIterator[list],
+                   footer: Optional[Callable[[], List[list]]] = None) -> AsyncIterator[bytes]:
+    # BOM để Excel mở đúng tiếng Việt
+    yield "﻿".encode("utf-8") + _csv_chunk([[name for name, _ in columns]])
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CSV_CHUNK_ROWS:
+            yield _csv_chunk(chunk)
+            chunk = []
+    if footer:
+        chunk.extend(footer())
+    if chunk:
+        yield _csv_chunk(chunk)
+
+
+# --- GHI FILE ---
+# Ghi file (xlsxwriter, ghi đĩa) là code đồng bộ -> chạy trong thread riêng theo từng lô BATCH_SIZE dòng,
+# event loop chỉ đọc cursor MongoDB và chuyển lô cho thread
+
+class _XlsxFile:
+    def __init__(self, path: str, sheet_name: str, columns: List[tuple]):
+        self.workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        self.worksheet = self.workbook.add_worksheet(sheet_name)
+        header_fmt = self.workbook.add_format({'bold': True, 'bg_color': '#BDD7EE', 'border': 1})
+        for index, (_, width) in enumerate(columns):
+            self.worksheet.set_column(index, index, width)
+        # constant_memory: phải ghi lần lượt từ trên xuống, dòng đã qua được đẩy ra file tạm
+        self.worksheet.write_row(0, 0, [name for name, _ in columns], header_fmt)
+        self.row_index = 1
+
+    def write(self, rows: List[list]):
+        for row in rows:
+            self.worksheet.write_row(self.row_index, 0, row)
+            self.row_index += 1
+
+    def close(self):
+        self.workbook.close()
+
+
+class _CsvFile:
+    def __init__(self, path: str, columns: List[tuple]):
+        self.file = open(path, "wb")
+        # BOM để Excel mở đúng tiếng Việt
+        self.file.write("\ufeff".encode("utf-8") + _csv_chunk([[name for name, _ in columns]]))
+
+    def write(self, rows: List[list]):
+        self.file.write(_csv_chunk(rows))
+
+    def close(self):
+        self.file.close()
+
+
+async def _write_file(open_file: Callable[[], object], rows: AsyncIterator[list],
+                      footer: Optional[Callable[[], List[list]]] = None):
+    out = await asyncio.to_thread(open_file)
+    try:
+        batch = []
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                await asyncio.to_thread(out.write, batch)
+                batch = []
+        # footer gọi sau khi đã đọc hết dòng (tổng cộng dồn trong lúc đọc)
+        if footer:
+            batch.extend(footer())
+        if batch:
+            await asyncio.to_thread(out.write, batch)
+    finally:
+        await asyncio.to_thread(out.close)
+
+
+async def write_xlsx(path: str, sheet_name: str, columns: List[tuple], rows: AsyncIterator[list],
+                     footer: Optional[Callable[[], List[list]]] = None):
+    await _write_file(lambda: _XlsxFile(path, sheet_name, columns), rows, footer)
+
+
+async def write_csv(path: str, columns: List[tuple], rows: AsyncIterator[list],
+                    footer: Optional[Callable[[], List[list]]] = None):
+    await _write_file(lambda: _CsvFile(path, columns), rows, footer)
+
+
+async def export_response(format: str, filename: str, sheet_name: str, columns: List[tuple],
+                          rows: AsyncIterator[list], footer: Optional[Callable[[], List[list]]] = None):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format phải là một trong {', '.join(EXPORT_FORMATS)}")
+
+    if format == "csv":
+        headers = {'Content-Disposition': f'attachment; filename="{filename}.csv"'}
+        return StreamingResponse(iter_csv(columns, rows, footer), headers=headers, media_type="text/csv; charset=utf-8")
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        await write_xlsx(path, sheet_name, columns, rows, footer)
+    except Exception:
+        os.remove(path)
+        raise
+    return FileResponse(path, filename=f"{filename}.xlsx", media_type=XLSX_MEDIA_TYPE,
+                        background=BackgroundTask(os.remove, path))
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Deque, Iterable, Optional, Set
+
+from pydantic import BaseModel
+
+import shutdown_service
+
+# Luồng thay đổi (change feed) để client không phải tải lại toàn bộ danh sách:
+# - Các handler ghi dữ liệu gọi publish() sau khi ghi xong (sự kiện trong tiến trình, không cần replica set
+#   như MongoDB change streams)
+# - Mỗi sự kiện có số thứ tự tăng dần; resume token = "<epoch>-<seq>" (epoch đổi mỗi lần khởi động server)
+# - FEED_BUFFER sự kiện gần nhất được giữ lại: client kết nối lại với token còn trong bộ đệm thì nhận bù
+#   phần bị lỡ, token quá cũ / của lần chạy trước thì nhận sự kiện "reset" -> tải lại danh sách 1 lần
+# - Gửi qua Server-Sent Events: trình duyệt tự kết nối lại kèm Last-Event-ID = token cuối cùng đã nhận
+# Chạy nhiều tiến trình server thì mỗi tiến trình chỉ thấy thay đổi do chính nó ghi.
+
+FEED_BUFFER = int(os.getenv("FEED_BUFFER", "5000"))
+FEED_HEARTBEAT = float(os.getenv("FEED_HEARTBEAT", "15"))
+FEED_SUBSCRIBER_QUEUE = 1000
+
+TOPICS = {"product", "transaction", "stocktake", "movement", "warranty", "log"}
+
+
+class FeedEvent(BaseModel):
+    seq: int
+    topic: str
+    op: str  # insert | update | delete | delta
+    id: str
+    data: Optional[dict] = None
+    ts: datetime
+
+
+class _Subscriber:
+    def __init__(self, topics: Set[str]):
+        self.topics = topics
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=FEED_SUBSCRIBER_QUEUE)
+        self.overflow = False  # Client đọc chậm, hàng đợi tràn -> gửi "reset"
+
+
+_epoch = uuid.uuid4().hex[:8]
+_seq = 0
+_buffer: Deque[FeedEvent] = deque(maxlen=FEED_BUFFER)
+_subscribers: Set[_Subscriber] = set()
+_stats = {"published": 0, "replayed": 0, "resets": 0}
+
+
+def current_token() -> str:
+    return f"{_epoch}-{_seq}"
+
+
+def _parse_token(token: Optional[str]) -> Optional[int]:
+    # Token hợp lệ của lần chạy này -> seq, ngược lại None
+    if not token:
+        return None
+    epoch, _, seq = token.partition("-")
+    if epoch != _epoch or not seq.isdigit():
+        return None
+    return int(seq)
+
+
+def _data(doc) -> Optional[dict]:
+    if doc is None or isinstance(doc, dict):
+        return doc
+    return doc.model_dump(mode="json")
+
+
+def publish(topic: str, op: str, id, doc=None):
+    """
+    Phát 1 sự kiện thay đổi. doc: Document/BaseModel hoặc dict (None với delete)
+    """
+    global _seq
+    _seq += 1
+    event = FeedEvent(seq=_seq, topic=topic, op=op, id=str(id), data=_data(doc), ts=datetime.now())
+    _buffer.append(event)
+    _stats["published"] += 1
+    for sub in _subscribers:
+        if topic not in sub.topics or sub.overflow:
+            continue
+        try:
+            sub.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            sub.overflow = True
+
+
+def publish_many(topic: str, op: str, docs: Iterable):
+    for doc in docs:
+        publish(topic, op, doc.id, doc)
+
+
+def publish_stock(product, delta: int):
+    """
+    Tồn kho của sản phẩm thay đổi: gửi cả số lượng mới (áp dụng lại nhiều lần vẫn đúng) lẫn chênh lệch
+    """
+    publish("product", "delta", product.id, {
+        "quantity": product.quantity, "imeiCount": product.imeiCount, "delta": delta,
+        "lastUpdated": product.lastUpdated.isoformat(),
+    })
+
+
+def _sse(event: str, token: str, data) -> str:
+    return f"id: {token}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _format(event: FeedEvent) -> str:
+    return _sse("change", f"{_epoch}-{event.seq}", event.model_dump(mode="json"))
+
+
+def _reset() -> str:
+    _stats["resets"] += 1
+    return _sse("reset", current_token(), {"token": current_token()})
+
+
+async def stream(topics: Set[str], resume: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Luồng SSE cho các topic đã chọn, bắt đầu sau resume token (nếu có).
+    Sự kiện "ready" báo token hiện tại, "change" là 1 thay đổi, "reset" yêu cầu client tải lại.
+    """
+    if shutdown_service.stopping():
+        return
+    # Đăng ký trước khi gửi bù để không lọt sự kiện phát ra trong lúc gửi bù
+    sub = _Subscriber(topics)
+    _subscribers.add(sub)
+    try:
+        last = _seq
+        if resume:
+            since = _parse_token(resume)
+            oldest = _buffer[0].seq if _buffer else _seq + 1
+            if since is None or since > _seq or since + 1 < oldest:
+                yield _reset()
+            else:
+                for event in list(_buffer):
+                    if event.seq > since and event.seq <= last and event.topic in topics:
+                        _stats["replayed"] += 1
+                        yield _format(event)
+        yield _sse("ready", f"{_epoch}-{last}", {"token": f"{_epoch}-{last}"})
+
+        while True:
+            if sub.overflow:
+                sub.queue = asyncio.Queue(maxsize=FEED_SUBSCRIBER_QUEUE)
+                sub.overflow = False
+                last = _seq
+                yield _reset()
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=FEED_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if event is None:
+                return
+            if event.seq <= last:
+                continue
+            last = event.seq
+            yield _format(event)
+    finally:
+        _subscribers.discard(sub)
+
+
+def close_all():
+    # Server tắt: đóng các kết nối SSE đang mở (gọi ngay khi nhận tín hiệu tắt, xem shutdown_service)
+    for sub in list(_subscribers):
+        sub.overflow = False
+        while sub.queue.full():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+
+
+def get_stats() -> dict:
+    return {**_stats, "token": current_token(), "buffered": len(_buffer), "subscribers": len(_subscribers)}
@@ -0,0 +1,206 @@
+import math
+import os
+from datetime import datetime
+from statistics import NormalDist
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import stats_service
+from models import DailyStat, ForecastItem, ForecastResult, Product, TransactionType
+
+# Dự báo nhu cầu chạy hoàn toàn trong máy (không gọi mạng), tính 1 lượt cho toàn bộ SKU:
+# 1. Chuỗi xuất kho theo ngày của từng SKU lấy từ daily_stats -> ma trận (SKU x ngày) bằng pandas
+# 2. Mùa vụ theo thứ trong tuần (chỉ số ngày / trung bình), co về 1 khi dữ liệu ít
+# 3. Holt (exponential smoothing có xu hướng tắt dần) trên chuỗi đã khử mùa vụ, vector hóa theo SKU
+#    (hàng bán lẻ tẻ, nhiều ngày không bán: dùng Croston)
+# 4. Độ lệch chuẩn sai số dự báo 1 ngày -> tồn kho an toàn + điểm đặt hàng theo thời gian giao hàng
+# Kết quả được cache theo ngày (cùng tham số chỉ tính 1 lần/ngày).
+
+HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "180"))
+HORIZON_DAYS = 30
+LEAD_TIME_DAYS = int(os.getenv("FORECAST_LEAD_TIME_DAYS", "7"))
+SERVICE_LEVEL = float(os.getenv("FORECAST_SERVICE_LEVEL", "0.95"))
+
+ALPHA = 0.3   # Độ nhạy của mức (level)
+BETA = 0.1    # Độ nhạy của xu hướng (trend)
+PHI = 0.9     # Hệ số tắt dần xu hướng
+SEASON = 7    # Chu kỳ mùa vụ (tuần)
+INTERMITTENT = 0.3  # Tỷ lệ ngày có bán dưới mức này -> coi là hàng bán lẻ tẻ
+
+_cache: Dict[Tuple, ForecastResult] = {}
+
+
+async def load_series(days: int = HISTORY_DAYS) -> Tuple[pd.DataFrame, pd.DatetimeIndex]:
+    """
+    Ma trận số lượng xuất theo ngày: mỗi dòng 1 productId, mỗi cột 1 ngày (đủ `days` ngày tới hôm qua)
+    """
+    today = pd.Timestamp(datetime.now().date())
+    index = pd.date_range(end=today - pd.Timedelta(days=1), periods=days, freq="D")
+    cursor = DailyStat.get_pymongo_collection().find(
+        {"day": {"$gte": stats_service.day_key(index[0]), "$lte": stats_service.day_key(index[-1])},
+         "type": TransactionType.EXPORT.value},
+        {"_id": 0, "day": 1, "productId": 1, "quantity": 1},
+    )
+    rows = await cursor.to_list()
+    if not rows:
+        return pd.DataFrame(columns=index, dtype=float), index
+
+    df = pd.DataFrame(rows)
+    df["day"] = pd.to_datetime(df["day"])
+    matrix = df.pivot_table(index="productId", columns="day", values="quantity", aggfunc="sum", fill_value=0)
+    return matrix.reindex(columns=index, fill_value=0).astype(float), index
+
+
+def seasonal_indices(y: np.ndarray, dow: np.ndarray) -> np.ndarray:
+    """
+    Chỉ số mùa vụ theo thứ (n x 7). SKU ít ngày có bán thì chỉ số được co về 1 để tránh nhiễu.
+    """
+    n = y.shape[0]
+    overall = y.mean(axis=1, keepdims=True)
+    season = np.ones((n, SEASON))
+    for d in range(SEASON):
+        cols = dow == d
+        if cols.any():
+            season[:, d] = y[:, cols].mean(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        season = np.where(overall > 0, season / overall, 1.0)
+    weight = np.minimum(1.0, (y > 0).sum(axis=1, keepdims=True) / 28)
+    season = 1 + (season - 1) * weight
+    return np.clip(season, 0.1, None)
+
+
+def holt_forecast(y: np.ndarray, dow: np.ndarray, future_dow: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Holt tắt dần + mùa vụ nhân cho toàn bộ SKU cùng lúc.
+    Trả về (dự báo từng ngày tới n x h, độ lệch chuẩn sai số 1 ngày n, xu hướng n)
+    """
+    n, t_len = y.shape
+    season = seasonal_indices(y, dow)
+    deseason = y / season[:, dow]
+
+    level = deseason[:, :SEASON].mean(axis=1) if t_len else np.zeros(n)
+    trend = np.zeros(n)
+    sse = np.zeros(n)
+    count = 0
+    for t in range(t_len):
+        predicted = (level + PHI * trend) * season[:, dow[t]]
+        if t >= SEASON:
+            sse += (y[:, t] - np.maximum(predicted, 0)) ** 2
+            count += 1
+        new_level = ALPHA * deseason[:, t] + (1 - ALPHA) * (level + PHI * trend)
+        trend = BETA * (new_level - level) + (1 - BETA) * PHI * trend
+        level = new_level
+
+    steps = np.arange(1, len(future_dow) + 1)
+    damped = np.cumsum(PHI ** steps)  # phi + phi^2 + ... + phi^h
+    forecast = (level[:, None] + damped[None, :] * trend[:, None]) * season[:, future_dow]
+    sigma = np.sqrt(sse / count) if count else np.zeros(n)
+    return np.maximum(forecast, 0), sigma, trend
+
+
+def croston_rate(y: np.ndarray) -> np.ndarray:
+    """
+    Nhu cầu/ngày cho hàng bán lẻ tẻ (nhiều ngày = 0) theo Croston (hiệu chỉnh SBA):
+    làm trơn riêng lượng mỗi lần bán và khoảng cách giữa các lần bán.
+    """
+    n, t_len = y.shape
+    size = np.zeros(n)
+    interval = np.zeros(n)
+    since = np.ones(n)
+    seen = np.zeros(n, dtype=bool)
+    for t in range(t_len):
+        sold = y[:, t] > 0
+        first = sold & ~seen
+        size = np.where(first, y[:, t], np.where(sold, size + ALPHA * (y[:, t] - size), size))
+        interval = np.where(first, since, np.where(sold, interval + ALPHA * (since - interval), interval))
+        seen |= sold
+        since = np.where(sold, 1, since + 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(interval > 0, size / interval, 0.0)
+    return rate * (1 - ALPHA / 2)
+
+
+def _analysis(daily: float, trend: float, current: int, reorder_point: int, restock: int) -> str:
+    if daily < 0.05:
+        return "Hầu như không có xuất kho gần đây, chưa cần nhập thêm."
+    direction = "tăng" if trend > 0.05 * daily else "giảm" if trend < -0.05 * daily else "ổn định"
+    text = f"Dự báo bán ~{daily:.1f}/ngày, xu hướng {direction}. Điểm đặt hàng {reorder_point}, tồn hiện tại {current}."
+    if restock > 0:
+        return text + f" Nên nhập thêm {restock}."
+    return text + " Tồn kho đủ cho 30 ngày tới."
+
+
+async def compute_forecast(lead_time: int = LEAD_TIME_DAYS, service_level: float = SERVICE_LEVEL) -> ForecastResult:
+    matrix, index = await load_series()
+    products = await Product.get_pymongo_collection().find({}, {"name": 1, "sku": 1, "quantity": 1}).to_list()
+
+    # Đưa toàn bộ sản phẩm vào ma trận (sản phẩm chưa từng xuất = chuỗi 0)
+    ids = [str(p["_id"]) for p in products]
+    y = matrix.reindex(ids, fill_value=0).to_numpy(dtype=float)
+    dow = index.dayofweek.to_numpy()
+    future = pd.date_range(start=index[-1] + pd.Timedelta(days=1), periods=HORIZON_DAYS, freq="D")
+
+    forecast, sigma, trend = holt_forecast(y, dow, future.dayofweek.to_numpy())
+    # Hàng bán lẻ tẻ (dưới INTERMITTENT ngày có bán): Holt đánh giá thấp -> dùng Croston
+    intermittent = (y > 0).mean(axis=1) < INTERMITTENT if y.shape[1] else np.zeros(len(ids), dtype=bool)
+    if intermittent.any():
+        forecast[intermittent] = croston_rate(y[intermittent])[:, None]
+        trend[intermittent] = 0
+    predicted = forecast.sum(axis=1)
+    daily = predicted / HORIZON_DAYS
+    last30 = y[:, -30:].sum(axis=1)
+
+    z = NormalDist().inv_cdf(service_level)
+    safety = np.ceil(z * sigma * math.sqrt(lead_time))
+    reorder = np.ceil(daily * lead_time + safety)
+    current = np.array([p.get("quantity", 0) for p in products], dtype=float)
+    restock = np.maximum(0, np.ceil(predicted + safety - current))
+
+    items = [
+        ForecastItem(
+            productId=ids[i],
+            sku=p.get("sku"),
+            productName=p.get("name", ""),
+            currentStock=int(current[i]),
+            salesLast30Days=int(last30[i]),
+            predictedSalesNextMonth=int(round(predicted[i])),
+            restockSuggestion=int(restock[i]),
+            dailyDemand=round(float(daily[i]), 2),
+            safetyStock=int(safety[i]),
+            reorderPoint=int(reorder[i]),
+            analysis=_analysis(float(daily[i]), float(trend[i]), int(current[i]), int(reorder[i]), int(restock[i])),
+        )
+        for i, p in enumerate(products)
+    ]
+    # Ưu tiên hàng cần nhập nhiều, rồi hàng bán chạy
+    items.sort(key=lambda f: (-f.restockSuggestion, -f.predictedSalesNextMonth))
+
+    need = sum(1 for f in items if f.restockSuggestion > 0)
+    below = sum(1 for f in items if f.currentStock <= f.reorderPoint and f.dailyDemand > 0)
+    summary = (
+        f"Dự báo 30 ngày tới cho {len(items)} sản phẩm: tổng nhu cầu ~{int(predicted.sum())} sản phẩm "
+        f"(30 ngày qua bán {int(last30.sum())}). {need} sản phẩm nên nhập thêm, "
+        f"{below} sản phẩm đã chạm điểm đặt hàng (thời gian giao hàng {lead_time} ngày, mức phục vụ {service_level:.0%})."
+    )
+    return ForecastResult(
+        summary=summary, forecasts=items, generatedAt=datetime.now(),
+        leadTimeDays=lead_time, serviceLevel=service_level,
+    )
+
+
+async def get_forecast(lead_time: Optional[int] = None, service_level: Optional[float] = None) -> ForecastResult:
+    """
+    Dự báo cho toàn bộ SKU, cache theo ngày + tham số
+    """
+    lead_time = lead_time or LEAD_TIME_DAYS
+    service_level = service_level or SERVICE_LEVEL
+    today = stats_service.day_key(datetime.now())
+    key = (today, lead_time, service_level)
+    if key not in _cache:
+        # Bỏ kết quả của các ngày trước
+        for old in [k for k in _cache if k[0] != today]:
+            _cache.pop(old)
+        _cache[key] = await compute_forecast(lead_time, service_level)
+    return _cache[key]
@@ -0,0 +1,166 @@
+from typing import Any, List, Set
+
+from pymongo import IndexModel, UpdateOne
+
+from models import (
+    User, Product, Transaction, StocktakeSession, MovementLog, SystemLog,
+    Partner, WarrantyTicket, Brand, DailyStat, StatCounter, SerialUnit, StockLedgerEntry, StockSnapshot,
+    CostLayer, ProductCost
+)
+
+# Các mẫu truy vấn thường dùng trong app: (model, filter, sort, mô tả)
+# sort giống hệt lệnh sort mà query_service.fetch_page gửi đi (cột sắp xếp + _id)
+# Index được Beanie tạo tự động từ Settings.indexes khi init_beanie
+QUERY_PATTERNS = [
+    (User, {"username": "_"}, None, "User theo username (đăng nhập, xác thực token)"),
+    (User, {"email": "_"}, None, "User theo email"),
+    (Brand, {"name": "_"}, None, "Brand theo tên"),
+    (Product, {"sku": "_"}, None, "Product theo SKU"),
+    (Product, {"category": "_"}, [("_id", 1)], "Product theo danh mục"),
+    (Product, {"searchTokens": "_"}, None, "Tìm kiếm sản phẩm"),
+    (SerialUnit, {"imei": "_"}, None, "Máy theo IMEI"),
+    (SerialUnit, {"productId": "_", "status": "_"}, None, "IMEI tồn kho theo sản phẩm"),
+    (Transaction, {}, [("date", -1), ("_id", -1)], "Transaction mới nhất"),
+    (Transaction, {"imeis": "_"}, None, "Transaction chứa IMEI"),
+    (Transaction, {"productId": "_"}, [("date", -1), ("_id", -1)], "Transaction theo sản phẩm"),
+    (Transaction, {"type": "_"}, [("date", -1), ("_id", -1)], "Transaction theo loại"),
+    (Transaction, {"category": "_"}, [("date", -1), ("_id", -1)], "Transaction theo danh mục"),
+    (Transaction, {"brand": "_"}, [("date", -1), ("_id", -1)], "Transaction theo thương hiệu"),
+    (StocktakeSession, {}, [("date", -1), ("_id", -1)], "Phiếu kiểm kê mới nhất"),
+    (StocktakeSession, {"items.productId": "_", "date": {"$gte": "_"}}, None, "Phiếu kiểm kê theo sản phẩm (truy vết IMEI)"),
+    (MovementLog, {"productId": "_", "date": {"$gte": "_"}}, None, "Di chuyển theo sản phẩm + thời gian (truy vết IMEI)"),
+    (MovementLog, {}, [("date", -1), ("_id", -1)], "Lịch sử di chuyển mới nhất"),
+    (MovementLog, {"productId": "_"}, [("date", -1), ("_id", -1)], "Di chuyển theo sản phẩm"),
+    (SystemLog, {}, [("timestamp", -1), ("_id", -1)], "Nhật ký hệ thống mới nhất"),
+    (Partner, {"type": "_"}, [("_id", 1)], "Đối tác theo loại"),
+    (Partner, {"searchTokens": "_"}, None, "Tìm kiếm đối tác"),
+    (WarrantyTicket, {"imei": "_"}, None, "Phiếu bảo hành theo IMEI"),
+    (WarrantyTicket, {"searchTokens": "_"}, None, "Tìm kiếm phiếu bảo hành"),
+    (WarrantyTicket, {}, [("received_date", -1), ("_id", -1)], "Phiếu bảo hành mới nhất"),
+    (DailyStat, {"day": {"$gte": "_"}}, None, "Thống kê theo ngày"),
+    (StatCounter, {"kind": "_"}, [("value", -1)], "Top bộ đếm"),
+    (StockLedgerEntry, {"productId": "_"}, [("date", -1), ("_id", -1)], "Sổ kho theo sản phẩm"),
+    (StockLedgerEntry, {"date": {"$gt": "_", "$lte": "_"}}, None, "Sổ kho từ lần chốt (tồn kho tại thời điểm)"),
+    (StockSnapshot, {"productId": "*", "date": {"$lte": "_"}}, [("date", -1)], "Lần chốt tồn kho gần nhất"),
+    (StockSnapshot, {"date": "_"}, None, "Tồn kho của 1 lần chốt"),
+    (CostLayer, {"productId": "_", "remaining": {"$gt": 0}}, [("date", 1), ("_id", 1)], "Lô giá vốn còn hàng (FIFO)"),
+    (ProductCost, {"productId": "_"}, None, "Giá vốn theo sản phẩm"),
+]
+
+
+async def dedupe_user_emails(database) -> int:
+    """
+    Chạy trước init_beanie: index unique trên users.email không tạo được nếu dữ liệu cũ còn email trùng.
+    Mỗi nhóm trùng giữ nguyên tài khoản tạo sớm nhất, các tài khoản còn lại đổi email sang
+    dạng local+dup-<_id>@domain (vẫn hợp lệ, admin sửa lại sau). Trả về số tài khoản đã đổi.
+    """
+    users = database[User.Settings.name]
+    cursor = await users.aggregate([
+        {"$sort": {"created_at": 1, "_id": 1}},
+        {"$group": {"_id": "$email", "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}, "_id": {"$ne": None}}},
+    ])
+    ops = []
+    async for group in cursor:
+        local, _, domain = group["_id"].partition("@")
+        for oid in group["ids"][1:]:
+            email = f"{local}+dup-{oid}@{domain}"
+            ops.append(UpdateOne({"_id": oid}, {"$set": {"email": email}}))
+            print(f"⚠️  Email {group['_id']} bị trùng: đổi email của user {oid} thành {email}")
+    if ops:
+        await users.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+async def check_unique_indexes(database, models) -> List[dict]:
+    """
+    Chạy trước init_beanie (sau dedupe_user_emails): dữ liệu cũ còn giá trị trùng (VD 2 sản phẩm cùng SKU,
+    2 user cùng username) thì không tạo được index unique và server không khởi động được.
+    Index unique chưa có trong DB mà dữ liệu đang trùng -> in ra các giá trị trùng và tạo index thường thay thế
+    (truy vấn vẫn dùng index); sửa dữ liệu xong khởi động lại sẽ tạo index unique.
+    """
+    skipped = []
+    for model in models:
+        indexes = getattr(model.Settings, "indexes", None) or []
+        collection = database[model.Settings.name]
+        existing = {index["name"]: index async for index in await collection.list_indexes()}
+        for position, index in enumerate(indexes):
+            spec = index.document
+            if not spec.get("unique") or existing.get(spec["name"], {}).get("unique"):
+                continue
+            keys = list(spec["key"].keys())
+            pipeline = [{"$match": spec["partialFilterExpression"]}] if "partialFilterExpression" in spec else []
+            pipeline += [
+                {"$group": {"_id": {f"k{i}": f"${key}" for i, key in enumerate(keys)}, "n": {"$sum": 1}}},
+                {"$match": {"n": {"$gt": 1}}},
+                {"$limit": 5},
+            ]
+            duplicates = await (await collection.aggregate(pipeline)).to_list()
+            if not duplicates:
+                continue
+            values = ", ".join(str(list(d["_id"].values())) for d in duplicates)
+            print(f"⚠️  [{model.Settings.name}] dữ liệu trùng {keys}: {values} -> tạm dùng index thường thay cho index unique")
+            options = {k: v for k, v in spec.items() if k not in ("key", "unique")}
+            indexes[position] = IndexModel(list(spec["key"].items()), **options)
+            skipped.append({"collection": model.Settings.name, "keys": keys, "duplicates": len(duplicates)})
+    return skipped
+
+
+def _plan_stages(plan: Any) -> Set[str]:
+    # Duyệt đệ quy cây winningPlan để lấy tất cả các stage (COLLSCAN, IXSCAN, SORT...)
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages |= _plan_stages(value)
+    return stages
+
+
+async def explain_query(model, filter: dict, sort=None) -> Set[str]:
+    cursor = model.get_pymongo_collection().find(filter)
+    if sort:
+        cursor = cursor.sort(sort)
+    result = await cursor.limit(1).explain()
+    return _plan_stages(result.get("queryPlanner", {}).get("winningPlan", {}))
+
+
+async def index_report() -> List[dict]:
+    """
+    Chạy explain cho các mẫu truy vấn và đánh dấu truy vấn nào vẫn phải quét toàn bộ collection (COLLSCAN)
+    hoặc sắp xếp trong RAM (SORT)
+    """
+    report = []
+    for model, filter, sort, description in QUERY_PATTERNS:
+        try:
+            stages = await explain_query(model, filter, sort)
+        except Exception as e:
+            report.append({"collection": model.get_collection_name(), "query": description, "error": str(e)})
+            continue
+        report.append({
+            "collection": model.get_collection_name(),
+            "query": description,
+            "stages": sorted(stages),
+            "collscan": "COLLSCAN" in stages,
+            "sort": "SORT" in stages,  # Sắp xếp trong RAM (index không phục vụ được lệnh sort)
+        })
+    return report
+
+
+async def print_index_report():
+    report = await index_report()
+    slow = [r for r in report if r.get("collscan")]
+    for r in slow:
+        print(f"⚠️  COLLSCAN: [{r['collection']}] {r['query']} -> {', '.join(r['stages'])}")
+    sorted_in_memory = [r for r in report if r.get("sort") and not r.get("collscan")]
+    for r in sorted_in_memory:
+        print(f"⚠️  SORT trong RAM: [{r['collection']}] {r['query']} -> {', '.join(r['stages'])}")
+    errors = [r for r in report if "error" in r]
+    for r in errors:
+        print(f"❌ Không explain được [{r['collection']}] {r['query']}: {r['error']}")
+    if not slow and not sorted_in_memory and not errors:
+        print(f"✅ Kiểm tra index: {len(report)} mẫu truy vấn đều dùng index")
+    return report
@@ -0,0 +1,340 @@
+import asyncio
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from beanie import PydanticObjectId
+from bson.errors import InvalidId
+from pydantic import BaseModel
+
+import mongo_service
+from models import Product, StockLedgerEntry, StockSnapshot, Transaction, TransactionType
+
+# Sổ kho chỉ thêm (append-only) để trả lời "ngày X còn bao nhiêu hàng" mà không phát lại toàn bộ lịch sử:
+# - Mỗi thay đổi tồn kho (nhập/xuất, kiểm kê, tạo/sửa/xóa sản phẩm) ghi 1 dòng stock_ledger kèm số dư sau thay đổi
+#   (lấy từ sản phẩm sau lệnh $inc nguyên tử -> đúng cả khi nhiều request chạy song song)
+# - Thứ tự các dòng của 1 sản phẩm theo seq = Product.ledgerSeq tăng trong chính lệnh cập nhật tồn kho
+#   (ngày ghi + _id của dòng sổ có thể lệch thứ tự khi nhiều request ghi song song)
+# - Định kỳ (LEDGER_SNAPSHOT_INTERVAL giây) chốt tồn kho mọi sản phẩm vào stock_snapshots
+# - Tồn tại thời điểm T = lần chốt gần nhất <= T + dòng sổ cuối cùng của từng sản phẩm trong (lần chốt, T]
+#   -> O(số sản phẩm + số dòng sổ kể từ lần chốt), không phụ thuộc độ dài lịch sử
+# Thời điểm của dòng sổ là lúc tồn kho thực sự thay đổi (không phải ngày ghi trên phiếu).
+# Dữ liệu có trước khi có sổ kho: chạy python ledger_service.py để dựng lại sổ + các lần chốt cuối tháng.
+
+LEDGER_SNAPSHOT_INTERVAL = float(os.getenv("LEDGER_SNAPSHOT_INTERVAL", str(24 * 3600)))
+# Chốt tồn kho lùi lại vài giây: dòng sổ được ghi sau lệnh cập nhật tồn kho, chốt ngay "hiện tại"
+# có thể bỏ sót dòng mang ngày trước lần chốt nhưng chưa kịp ghi
+LEDGER_SNAPSHOT_GRACE = float(os.getenv("LEDGER_SNAPSHOT_GRACE", "5"))
+BATCH_SIZE = 5000
+
+SOURCE_TRANSACTION = "transaction"
+SOURCE_STOCKTAKE = "stocktake"
+SOURCE_PRODUCT = "product"  # Tạo / sửa số lượng / xóa sản phẩm trực tiếp
+SOURCE_OPENING = "opening"  # Tồn đầu kỳ khi dựng lại sổ
+SOURCE_ROLLBACK = "rollback"  # Phiếu lỗi giữa chừng: lệnh cập nhật tồn kho đã ghi + lệnh hoàn tác
+
+SNAPSHOT_MARKER = "*"
+
+_snapshot_task: Optional[asyncio.Task] = None
+
+
+class StockPosition(BaseModel):
+    productId: str
+    productName: str
+    sku: Optional[str] = None
+    category: Optional[str] = None
+    quantity: int
+    price: float = 0.0  # Đơn giá hiện tại của sản phẩm
+    value: float = 0.0
+
+
+class InventoryAsOf(BaseModel):
+    date: datetime
+    snapshotDate: Optional[datetime] = None  # Lần chốt tồn kho dùng làm điểm xuất phát
+    entriesScanned: int = 0                  # Số dòng sổ kho đọc thêm sau lần chốt
+    totalQuantity: int = 0
+    totalValue: float = 0.0
+    items: List[StockPosition] = []
+
+
+def _now_ms() -> datetime:
+    # MongoDB lưu datetime đến mili giây -> cắt bớt để so sánh bằng được
+    now = datetime.now()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def _signed(trans: Transaction) -> int:
+    return trans.quantity if trans.type == TransactionType.IMPORT else -trans.quantity
+
+
+# --- GHI SỔ ---
+
+async def record_transactions(transactions: List[Transaction], products: Dict[str, Product]):
+    """
+    Ghi sổ các phiếu vừa áp dụng. products: sản phẩm SAU khi cập nhật (theo productId),
+    số dư từng dòng được tính ngược từ tồn kho cuối cùng.
+    """
+    balances = {pid: p.quantity for pid, p in products.items()}
+    now = datetime.now()
+    entries = []
+    for trans in reversed(transactions):
+        if trans.productId not in balances:
+            continue
+        delta = _signed(trans)
+        entries.append(StockLedgerEntry(
+            productId=trans.productId, productName=products[trans.productId].name, date=now,
+            delta=delta, balance=balances[trans.productId], seq=products[trans.productId].ledgerSeq,
+            source=SOURCE_STOCKTAKE if trans.stocktakeId else SOURCE_TRANSACTION,
+            refId=trans.stocktakeId or (str(trans.id) if trans.id else None),
+        ))
+        balances[trans.productId] -= delta
+    if entries:
+        # Các dòng cùng 1 lệnh cập nhật (cùng seq) giữ thứ tự phiếu theo _id tăng dần
+        await StockLedgerEntry.insert_many(entries[::-1])
+
+
+async def record_products(changes: Iterable[Tuple[Product, int]], source: str = SOURCE_PRODUCT):
+    """
+    Ghi sổ thay đổi số lượng trực tiếp trên sản phẩm: changes = [(sản phẩm sau thay đổi, chênh lệch)]
+    """
+    now = datetime.now()
+    entries = [
+        StockLedgerEntry(productId=str(p.id), productName=p.name, date=now, delta=delta, balance=p.quantity,
+                         seq=p.ledgerSeq, source=source)
+        for p, delta in changes
+        if delta
+    ]
+    if entries:
+        await StockLedgerEntry.insert_many(entries)
+
+
+# --- TỒN KHO TẠI THỜI ĐIỂM ---
+
+def _collection(model, report: bool):
+    # report=True: đọc cho báo cáo (có thể từ secondary); chốt tồn kho phải đọc primary
+    return mongo_service.reports(model) if report else model.get_pymongo_collection()
+
+
+async def _latest_snapshot(date: datetime, report: bool = False) -> Optional[datetime]:
+    marker = await _collection(StockSnapshot, report).find_one(
+        {"productId": SNAPSHOT_MARKER, "date": {"$lte": date}}, {"date": 1}, sort=[("date", -1)]
+    )
+    return marker["date"] if marker else None
+
+
+async def balances_at(date: datetime, report: bool = False) -> Tuple[Optional[datetime], int, Dict[str, Tuple[str, int]]]:
+    """
+    Tồn kho từng sản phẩm tại thời điểm date: (lần chốt đã dùng, số dòng sổ đã đọc, {productId: (tên, số lượng)})
+    """
+    since = await _latest_snapshot(date, report)
+    positions: Dict[str, Tuple[str, int]] = {}
+    window = {"$lte": date}
+    if since:
+        window["$gt"] = since
+        cursor = _collection(StockSnapshot, report).find(
+            {"date": since, "productId": {"$ne": SNAPSHOT_MARKER}}, {"productId": 1, "productName": 1, "quantity": 1},
+            batch_size=BATCH_SIZE,
+        )
+        async for doc in cursor:
+            positions[doc["productId"]] = (doc["productName"], doc["quantity"])
+
+    # Dòng cuối cùng của từng sản phẩm trong (lần chốt, date] theo (seq, _id), lọc theo index (date, _id).
+    # $max trên document so sánh lần lượt từng trường -> lấy được dòng có (seq, _id) lớn nhất mà không cần $sort
+    cursor = await _collection(StockLedgerEntry, report).aggregate([
+        {"$match": {"date": window}},
+        {"$group": {"_id": "$productId", "last": {"$max": {
+            "seq": {"$ifNull": ["$seq", 0]}, "id": "$_id", "productName": "$productName", "balance": "$balance",
+        }}, "n": {"$sum": 1}}},
+    ])
+    scanned = 0
+    async for row in cursor:
+        positions[row["_id"]] = (row["last"]["productName"], row["last"]["balance"])
+        scanned += row["n"]
+    return since, scanned, positions
+
+
+async def _product_info(product_ids: List[str]) -> Dict[str, dict]:
+    oids = []
+    for pid in product_ids:
+        try:
+            oids.append(PydanticObjectId(pid))
+        except (InvalidId, TypeError):
+            pass
+    docs = await mongo_service.reports(Product).find(
+        {"_id": {"$in": oids}}, {"sku": 1, "category": 1, "price": 1}
+    ).to_list()
+    return {str(d["_id"]): d for d in docs}
+
+
+async def inventory_as_of(date: datetime) -> InventoryAsOf:
+    """
+    Tồn kho + giá trị (theo đơn giá hiện tại) của từng sản phẩm tại thời điểm date, bỏ qua sản phẩm tồn 0
+    """
+    since, scanned, positions = await balances_at(date, report=True)
+    positions = {pid: pos for pid, pos in positions.items() if pos[1]}
+    info = await _product_info(list(positions))
+
+    result = InventoryAsOf(date=date, snapshotDate=since, entriesScanned=scanned)
+    for pid, (name, quantity) in positions.items():
+        product = info.get(pid, {})
+        price = float(product.get("price") or 0)
+        result.items.append(StockPosition(
+            productId=pid, productName=name, sku=product.get("sku"), category=product.get("category"),
+            quantity=quantity, price=price, value=quantity * price,
+        ))
+        result.totalQuantity += quantity
+        result.totalValue += quantity * price
+    result.items.sort(key=lambda p: (p.sku or "", p.productName))
+    return result
+
+
+# --- CHỐT TỒN KHO ---
+
+async def _write_snapshot(date: datetime, positions: Dict[str, Tuple[str, int]]) -> int:
+    rows = [
+        {"date": date, "productId": pid, "productName": name, "quantity": quantity}
+        for pid, (name, quantity) in positions.items()
+        if quantity
+    ]
+    coll = StockSnapshot.get_pymongo_collection()
+    for start in range(0, len(rows), BATCH_SIZE):
+        await coll.insert_many(rows[start:start + BATCH_SIZE], ordered=False)
+    # Dòng đánh dấu ghi sau cùng
+    await coll.insert_one({"date": date, "productId": SNAPSHOT_MARKER, "productName": "", "quantity": len(rows)})
+    return len(rows)
+
+
+async def take_snapshot(date: Optional[datetime] = None) -> dict:
+    """
+    Chốt tồn kho tại thời điểm date (mặc định: hiện tại lùi LEDGER_SNAPSHOT_GRACE giây), tính từ lần chốt trước + sổ kho
+    """
+    date = date or _now_ms() - timedelta(seconds=LEDGER_SNAPSHOT_GRACE)
+    if await _latest_snapshot(date) == date:
+        return {"date": date, "products": 0, "skipped": True}
+    _, scanned, positions = await balances_at(date)
+    count = await _write_snapshot(date, positions)
+    return {"date": date, "products": count, "entriesScanned": scanned}
+
+
+async def _snapshot_loop():
+    while True:
+        await asyncio.sleep(LEDGER_SNAPSHOT_INTERVAL)
+        try:
+            await take_snapshot()
+        except Exception as e:
+            print(f"⚠️  Không chốt được tồn kho: {e}")
+
+
+async def start_snapshots():
+    global _snapshot_task
+    if not await StockLedgerEntry.find_one() and await Product.find_one(Product.quantity != 0):
+        print("⚠️  Sổ kho trống: chạy python ledger_service.py để dựng lại từ lịch sử giao dịch")
+    if LEDGER_SNAPSHOT_INTERVAL > 0:
+        _snapshot_task = asyncio.create_task(_snapshot_loop())
+
+
+async def stop_snapshots():
+    global _snapshot_task
+    if _snapshot_task:
+        _snapshot_task.cancel()
+        _snapshot_task = None
+
+
+# --- DỰNG LẠI SỔ KHO ---
+
+def _next_month(date: datetime) -> datetime:
+    first = date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return (first + timedelta(days=32)).replace(day=1)
+
+
+async def rebuild() -> dict:
+    """
+    Dựng lại sổ kho từ lịch sử giao dịch + tồn kho hiện tại, chốt tồn kho mỗi đầu tháng và tại thời điểm hiện tại.
+    Tồn đầu kỳ của sản phẩm = tồn hiện tại - tổng nhập/xuất (phần nhập qua form sản phẩm, không có phiếu).
+    """
+    await StockLedgerEntry.find_all().delete()
+    await StockSnapshot.find_all().delete()
+
+    products = {
+        str(d["_id"]): d
+        for d in await Product.get_pymongo_collection().find({}, {"name": 1, "quantity": 1, "lastUpdated": 1}).to_list()
+    }
+    cursor = await Transaction.get_pymongo_collection().aggregate([
+        {"$group": {"_id": "$productId", "net": {"$sum": {"$cond": [
+            {"$eq": ["$type", TransactionType.IMPORT.value]}, "$quantity", {"$multiply": ["$quantity", -1]},
+        ]}}}},
+    ])
+    net = {row["_id"]: row["net"] async for row in cursor}
+    opening = {pid: p.get("quantity", 0) - net.get(pid, 0) for pid, p in products.items()}
+
+    # Sản phẩm không có phiếu nào: tồn đầu kỳ tại lần cập nhật cuối
+    idle = deque(sorted(
+        (p.get("lastUpdated") or datetime.now(), pid) for pid, p in products.items() if pid not in net and opening[pid]
+    ))
+    balances: Dict[str, Tuple[str, int]] = {}
+    state = {"entries": 0, "snapshots": 0, "boundary": None}
+    pending: List[dict] = []
+
+    async def flush():
+        if pending:
+            await StockLedgerEntry.get_pymongo_collection().insert_many(pending, ordered=True)
+            state["entries"] += len(pending)
+            pending.clear()
+
+    async def advance(date: datetime):
+        # Chốt tồn kho tại mỗi mốc đầu tháng đã đi qua
+        if state["boundary"] is None:
+            state["boundary"] = _next_month(date)
+        while state["boundary"] <= date:
+            await flush()
+            await _write_snapshot(state["boundary"], balances)
+            state["snapshots"] += 1
+            state["boundary"] = _next_month(state["boundary"])
+
+    async def post(pid: str, name: str, date: datetime, delta: int, source: str, ref: Optional[str] = None):
+        await advance(date)
+        balance = balances.get(pid, (name, 0))[1] + delta
+        balances[pid] = (name, balance)
+        pending.append({"productId": pid, "productName": name, "date": date, "delta": delta, "balance": balance,
+                        "source": source, "refId": ref})
+        if len(pending) >= BATCH_SIZE:
+            await flush()
+
+    async def post_idle(until: Optional[datetime]):
+        while idle and (until is None or idle[0][0] <= until):
+            date, pid = idle.popleft()
+            await post(pid, products[pid]["name"], date, opening[pid], SOURCE_OPENING)
+
+    seen = set()
+    cursor = Transaction.get_pymongo_collection().find(
+        {}, {"productId": 1, "productName": 1, "type": 1, "quantity": 1, "date": 1, "stocktakeId": 1}, batch_size=BATCH_SIZE
+    ).sort([("date", 1), ("_id", 1)])
+    async for doc in cursor:
+        await post_idle(doc["date"])
+        pid = doc["productId"]
+        name = products[pid]["name"] if pid in products else doc["productName"]
+        if pid not in seen:
+            seen.add(pid)
+            if opening.get(pid):
+                await post(pid, name, doc["date"] - timedelta(milliseconds=1), opening[pid], SOURCE_OPENING)
+        delta = doc["quantity"] if doc["type"] == TransactionType.IMPORT.value else -doc["quantity"]
+        await post(pid, name, doc["date"], delta, SOURCE_STOCKTAKE if doc.get("stocktakeId") else SOURCE_TRANSACTION,
+                   doc.get("stocktakeId") or str(doc["_id"]))
+    await post_idle(None)
+    await flush()
+
+    await take_snapshot()
+    return {"entries": state["entries"], "snapshots": state["snapshots"] + 1}
+
+
+if __name__ == "__main__":
+    # Chạy: python ledger_service.py  -> dựng lại sổ kho + các lần chốt tồn kho từ lịch sử
+    from app import connect_database
+
+    async def main():
+        await connect_database()
+        result = await rebuild()
+        print(f"✅ Đã dựng lại sổ kho: {result}")
+
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+# backend/load_test_stock.py
+# Bắn hàng trăm phiếu XUẤT song song vào cùng 1 SKU để kiểm tra stock_service:
+# - Tồn kho không bao giờ âm
+# - Số phiếu được lưu đúng bằng số phiếu thành công (không có phiếu mồ côi)
+# - IMEI không bị bán 2 lần
+#
+# Chạy (cần MongoDB local): python load_test_stock.py [số_phiếu] [tồn_ban_đầu]
+# Dữ liệu ghi vào database riêng "<DB_NAME>_loadtest" và bị xóa sau khi chạy.
+import asyncio
+import sys
+import time
+
+from fastapi import HTTPException
+
+from app import connect_database, DB_NAME
+from models import Product, Transaction, TransactionType, SerialUnit, SerialStatus
+import stock_service
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+INITIAL_STOCK = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+
+async def export_one(product: Product, imei: str = None):
+    trans = Transaction(
+        productId=str(product.id),
+        productName=product.name,
+        type=TransactionType.EXPORT,
+        quantity=1,
+        imeis=[imei] if imei else [],
+    )
+    try:
+        await stock_service.apply_transaction(trans)
+        return True
+    except HTTPException:
+        return False
+
+
+async def run_case(name: str, with_imei: bool) -> bool:
+    product = Product(name=f"Load test {name}", sku=f"LOADTEST-{name}", category="Laptop", location="LT")
+    await product.create()
+
+    imeis = [f"LT{name}{i:06d}" for i in range(INITIAL_STOCK)] if with_imei else []
+    await stock_service.apply_transaction(Transaction(
+        productId=str(product.id), productName=product.name, type=TransactionType.IMPORT,
+        quantity=INITIAL_STOCK, imeis=imeis,
+    ))
+
+    # Nhiều phiếu tranh nhau cùng 1 IMEI / cùng 1 SKU
+    targets = [imeis[i % len(imeis)] if imeis else None for i in range(REQUESTS)]
+    start = time.perf_counter()
+    results = await asyncio.gather(*(export_one(product, imei) for imei in targets))
+    elapsed = time.perf_counter() - start
+
+    succeeded = sum(results)
+    product = await Product.get(product.id)
+    exports = await Transaction.find(Transaction.productId == str(product.id), Transaction.type == TransactionType.EXPORT).count()
+    sold = await SerialUnit.find(SerialUnit.productId == str(product.id), SerialUnit.status == SerialStatus.SOLD).count()
+
+    checks = {
+        "tồn kho không âm": product.quantity >= 0,
+        "tồn kho = ban đầu - thành công": product.quantity == INITIAL_STOCK - succeeded,
+        "không có phiếu mồ côi": exports == succeeded,
+        "thành công không vượt tồn": succeeded <= INITIAL_STOCK,
+    }
+    if with_imei:
+        checks["IMEI đã bán = phiếu thành công"] = sold == succeeded
+        checks["imeiCount khớp tồn kho"] = product.imeiCount == product.quantity
+
+    print(f"\n📦 [{name}] {REQUESTS} phiếu xuất song song, tồn ban đầu {INITIAL_STOCK}")
+    print(f"   Thành công: {succeeded} | Bị từ chối: {REQUESTS - succeeded} | Tồn cuối: {product.quantity} | {elapsed:.2f}s")
+    for label, ok in checks.items():
+        print(f"   {'✅' if ok else '❌'} {label}")
+    return all(checks.values())
+
+
+async def main():
+    client = await connect_database(f"{DB_NAME}_loadtest")
+    try:
+        ok = await run_case("SKU", with_imei=False)
+        ok = await run_case("IMEI", with_imei=True) and ok
+    finally:
+        await client.drop_database(f"{DB_NAME}_loadtest")
+        await client.close()
+    print("\n✅ ĐẠT" if ok else "\n❌ KHÔNG ĐẠT")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,13 +1,229 @@
+import asyncio
+import json
+import os
+from typing import List, Optional, Tuple
+
+from beanie import PydanticObjectId
+from pymongo.errors import BulkWriteError
+
+import feed_service
 from models import SystemLog
 
+# Ghi nhật ký bất đồng bộ theo lô:
+# - create_log/create_logs chỉ đưa log vào hàng đợi trong bộ nhớ rồi trả về ngay (fire-and-forget)
+# - 1 task nền gom log và ghi bằng insert_many khi đủ LOG_BATCH_SIZE dòng hoặc sau LOG_FLUSH_INTERVAL giây
+# - Hàng đợi đầy: chờ tối đa LOG_ENQUEUE_TIMEOUT giây (backpressure), quá hạn thì ghi tạm ra file
+# - MongoDB lỗi: cả lô được ghi tạm ra file (LOG_SPILL_FILE) và nạp lại vào DB khi kết nối ổn định
+#   (file giữ _id, ghi không thứ tự và bỏ qua _id đã có -> ghi lại nhiều lần không nhân đôi nhật ký;
+#   dòng hỏng được chuyển sang file .bad để không chặn các lần nạp sau)
+# - Chưa bật writer (script chạy tay, seed...) thì ghi thẳng vào DB như cũ
+
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_ENQUEUE_TIMEOUT = float(os.getenv("LOG_ENQUEUE_TIMEOUT", "0.05"))
+LOG_SPILL_FILE = os.getenv("LOG_SPILL_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "audit_spill.jsonl"))
+
+_queue: Optional[asyncio.Queue] = None
+_worker: Optional[asyncio.Task] = None
+_replay_lock = asyncio.Lock()  # Chỉ 1 lần nạp lại file tạm tại 1 thời điểm
+
+# Bộ đếm cho /api/logs/metrics
+_metrics = {
+    "enqueued": 0,   # Số log đã nhận
+    "written": 0,    # Số log đã ghi vào DB
+    "batches": 0,    # Số lần insert_many
+    "spilled": 0,    # Số log bị ghi tạm ra file (bị trễ)
+    "replayed": 0,   # Số log từ file đã nạp lại vào DB
+    "dropped": 0,    # Số log bị mất (không ghi được cả DB lẫn file)
+}
+
+
+def _to_json(log: SystemLog) -> str:
+    return json.dumps(log.model_dump(mode="json", exclude={"revision_id"}), ensure_ascii=False)
+
+
+def _append_spill(logs: List[SystemLog]):
+    with open(LOG_SPILL_FILE, "a", encoding="utf-8") as f:
+        for log in logs:
+            f.write(_to_json(log) + "\n")
+
+
+async def _spill(logs: List[SystemLog]):
+    try:
+        await asyncio.to_thread(_append_spill, logs)
+        _metrics["spilled"] += len(logs)
+    except OSError as e:
+        _metrics["dropped"] += len(logs)
+        print(f"❌ Mất {len(logs)} dòng nhật ký, không ghi được file tạm: {e}")
+
+
+def _read_spill(path: str) -> List[SystemLog]:
+    logs, bad = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                logs.append(SystemLog(**json.loads(line)))
+            except ValueError:
+                bad.append(line if line.endswith("\n") else line + "\n")
+    if bad:
+        with open(LOG_SPILL_FILE + ".bad", "a", encoding="utf-8") as f:
+            f.writelines(bad)
+        print(f"⚠️  {len(bad)} dòng nhật ký hỏng trong file tạm, đã chuyển sang {LOG_SPILL_FILE}.bad")
+    return logs
+
+
+async def _insert(logs: List[SystemLog]):
+    # Không thứ tự: 1 dòng lỗi không chặn các dòng sau; _id đã có (ghi ở lần trước) thì bỏ qua
+    try:
+        await SystemLog.insert_many(logs, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if e.details.get("writeConcernErrors") or any(err.get("code") != 11000 for err in errors):
+            raise
+
+
+async def _replay_spill():
+    """
+    Nạp lại log đã ghi tạm ra file vào DB.
+    File được đổi tên trước khi đọc để log ghi tạm trong lúc nạp không bị mất.
+    Lỗi giữa chừng thì lần sau nạp lại cả file, các dòng đã ghi bị bỏ qua theo _id.
+    """
+    async with _replay_lock:
+        replaying = LOG_SPILL_FILE + ".replay"
+        if not os.path.exists(replaying):
+            if not os.path.exists(LOG_SPILL_FILE):
+                return
+            os.replace(LOG_SPILL_FILE, replaying)
+
+        logs = await asyncio.to_thread(_read_spill, replaying)
+        for start in range(0, len(logs), LOG_BATCH_SIZE):
+            await _insert(logs[start:start + LOG_BATCH_SIZE])
+        os.remove(replaying)
+        _metrics["replayed"] += len(logs)
+
+
+async def _flush(batch: List[SystemLog]):
+    try:
+        await _insert(batch)
+    except Exception as e:
+        print(f"⚠️  Không ghi được {len(batch)} dòng nhật ký vào DB, ghi tạm ra file: {e}")
+        await _spill(batch)
+        return
+    _metrics["written"] += len(batch)
+    _metrics["batches"] += 1
+
+    # DB đã ghi được -> nạp nốt phần log còn nằm trong file (lỗi thì để lần sau)
+    try:
+        await _replay_spill()
+    except Exception as e:
+        print(f"⚠️  Chưa nạp lại được nhật ký từ file tạm: {e}")
+
+
+async def _run_writer(queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + LOG_FLUSH_INTERVAL
+        while len(batch) < LOG_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        try:
+            await _flush(batch)
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+
+async def start_writer():
+    """
+    Bật writer nền (gọi trong lifespan sau khi đã kết nối DB)
+    """
+    global _queue, _worker
+    if _worker is not None:
+        return
+    # Nạp lại file tạm trước khi bật worker (worker cũng nạp lại sau mỗi lô ghi được)
+    try:
+        await _replay_spill()
+    except Exception as e:
+        print(f"⚠️  Chưa nạp lại được nhật ký từ file tạm: {e}")
+    _queue = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+    _worker = asyncio.create_task(_run_writer(_queue))
+
+
+async def stop_writer():
+    """
+    Ghi hết log còn trong hàng đợi rồi tắt writer (gọi trong lifespan khi tắt server)
+    """
+    global _queue, _worker
+    if _worker is None:
+        return
+    queue, worker = _queue, _worker
+    _queue, _worker = None, None  # Log phát sinh từ đây ghi thẳng vào DB
+
+    if not worker.done():
+        await queue.join()
+    worker.cancel()
+    try:
+        await worker
+    except asyncio.CancelledError:
+        pass
+
+
+async def _enqueue(logs: List[SystemLog]):
+    _metrics["enqueued"] += len(logs)
+    # _id được cấp sẵn khi tạo log -> màn hình nhật ký nhận được ngay qua change feed
+    feed_service.publish_many("log", "insert", logs)
+    if _queue is None:
+        await _flush(logs)
+        return
+
+    for index, log in enumerate(logs):
+        try:
+            _queue.put_nowait(log)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(_queue.put(log), LOG_ENQUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Writer không theo kịp -> không giữ request lại lâu hơn, ghi tạm ra file
+                await _spill(logs[index:])
+                return
+
+
+def get_metrics() -> dict:
+    return {
+        **_metrics,
+        "queued": _queue.qsize() if _queue else 0,
+        "running": _worker is not None and not _worker.done(),
+        "spillPending": os.path.exists(LOG_SPILL_FILE) or os.path.exists(LOG_SPILL_FILE + ".replay"),
+    }
+
+
 async def create_log(username: str, action: str, target: str, details: str = ""):
     """
-    Hàm helper để ghi lại nhật ký hoạt động vào MongoDB
+    Hàm helper để ghi lại nhật ký hoạt động (đưa vào hàng đợi, không chờ ghi DB)
     """
-    log = SystemLog(
+    await _enqueue([SystemLog(
+        id=PydanticObjectId(),
         username=username,
         action=action,
         target=target,
         details=details
-    )
-    await log.create()
\ No newline at end of file
+    )])
+
+async def create_logs(username: str, entries: List[Tuple[str, str, str]]):
+    """
+    Ghi nhiều dòng nhật ký (action, target, details) trong 1 lần
+    """
+    if entries:
+        await _enqueue([
+            SystemLog(id=PydanticObjectId(), username=username, action=action, target=target, details=details)
+            for action, target, details in entries
+        ])
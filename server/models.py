@@ -3,6 +3,7 @@ from enum import Enum
 from datetime import datetime
 from beanie import Document
 from pydantic import BaseModel, EmailStr, Field
+from pymongo import IndexModel, ASCENDING, DESCENDING
 
 # 1. ENUMS 
 class Category(str, Enum):
@@ -48,6 +49,9 @@ class Brand(Document):
     
     class Settings:
         name = "brands"
+        indexes = [
+            IndexModel([("name", ASCENDING)]),
+        ]
 
 # Model cho Sản phẩm (Collection: products)
 class Product(Document):
@@ -56,7 +60,8 @@ class Product(Document):
     category: Category  # Sử dụng Enum Category ở trên
     brand: Optional[str] = None 
     quantity: int = 0
-    imeis: List[str] = Field(default_factory=list) 
+    imeiCount: int = 0  # Số IMEI đang tồn kho (chi tiết nằm trong collection serial_units)
+    ledgerSeq: int = 0  # Tăng cùng lệnh cập nhật tồn kho -> thứ tự các dòng sổ kho của sản phẩm
     minStock: int = 0
     price: float = 0.0
     location: str
@@ -64,12 +69,38 @@ class Product(Document):
 
     class Settings:
         name = "products"  # Tên collection trong MongoDB
+        indexes = [
+            IndexModel([("sku", ASCENDING)], unique=True),
+            IndexModel([("category", ASCENDING), ("_id", ASCENDING)]),
+            IndexModel([("searchTokens", ASCENDING)]),  # Tìm kiếm (search_service)
+        ]
     
     class Config:
         # Cho phép map dữ liệu dù tên trường là camelCase (frontend) hay snake_case
         populate_by_name = True
         json_encoders = {datetime: lambda v: v.isoformat()}
 
+# Model cho từng máy theo IMEI/Serial (Collection: serial_units)
+class SerialStatus(str, Enum):
+    IN_STOCK = "IN_STOCK"        # Đang trong kho
+    SOLD = "SOLD"                # Đã xuất bán
+    IN_WARRANTY = "IN_WARRANTY"  # Đang bảo hành / sửa chữa
+
+class SerialUnit(Document):
+    imei: str
+    productId: str
+    status: SerialStatus = SerialStatus.IN_STOCK
+    location: Optional[str] = None
+    lastTransactionId: Optional[str] = None
+    updatedAt: datetime = Field(default_factory=datetime.now)
+
+    class Settings:
+        name = "serial_units"
+        indexes = [
+            IndexModel([("imei", ASCENDING)], unique=True),
+            IndexModel([("productId", ASCENDING), ("status", ASCENDING)]),
+        ]
+
 # Model cho Giao dịch (Collection: transactions)
 class Transaction(Document):
     productId: str
@@ -80,9 +111,26 @@ class Transaction(Document):
     partner: Optional[str] = None # (Lưu tên NCC hoặc Khách hàng)
     date: datetime = Field(default_factory=datetime.now)
     notes: Optional[str] = None
+    stocktakeId: Optional[str] = None # Phiếu điều chỉnh sinh ra từ kiểm kê (không phải mua/bán)
+    unitCost: Optional[float] = None  # Nhập: giá nhập / đơn vị (không gửi -> giá vốn hiện tại); Xuất: giá vốn / đơn vị (server tính)
+    costAmount: Optional[float] = None  # Thành tiền theo giá vốn (nhập: giá trị nhập kho, xuất: giá vốn hàng bán)
+    # Thông tin sản phẩm tại thời điểm ghi phiếu (server điền, không đổi khi sửa sản phẩm) -> báo cáo không cần tra products
+    sku: Optional[str] = None
+    brand: Optional[str] = None
+    category: Optional[str] = None
+    unitPrice: Optional[float] = None  # Đơn giá sản phẩm lúc ghi phiếu
 
     class Settings:
         name = "transactions"
+        indexes = [
+            # Danh sách phân trang keyset sắp theo (date, _id) -> index có cả _id để không phải SORT trong RAM
+            IndexModel([("date", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("imeis", ASCENDING)]),  # Multikey: tra cứu IMEI
+            IndexModel([("productId", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("type", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("category", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("brand", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]),
+        ]
     
     class Config:
         populate_by_name = True
@@ -105,6 +153,10 @@ class Partner(Document):
 
     class Settings:
         name = "partners"
+        indexes = [
+            IndexModel([("type", ASCENDING), ("_id", ASCENDING)]),
+            IndexModel([("searchTokens", ASCENDING)]),  # Tìm kiếm (search_service)
+        ]
 
 # Model cho quản lý phiếu bảo hành/sửa chữa (Collection: warranty_tickets)
 class WarrantyStatus(str, Enum):
@@ -127,9 +179,15 @@ class WarrantyTicket(Document):
     
     received_date: datetime = Field(default_factory=datetime.now)
     returned_date: Optional[datetime] = None
+    updated_at: Optional[datetime] = None # Lần sửa phiếu gần nhất
 
     class Settings:
         name = "warranty_tickets"
+        indexes = [
+            IndexModel([("imei", ASCENDING)]),
+            IndexModel([("received_date", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("searchTokens", ASCENDING)]),  # Tìm kiếm (search_service)
+        ]
     
     class Config:
         json_encoders = {datetime: lambda v: v.isoformat()}
@@ -154,6 +212,10 @@ class StocktakeSession(Document):
 
     class Settings:
         name = "stocktakes"
+        indexes = [
+            IndexModel([("date", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("items.productId", ASCENDING), ("date", DESCENDING)]),  # Truy vết IMEI theo sản phẩm
+        ]
     
     class Config:
         populate_by_name = True
@@ -170,12 +232,115 @@ class MovementLog(Document):
 
     class Settings:
         name = "movement_logs"
+        indexes = [
+            IndexModel([("date", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("productId", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]),
+        ]
     
     class Config:
         populate_by_name = True
         json_encoders = {datetime: lambda v: v.isoformat()}
 
 
+# Model thống kê cộng dồn theo ngày (Collection: daily_stats)
+# Mỗi document = tổng số lượng 1 loại giao dịch của 1 sản phẩm trong 1 ngày
+class DailyStat(Document):
+    day: str                # Ngày dạng YYYY-MM-DD
+    productId: str
+    productName: str
+    type: TransactionType
+    quantity: int = 0       # Tổng số lượng trong ngày
+    transactionCount: int = 0  # Số phiếu trong ngày
+    cost: float = 0         # Tổng giá vốn (nhập: giá trị nhập kho, xuất: giá vốn hàng bán)
+
+    class Settings:
+        name = "daily_stats"
+        indexes = [
+            IndexModel([("day", ASCENDING), ("productId", ASCENDING), ("type", ASCENDING)], unique=True),
+        ]
+
+# Model bộ đếm tổng (Collection: stat_counters)
+# kind = "category": tồn kho theo danh mục | kind = "export": tổng xuất theo sản phẩm
+class StatCounter(Document):
+    kind: str
+    key: str
+    label: str = ""
+    value: int = 0
+
+    class Settings:
+        name = "stat_counters"
+        indexes = [
+            IndexModel([("kind", ASCENDING), ("key", ASCENDING)], unique=True),
+            IndexModel([("kind", ASCENDING), ("value", DESCENDING)]),
+        ]
+
+# Lô giá vốn (Collection: cost_layers): mỗi lần nhập = 1 lô, xuất kho lấy dần từ lô cũ nhất (FIFO)
+class CostLayer(Document):
+    productId: str
+    refId: Optional[str] = None  # Phiếu nhập tạo ra lô
+    date: datetime = Field(default_factory=datetime.now)
+    quantity: int           # Số lượng nhập
+    remaining: int          # Số lượng chưa xuất
+    unitCost: float
+
+    class Settings:
+        name = "cost_layers"
+        indexes = [
+            # Chỉ index các lô còn hàng: xuất kho chỉ đọc lô còn hàng của sản phẩm, theo thứ tự nhập
+            IndexModel([("productId", ASCENDING), ("date", ASCENDING), ("_id", ASCENDING)],
+                       partialFilterExpression={"remaining": {"$gt": 0}}),
+        ]
+
+# Giá trị tồn kho theo giá vốn của từng sản phẩm (Collection: product_costs), cập nhật mỗi lần nhập/xuất
+class ProductCost(Document):
+    productId: str
+    productName: str = ""
+    method: str             # fifo | average
+    quantity: int = 0       # Số lượng đã tính giá vốn
+    value: float = 0        # Giá trị tồn kho theo giá vốn
+    cogs: float = 0         # Giá vốn hàng bán cộng dồn (không gồm điều chỉnh kiểm kê)
+    updatedAt: datetime = Field(default_factory=datetime.now)
+
+    class Settings:
+        name = "product_costs"
+        indexes = [
+            IndexModel([("productId", ASCENDING)], unique=True),
+        ]
+
+# Sổ kho (Collection: stock_ledger): mỗi lần tồn kho của 1 sản phẩm thay đổi = 1 dòng, chỉ thêm, không sửa
+# balance = tồn kho ngay sau thay đổi (số dư lũy kế) -> tồn tại thời điểm T = balance của dòng cuối cùng <= T
+class StockLedgerEntry(Document):
+    productId: str
+    productName: str
+    date: datetime = Field(default_factory=datetime.now)
+    delta: int              # Chênh lệch (+ nhập, - xuất)
+    balance: int            # Tồn kho sau thay đổi
+    source: str             # transaction | stocktake | product | opening | rollback
+    seq: int = 0            # Product.ledgerSeq sau thay đổi: thứ tự thật của các dòng cùng sản phẩm
+    refId: Optional[str] = None  # Phiếu nhập/xuất hoặc phiếu kiểm kê gây ra thay đổi
+
+    class Settings:
+        name = "stock_ledger"
+        indexes = [
+            IndexModel([("productId", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("date", ASCENDING), ("_id", ASCENDING)]),
+        ]
+
+# Chốt tồn kho định kỳ (Collection: stock_snapshots): tồn của từng sản phẩm tại thời điểm date
+# Mỗi lần chốt có 1 dòng đánh dấu (productId = "*") ghi cuối cùng: chỉ lần chốt đã ghi xong mới được dùng
+class StockSnapshot(Document):
+    date: datetime
+    productId: str
+    productName: str = ""
+    quantity: int = 0       # Dòng đánh dấu: số sản phẩm trong lần chốt
+
+    class Settings:
+        name = "stock_snapshots"
+        indexes = [
+            IndexModel([("date", DESCENDING), ("productId", ASCENDING)], unique=True),
+            IndexModel([("productId", ASCENDING), ("date", DESCENDING)]),
+        ]
+
 # --- AI Response Models ---
 class RestockRecommendation(BaseModel):
     productName: str
@@ -197,6 +362,9 @@ class SystemLog(Document):
 
     class Settings:
         name = "system_logs"
+        indexes = [
+            IndexModel([("timestamp", DESCENDING), ("_id", DESCENDING)]),
+        ]
     
     class Config:
         json_encoders = {datetime: lambda v: v.isoformat()}
@@ -211,6 +379,10 @@ class User(Document):
 
     class Settings:
         name = "users" # Tên collection trong MongoDB
+        indexes = [
+            IndexModel([("username", ASCENDING)], unique=True),
+            IndexModel([("email", ASCENDING)], unique=True),
+        ]
 
 # Schema dùng để Update (nhận từ Frontend)
 class UserUpdate(BaseModel):
@@ -226,15 +398,23 @@ class UserCreate(BaseModel):
     full_name: str
     role: str
     password: str
-# # --- Forecast Models ---
-# class ForecastItem(BaseModel):
-#     productName: str
-#     currentStock: int
-#     salesLast30Days: int
-#     predictedSalesNextMonth: int # AI dự đoán
-#     restockSuggestion: int       # AI khuyên nhập thêm
-#     analysis: str                # Lý do
-
-# class ForecastResult(BaseModel):
-#     summary: str
-#     forecasts: List[ForecastItem]
\ No newline at end of file
+# --- Forecast Models ---
+class ForecastItem(BaseModel):
+    productName: str
+    currentStock: int
+    salesLast30Days: int
+    predictedSalesNextMonth: int # Dự báo số lượng bán 30 ngày tới
+    restockSuggestion: int       # Số lượng khuyên nhập thêm
+    analysis: str                # Lý do
+    productId: Optional[str] = None
+    sku: Optional[str] = None
+    dailyDemand: float = 0       # Nhu cầu trung bình/ngày dự báo
+    safetyStock: int = 0         # Tồn kho an toàn
+    reorderPoint: int = 0        # Điểm đặt hàng (tồn <= mức này thì nên đặt)
+
+class ForecastResult(BaseModel):
+    summary: str
+    forecasts: List[ForecastItem]
+    generatedAt: Optional[datetime] = None
+    leadTimeDays: Optional[int] = None
+    serviceLevel: Optional[float] = None
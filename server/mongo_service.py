@@ -0,0 +1,354 @@
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from pymongo import monitoring
+from pymongo.read_preferences import ReadPreference, Secondary, SecondaryPreferred
+
+# Cấu hình kết nối MongoDB + theo dõi độ trễ:
+# - Kích thước pool, thời gian chờ lấy kết nối / kết nối / chọn server lấy từ biến môi trường (client_options)
+# - Báo cáo (analytics, giá trị tồn, tồn tại thời điểm, file xuất) đọc theo REPORT_READ_PREFERENCE
+#   (mặc định secondaryPreferred: có replica set thì đọc secondary, chạy 1 node thì vẫn đọc primary)
+# - Listener của pymongo ghi độ trễ từng lệnh vào histogram theo (collection, lệnh), đếm kết nối của pool,
+#   ghi lại lệnh chậm hơn ngưỡng (chỉ giữ "hình dạng" truy vấn, không giữ giá trị)
+# Listener chạy trong event loop ngay sau mỗi lệnh -> chỉ cộng số, không I/O (trừ print lệnh chậm)
+
+load_dotenv()
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+MONGO_APP_NAME = os.getenv("MONGO_APP_NAME", "warehouse-server")
+
+
+def _env_int(name: str, default: Optional[int] = None) -> Optional[int]:
+    value = os.getenv(name, "").strip()
+    return int(value) if value else default
+
+
+MONGO_MAX_POOL_SIZE = _env_int("MONGO_MAX_POOL_SIZE", 100)
+MONGO_MIN_POOL_SIZE = _env_int("MONGO_MIN_POOL_SIZE", 0)
+MONGO_MAX_IDLE_TIME_MS = _env_int("MONGO_MAX_IDLE_TIME_MS")  # None = giữ kết nối rảnh mãi
+MONGO_WAIT_QUEUE_TIMEOUT_MS = _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000)  # Pool đầy quá lâu -> lỗi thay vì treo request
+MONGO_CONNECT_TIMEOUT_MS = _env_int("MONGO_CONNECT_TIMEOUT_MS", 10000)
+MONGO_SOCKET_TIMEOUT_MS = _env_int("MONGO_SOCKET_TIMEOUT_MS")  # None = không giới hạn (báo cáo lớn chạy lâu)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000)
+
+REPORT_READ_PREFERENCE = os.getenv("REPORT_READ_PREFERENCE", "secondaryPreferred")
+REPORT_MAX_STALENESS = _env_int("REPORT_MAX_STALENESS", -1)  # Giây, >= 90; -1 = không giới hạn độ trễ của secondary
+
+# Ngưỡng lệnh chậm (ms), có thể đặt riêng theo lệnh: SLOW_QUERY_THRESHOLDS="aggregate=500,getMore=500"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_THRESHOLDS = {
+    name.strip(): float(ms)
+    for name, _, ms in (item.partition("=") for item in os.getenv("SLOW_QUERY_THRESHOLDS", "").split(","))
+    if name.strip() and ms.strip()
+}
+SLOW_QUERY_KEEP = _env_int("SLOW_QUERY_KEEP", 100)
+
+# Cận trên các ô histogram (ms), ô cuối = lớn hơn tất cả
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Lệnh bắt tay / xác thực: không tính vào độ trễ truy vấn
+_IGNORED = {"hello", "ismaster", "ping", "endsessions", "buildinfo", "saslstart", "saslcontinue",
+            "authenticate", "getnonce", "killcursors"}
+# Lệnh -> trường chứa điều kiện lọc (để ghi hình dạng truy vấn chậm)
+_FILTER_FIELDS = {"find": "filter", "aggregate": "pipeline", "count": "query", "distinct": "query",
+                  "findAndModify": "query", "update": "updates", "delete": "deletes"}
+
+
+def client_options() -> dict:
+    """
+    Tham số cho AsyncMongoClient: pool, timeout, listener theo dõi độ trễ
+    """
+    options = {
+        "appname": MONGO_APP_NAME,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    }
+    options = {k: v for k, v in options.items() if v is not None}
+    options["event_listeners"] = [_CommandListener(), _PoolListener()]
+    return options
+
+
+# --- ĐỌC CHO BÁO CÁO ---
+
+def _report_read_preference():
+    mode = REPORT_READ_PREFERENCE.lower()
+    if mode == "secondary":
+        return Secondary(max_staleness=REPORT_MAX_STALENESS)
+    if mode == "secondarypreferred":
+        return SecondaryPreferred(max_staleness=REPORT_MAX_STALENESS)
+    return ReadPreference.PRIMARY
+
+
+_report_preference = _report_read_preference()
+
+
+def reports(model):
+    """
+    Collection của model cho truy vấn báo cáo (đọc theo REPORT_READ_PREFERENCE).
+    Không dùng cho đoạn đọc rồi ghi lại (secondary có thể chậm hơn primary).
+    """
+    return model.get_pymongo_collection().with_options(read_preference=_report_preference)
+
+
+# --- HISTOGRAM ---
+
+class _Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float):
+        i = 0
+        while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def _quantile(self, q: float) -> float:
+        # Cận trên của ô chứa phân vị q (ô cuối: lấy max)
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return float(BUCKETS_MS[i]) if i < len(BUCKETS_MS) else round(self.max, 2)
+        return 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avgMs": round(self.total / self.count, 2) if self.count else 0.0,
+            "maxMs": round(self.max, 2),
+            "p50Ms": self._quantile(0.5),
+            "p95Ms": self._quantile(0.95),
+            "p99Ms": self._quantile(0.99),
+            "buckets": {(f"<={b}" if i < len(BUCKETS_MS) else f">{BUCKETS_MS[-1]}"): n
+                        for i, (b, n) in enumerate(zip(BUCKETS_MS + (None,), self.counts)) if n},
+        }
+
+
+# --- LỆNH (COMMAND) ---
+
+# (connection_id, request_id) -> (database, collection, lệnh gốc) giữ từ lúc gửi tới lúc có kết quả
+_pending: Dict[Tuple, Tuple[str, str, dict]] = {}
+_latency: Dict[Tuple[str, str], _Histogram] = {}
+_failures: Dict[Tuple[str, str], int] = {}
+_slow: Deque[dict] = deque(maxlen=SLOW_QUERY_KEEP)
+_slow_count = 0
+_started_at = datetime.now()
+
+
+def _shape(value, depth: int = 0):
+    # Giữ tên trường / toán tử, thay giá trị bằng "?" -> không lộ dữ liệu khách hàng vào log
+    if depth > 6:
+        return "…"
+    if isinstance(value, dict):
+        return {k: _shape(v, depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        shaped = [_shape(v, depth + 1) for v in value[:5]]
+        return shaped + ["…"] if len(value) > 5 else shaped
+    return "?"
+
+
+def _collection_of(command_name: str, command: dict) -> str:
+    if command_name == "getMore":
+        return command.get("collection", "")
+    target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+
+def _record(event, failed: bool):
+    global _slow_count
+    database, collection, command = _pending.pop((event.connection_id, event.request_id), (None, None, None))
+    if collection is None:
+        return
+    ms = event.duration_micros / 1000
+    key = (collection, event.command_name)
+    histogram = _latency.get(key)
+    if histogram is None:
+        histogram = _latency[key] = _Histogram()
+    histogram.add(ms)
+    if failed:
+        _failures[key] = _failures.get(key, 0) + 1
+
+    if ms >= SLOW_QUERY_THRESHOLDS.get(event.command_name, SLOW_QUERY_MS):
+        _slow_count += 1
+        field = _FILTER_FIELDS.get(event.command_name)
+        entry = {
+            "time": datetime.now(),
+            "database": database,
+            "collection": collection,
+            "command": event.command_name,
+            "durationMs": round(ms, 2),
+            "failed": failed,
+            "shape": _shape(command.get(field)) if field else None,
+        }
+        _slow.append(entry)
+        print(f"🐢 Lệnh chậm {entry['durationMs']:.0f} ms: {event.command_name} "
+              f"{database}.{collection} {entry['shape'] or ''}")
+
+
+class _CommandListener(monitoring.CommandListener):
+    def started(self, event):
+        if event.command_name.lower() in _IGNORED:
+            return
+        if len(_pending) > 10000:  # Phòng rò rỉ nếu driver không báo kết quả
+            _pending.clear()
+        _pending[(event.connection_id, event.request_id)] = (
+            event.database_name, _collection_of(event.command_name, event.command) or "-", event.command
+        )
+
+    def succeeded(self, event):
+        _record(event, False)
+
+    def failed(self, event):
+        _record(event, True)
+
+
+# --- POOL KẾT NỐI ---
+
+class _PoolStats:
+    __slots__ = ("created", "closed", "checkout_started", "checked_out", "checked_in", "checkout_failed",
+                 "failures", "cleared", "checkout")
+
+    def __init__(self):
+        self.created = self.closed = self.cleared = 0
+        self.checkout_started = self.checked_out = self.checked_in = self.checkout_failed = 0
+        self.failures: Dict[str, int] = {}
+        self.checkout = _Histogram()  # Thời gian chờ lấy kết nối
+
+    def to_dict(self) -> dict:
+        in_use = self.checked_out - self.checked_in
+        return {
+            "open": self.created - self.closed,
+            "inUse": in_use,
+            "waiting": max(0, self.checkout_started - self.checked_out - self.checkout_failed),
+            "maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "saturation": round(in_use / MONGO_MAX_POOL_SIZE, 3) if MONGO_MAX_POOL_SIZE else None,
+            "created": self.created,
+            "closed": self.closed,
+            "cleared": self.cleared,
+            "checkoutFailures": self.failures,
+            "checkoutWait": self.checkout.to_dict(),
+        }
+
+
+_pools: Dict[str, _PoolStats] = {}
+
+
+def _pool(address) -> _PoolStats:
+    name = f"{address[0]}:{address[1]}"
+    stats = _pools.get(name)
+    if stats is None:
+        stats = _pools[name] = _PoolStats()
+    return stats
+
+
+class _PoolListener(monitoring.ConnectionPoolListener):
+    def pool_created(self, event):
+        _pool(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        _pool(event.address).cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        _pool(event.address).created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        _pool(event.address).closed += 1
+
+    def connection_check_out_started(self, event):
+        _pool(event.address).checkout_started += 1
+
+    def connection_check_out_failed(self, event):
+        stats = _pool(event.address)
+        stats.checkout_failed += 1
+        reason = str(event.reason)
+        stats.failures[reason] = stats.failures.get(reason, 0) + 1
+        if event.duration is not None:
+            stats.checkout.add(event.duration * 1000)
+
+    def connection_checked_out(self, event):
+        stats = _pool(event.address)
+        stats.checked_out += 1
+        if event.duration is not None:
+            stats.checkout.add(event.duration * 1000)
+
+    def connection_checked_in(self, event):
+        _pool(event.address).checked_in += 1
+
+
+# --- SỨC KHỎE ---
+
+def _servers(client) -> List[dict]:
+    servers = []
+    for address, server in client.topology_description.server_descriptions().items():
+        rtt = server.round_trip_time
+        servers.append({
+            "address": f"{address[0]}:{address[1]}",
+            "type": server.server_type_name,
+            "rttMs": round(rtt * 1000, 2) if rtt is not None else None,
+        })
+    return servers
+
+
+async def health(database) -> dict:
+    """
+    Ping MongoDB + tình trạng pool / server (trả status "ok" hoặc "down")
+    """
+    start = time.perf_counter()
+    try:
+        await database.command("ping")
+        status, error = "ok", None
+    except Exception as e:
+        status, error = "down", str(e)
+    return {
+        "status": status,
+        "error": error,
+        "pingMs": round((time.perf_counter() - start) * 1000, 2),
+        "uptimeSeconds": int((datetime.now() - _started_at).total_seconds()),
+        "servers": _servers(database.client),
+        "pools": {name: stats.to_dict() for name, stats in _pools.items()},
+        "reportReadPreference": _report_preference.mongos_mode,
+    }
+
+
+def get_stats() -> dict:
+    """
+    Độ trễ theo (collection, lệnh) + các lệnh chậm gần nhất
+    """
+    latency = {}
+    for (collection, command), histogram in sorted(_latency.items()):
+        item = histogram.to_dict()
+        item["failures"] = _failures.get((collection, command), 0)
+        latency.setdefault(collection, {})[command] = item
+    return {
+        "latency": latency,
+        "slowQueryMs": SLOW_QUERY_MS,
+        "slowQueryThresholds": SLOW_QUERY_THRESHOLDS,
+        "slowQueries": _slow_count,
+        "recentSlowQueries": list(reversed(_slow)),
+    }
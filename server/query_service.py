@@ -0,0 +1,122 @@
+import base64
+import json
+import re
+from datetime import datetime
+from typing import Any, List, Optional, Type
+
+from beanie import Document, PydanticObjectId
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pymongo import ASCENDING, DESCENDING
+
+# Header trả về cursor của trang kế tiếp (rỗng = hết dữ liệu)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_PAGE_SIZE = 1000
+
+
+# --- CURSOR (Keyset pagination) ---
+# Cursor = vị trí của document cuối cùng trong trang (giá trị cột sắp xếp + _id)
+
+def encode_cursor(doc: Document, sort_field: str) -> str:
+    value = getattr(doc, sort_field) if sort_field != "_id" else None
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    raw = json.dumps({"v": value, "id": str(doc.id)})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        value = data["v"]
+        if isinstance(value, dict) and "$date" in value:
+            value = datetime.fromisoformat(value["$date"])
+        return value, PydanticObjectId(data["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor không hợp lệ")
+
+
+def _after_cursor(cursor: str, sort_field: str, descending: bool) -> dict:
+    value, oid = decode_cursor(cursor)
+    op = "$lt" if descending else "$gt"
+    if sort_field == "_id":
+        return {"_id": {op: oid}}
+    return {"$or": [
+        {sort_field: {op: value}},
+        {sort_field: value, "_id": {op: oid}},
+    ]}
+
+
+# --- FILTERS ---
+
+def text_filter(q: Optional[str], fields: List[str]) -> dict:
+    # Tìm kiếm gần đúng, không phân biệt hoa thường trên nhiều trường
+    if not q:
+        return {}
+    pattern = {"$regex": re.escape(q.strip()), "$options": "i"}
+    return {"$or": [{f: pattern} for f in fields]}
+
+
+def date_filter(field: str, date_from: Optional[datetime], date_to: Optional[datetime]) -> dict:
+    cond = {}
+    if date_from:
+        cond["$gte"] = date_from
+    if date_to:
+        cond["$lte"] = date_to
+    return {field: cond} if cond else {}
+
+
+def combine(*filters: dict) -> dict:
+    parts = [f for f in filters if f]
+    if not parts:
+        return {}
+    return parts[0] if len(parts) == 1 else {"$and": parts}
+
+
+# --- PAGE / STREAM ---
+
+async def _ndjson_lines(query):
+    # Duyệt cursor MongoDB theo lô, không giữ toàn bộ collection trong RAM
+    async for doc in query:
+        yield doc.model_dump_json(by_alias=True) + "\n"
+
+
+async def fetch_page(
+    model: Type[Document],
+    filters: dict,
+    response: Response,
+    sort_field: str = "_id",
+    descending: bool = True,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    format: str = "json",
+) -> Any:
+    """
+    Truy vấn danh sách có lọc + phân trang keyset (sort_field, _id).
+    - limit = None: trả về toàn bộ (tương thích client cũ)
+    - format = "ndjson": stream từng document một dòng JSON
+    """
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit phải trong khoảng 1..{MAX_PAGE_SIZE}")
+
+    if cursor:
+        filters = combine(filters, _after_cursor(cursor, sort_field, descending))
+
+    direction = DESCENDING if descending else ASCENDING
+    sort = [("_id", direction)] if sort_field == "_id" else [(sort_field, direction), ("_id", direction)]
+    query = model.find(filters).sort(sort)
+
+    if format == "ndjson":
+        if limit:
+            query = query.limit(limit)
+        return StreamingResponse(_ndjson_lines(query), media_type="application/x-ndjson")
+
+    if not limit:
+        return await query.to_list()
+
+    # Lấy dư 1 bản ghi để biết còn trang sau hay không
+    items = await query.limit(limit + 1).to_list()
+    if len(items) > limit:
+        items = items[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(items[-1], sort_field)
+    return items
@@ -0,0 +1,298 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+
+import export_service
+import mongo_service
+import query_service
+from models import Product, ProductCost, StocktakeSession, StocktakeStatus, Transaction, WarrantyTicket
+
+# Hàng đợi tạo báo cáo chạy nền:
+# - POST tạo job -> trả về ngay, REPORT_WORKERS worker trong tiến trình lần lượt tạo file
+#   (worker chỉ đọc cursor trên event loop, ghi file chạy trong thread theo lô -> không chặn API)
+# - File kết quả nằm trong REPORT_DIR, tên file = hash(loại, định dạng, tham số, watermark dữ liệu)
+# - Watermark = số bản ghi + _id lớn nhất + thời điểm cập nhật mới nhất của dữ liệu trong phạm vi báo cáo:
+#   dữ liệu không đổi thì watermark không đổi -> dùng lại file cũ, không tạo lại
+# - Job giống nhau đang chờ/chạy thì dùng chung 1 job
+# Trạng thái job chỉ nằm trong bộ nhớ (mất khi restart), file kết quả vẫn được dùng lại.
+
+REPORT_DIR = os.getenv("REPORT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "reports_cache"))
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_RETENTION_DAYS = int(os.getenv("REPORT_RETENTION_DAYS", "7"))
+MAX_JOBS = 200  # Số job giữ lại để tra trạng thái
+
+
+class ReportKind(str, Enum):
+    TRANSACTIONS = "transactions"
+    INVENTORY = "inventory"
+    STOCKTAKE_VARIANCE = "stocktake-variance"
+    WARRANTY = "warranty"
+
+
+class JobStatus(str, Enum):
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+
+class ReportJob(BaseModel):
+    id: str
+    kind: ReportKind
+    format: str
+    params: Dict[str, Any] = {}
+    status: JobStatus = JobStatus.PENDING
+    reused: bool = False          # True = dùng lại file đã tạo trước đó
+    fileName: str                 # Tên file khi tải về
+    createdBy: Optional[str] = None
+    createdAt: datetime = Field(default_factory=datetime.now)
+    finishedAt: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+_jobs: "OrderedDict[str, ReportJob]" = OrderedDict()
+_keys: Dict[str, str] = {}  # job_id -> key của file kết quả
+_active: Dict[str, str] = {}  # key -> job_id đang chờ/chạy
+_queue: Optional[asyncio.Queue] = None
+_workers = []
+
+
+# --- WATERMARK ---
+
+async def _watermark(model, filters: dict, time_fields: list) -> list:
+    group = {"_id": None, "n": {"$sum": 1}, "lastId": {"$max": "$_id"}}
+    for index, field in enumerate(time_fields):
+        group[f"t{index}"] = {"$max": f"${field}"}
+    cursor = await mongo_service.reports(model).aggregate([{"$match": filters}, {"$group": group}])
+    rows = await cursor.to_list()
+    if not rows:
+        return [0]
+    row = rows[0]
+    return [row["n"], str(row["lastId"])] + [row.get(f"t{i}") for i in range(len(time_fields))]
+
+
+def _date_range(params: dict) -> tuple:
+    return params.get("date_from"), params.get("date_to")
+
+
+# --- ĐỊNH NGHĨA CÁC LOẠI BÁO CÁO ---
+# Mỗi loại: tên file, tên sheet, cột, hàm tạo (rows, footer), hàm watermark, các tham số dùng được
+
+async def _transactions_watermark(params: dict) -> list:
+    filters = export_service.transaction_filter(*_date_range(params), params.get("type"))
+    # SKU đã chép vào phiếu lúc ghi -> sửa sản phẩm không làm đổi báo cáo
+    return await _watermark(Transaction, filters, ["date"])
+
+
+def _transactions_rows(params: dict):
+    totals = {"import": 0, "export": 0}
+    filters = export_service.transaction_filter(*_date_range(params), params.get("type"))
+    return export_service.transaction_rows(filters, totals), lambda: export_service.transaction_footer(totals)
+
+
+async def _inventory_watermark(params: dict) -> list:
+    category = params.get("category")
+    # Giá trị tồn lấy từ giá vốn -> tính lại giá vốn cũng phải tạo lại
+    return (await _watermark(Product, {"category": category.value} if category else {}, ["lastUpdated"])) + \
+        (await _watermark(ProductCost, {}, ["updatedAt"]))
+
+
+def _inventory_rows(params: dict):
+    category = params.get("category")
+    return export_service.inventory_rows(category.value if category else None), None
+
+
+async def _stocktake_watermark(params: dict) -> list:
+    filters = query_service.combine(
+        {"status": StocktakeStatus.COMPLETED.value},
+        query_service.date_filter("date", *_date_range(params)),
+    )
+    return await _watermark(StocktakeSession, filters, ["date"])
+
+
+def _stocktake_rows(params: dict):
+    return export_service.stocktake_variance_rows(*_date_range(params)), None
+
+
+async def _warranty_watermark(params: dict) -> list:
+    filters = query_service.date_filter("received_date", *_date_range(params))
+    return await _watermark(WarrantyTicket, filters, ["received_date", "returned_date", "updated_at"])
+
+
+def _warranty_rows(params: dict):
+    return export_service.warranty_rows(*_date_range(params)), None
+
+
+REPORTS = {
+    ReportKind.TRANSACTIONS: ("BaoCaoNhapXuat", "LichSuGiaoDich", export_service.TRANSACTION_COLUMNS,
+                              _transactions_rows, _transactions_watermark, ("date_from", "date_to", "type")),
+    ReportKind.INVENTORY: ("BaoCaoTonKho", "TonKho", export_service.INVENTORY_COLUMNS,
+                           _inventory_rows, _inventory_watermark, ("category",)),
+    ReportKind.STOCKTAKE_VARIANCE: ("ChenhLechKiemKe", "ChenhLech", export_service.STOCKTAKE_VARIANCE_COLUMNS,
+                                    _stocktake_rows, _stocktake_watermark, ("date_from", "date_to")),
+    ReportKind.WARRANTY: ("BaoCaoBaoHanh", "BaoHanh", export_service.WARRANTY_COLUMNS,
+                          _warranty_rows, _warranty_watermark, ("date_from", "date_to")),
+}
+
+
+def _artifact_path(job: ReportJob) -> str:
+    return os.path.join(REPORT_DIR, f"{job.kind.value}-{_keys[job.id]}.{job.format}")
+
+
+def _remember(job: ReportJob, key: str):
+    _jobs[job.id] = job
+    _keys[job.id] = key
+    # Chỉ giữ MAX_JOBS job gần nhất (bỏ job cũ đã xong)
+    for job_id in list(_jobs):
+        if len(_jobs) <= MAX_JOBS:
+            break
+        if _jobs[job_id].status in (JobStatus.DONE, JobStatus.FAILED):
+            _jobs.pop(job_id)
+            _keys.pop(job_id, None)
+
+
+# --- API CHO APP ---
+
+async def submit(kind: ReportKind, format: str, params: dict, username: Optional[str] = None) -> ReportJob:
+    """
+    Tạo job báo cáo. Dữ liệu chưa đổi kể từ lần tạo trước -> job xong ngay với file cũ.
+    """
+    if format not in export_service.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format phải là một trong {', '.join(export_service.EXPORT_FORMATS)}")
+    if _queue is None:
+        raise HTTPException(status_code=503, detail="Hàng đợi báo cáo chưa sẵn sàng")
+
+    prefix, _, _, _, watermark, allowed = REPORTS[kind]
+    params = {name: params[name] for name in allowed if params.get(name) is not None}
+
+    raw_key = json.dumps([kind.value, format, params, await watermark(params)], sort_keys=True, default=str)
+    key = hashlib.sha256(raw_key.encode()).hexdigest()[:24]
+
+    if key in _active:
+        return _jobs[_active[key]]
+
+    job = ReportJob(
+        id=uuid.uuid4().hex,
+        kind=kind,
+        format=format,
+        params=params,
+        fileName=f"{prefix}_{datetime.now().strftime('%Y%m%d')}.{format}",
+        createdBy=username,
+    )
+    _remember(job, key)
+
+    path = _artifact_path(job)
+    if os.path.exists(path):
+        os.utime(path)  # Gia hạn thời gian giữ file
+        job.status, job.reused, job.finishedAt = JobStatus.DONE, True, datetime.now()
+        return job
+
+    _active[key] = job.id
+    await _queue.put(job.id)
+    return job
+
+
+def get_job(job_id: str) -> ReportJob:
+    job = _jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job báo cáo")
+    return job
+
+
+def list_jobs() -> list:
+    return list(reversed(_jobs.values()))
+
+
+def artifact(job_id: str) -> tuple:
+    """
+    Trả về (đường dẫn file, tên file tải về) của job đã xong
+    """
+    job = get_job(job_id)
+    if job.status != JobStatus.DONE:
+        raise HTTPException(status_code=409, detail=f"Báo cáo chưa sẵn sàng (trạng thái: {job.status.value})")
+    path = _artifact_path(job)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="File báo cáo đã bị dọn, vui lòng tạo lại")
+    return path, job.fileName
+
+
+# --- WORKER ---
+
+async def _generate(job: ReportJob):
+    _, sheet_name, columns, make_rows, _, _ = REPORTS[job.kind]
+    rows, footer = make_rows(job.params)
+    path = _artifact_path(job)
+    # Ghi ra file tạm rồi mới đổi tên -> không bao giờ dùng lại file ghi dở
+    tmp_path = f"{path}.{job.id}.tmp"
+    try:
+        if job.format == "csv":
+            await export_service.write_csv(tmp_path, columns, rows, footer)
+        else:
+            await export_service.write_xlsx(tmp_path, sheet_name, columns, rows, footer)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+async def _run_worker(queue: asyncio.Queue):
+    while True:
+        job_id = await queue.get()
+        job = _jobs.get(job_id)
+        try:
+            if job:
+                job.status = JobStatus.RUNNING
+                await _generate(job)
+                job.status = JobStatus.DONE
+        except Exception as e:
+            job.status, job.error = JobStatus.FAILED, str(e)
+            print(f"❌ Tạo báo cáo {job.kind.value} thất bại: {e}")
+        finally:
+            if job:
+                job.finishedAt = datetime.now()
+                _active.pop(_keys.get(job_id), None)
+            queue.task_done()
+
+
+def prune_artifacts() -> int:
+    # Xóa file báo cáo không được dùng trong REPORT_RETENTION_DAYS ngày
+    cutoff = time.time() - REPORT_RETENTION_DAYS * 86400
+    removed = 0
+    for name in os.listdir(REPORT_DIR):
+        path = os.path.join(REPORT_DIR, name)
+        if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+async def start_workers():
+    """
+    Bật worker tạo báo cáo (gọi trong lifespan)
+    """
+    global _queue
+    if _queue is not None:
+        return
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    prune_artifacts()
+    _queue = asyncio.Queue()
+    _workers.extend(asyncio.create_task(_run_worker(_queue)) for _ in range(REPORT_WORKERS))
+
+
+async def stop_workers():
+    global _queue
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queue = None
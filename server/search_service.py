@@ -0,0 +1,168 @@
+import os
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Type
+
+from beanie import Document
+from pydantic import BaseModel
+from pymongo import UpdateOne
+
+from models import Partner, Product, WarrantyTicket
+
+# Tìm kiếm nhanh trên server (thay cho tải cả danh sách rồi lọc ở trình duyệt):
+# - Mỗi document có thêm mảng searchTokens (multikey index): các từ đã bỏ dấu tiếng Việt, chữ thường
+#   ("Điện thoại" -> "dien", "thoai"), kèm dạng viết liền của mã ("MBP-14-M3" -> "mbp14m3")
+# - Truy vấn: mọi từ khóa phải khớp (đúng từ hoặc tiền tố) -> regex "^..." trên searchTokens đi theo index
+# - Ứng viên được chấm điểm trong Python: khớp nguyên từ > khớp tiền tố, trường mã (SKU, IMEI, SĐT...) > tên
+# searchTokens được cập nhật khi tạo/sửa; dữ liệu cũ: chạy python search_service.py để tạo lại.
+
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "20"))
+SEARCH_MAX_LIMIT = 200
+CANDIDATE_FACTOR = 10  # Số ứng viên lấy ra để chấm điểm = limit x hệ số
+
+# Loại kết quả -> (model, {trường: trọng số}, trường tiêu đề, trường phụ)
+SOURCES: Dict[str, tuple] = {
+    "product": (Product, {"sku": 3, "name": 2, "brand": 1}, "name", "sku"),
+    "partner": (Partner, {"phone": 3, "tax_code": 3, "name": 2}, "name", "phone"),
+    "warranty": (WarrantyTicket, {"ticket_code": 3, "imei": 3, "customer_phone": 3}, "ticket_code", "imei"),
+}
+
+
+class SearchHit(BaseModel):
+    type: str  # product | partner | warranty
+    id: str
+    title: str
+    subtitle: Optional[str] = None
+    score: float
+
+
+def normalize(text: Any) -> str:
+    # Bỏ dấu tiếng Việt (kể cả đ/Đ), chữ thường
+    text = unicodedata.normalize("NFD", str(text)).replace("đ", "d").replace("Đ", "D")
+    return "".join(c for c in text if unicodedata.category(c) != "Mn").lower()
+
+
+def tokenize(text: Any) -> List[str]:
+    return re.findall(r"[a-z0-9]+", normalize(text)) if text else []
+
+
+def document_tokens(values: List[Any]) -> List[str]:
+    tokens = []
+    for value in values:
+        words = tokenize(value)
+        tokens += words
+        if len(words) > 1:
+            # Mã viết liền (SKU, mã phiếu): gõ "mbp14" vẫn khớp "MBP-14-M3"
+            tokens.append("".join(words))
+    return list(dict.fromkeys(tokens))
+
+
+def _tokens_for(kind: str, source: Any) -> List[str]:
+    _, weights, _, _ = SOURCES[kind]
+    get = source.get if isinstance(source, dict) else lambda f: getattr(source, f, None)
+    return document_tokens([get(f) for f in weights])
+
+
+def _kind_of(model: Type[Document]) -> str:
+    return next(kind for kind, (m, *_) in SOURCES.items() if m is model)
+
+
+async def index_document(model: Type[Document], doc_id: Any, source: Any):
+    """
+    Ghi searchTokens cho 1 document sau khi tạo/sửa (source: document hoặc dữ liệu mới)
+    """
+    tokens = _tokens_for(_kind_of(model), source)
+    await model.get_pymongo_collection().update_one({"_id": doc_id}, {"$set": {"searchTokens": tokens}})
+
+
+def _score(query: List[str], compact: str, fields: Dict[str, int], doc: dict) -> float:
+    score = 0.0
+    for field, weight in fields.items():
+        words = tokenize(doc.get(field))
+        if not words:
+            continue
+        joined = "".join(words)
+        if joined == compact:
+            score += 10 * weight  # Khớp toàn bộ giá trị (VD: đúng SKU / IMEI)
+        for q in query:
+            if q in words:
+                score += 2 * weight
+            elif joined.startswith(q) or any(w.startswith(q) for w in words):
+                score += weight
+    return score
+
+
+async def _search_source(kind: str, query: List[str], limit: int) -> List[SearchHit]:
+    model, fields, title, subtitle = SOURCES[kind]
+    coll = model.get_pymongo_collection()
+    projection = {f: 1 for f in fields} | {title: 1, subtitle: 1}
+    cap = limit * CANDIDATE_FACTOR
+
+    # Khớp nguyên từ trước (ứng viên tốt nhất), còn chỗ thì lấy thêm khớp tiền tố
+    docs = await coll.find({"searchTokens": {"$all": query}}, projection).limit(cap).to_list()
+    if len(docs) < cap:
+        seen = [d["_id"] for d in docs]
+        # Từ khóa dài nhất đứng đầu (chọn lọc nhất) -> dùng cho index
+        prefix = [{"searchTokens": re.compile("^" + re.escape(q))} for q in sorted(query, key=len, reverse=True)]
+        docs += await coll.find(
+            {"$and": prefix, "_id": {"$nin": seen}}, projection
+        ).limit(cap - len(docs)).to_list()
+
+    compact = "".join(query)
+    hits = [
+        SearchHit(
+            type=kind, id=str(d["_id"]), title=str(d.get(title) or ""),
+            subtitle=d.get(subtitle), score=_score(query, compact, fields, d),
+        )
+        for d in docs
+    ]
+    hits.sort(key=lambda h: (-h.score, h.title))
+    return hits[:limit]
+
+
+async def search(q: str, types: Optional[List[str]] = None, limit: int = SEARCH_LIMIT) -> List[SearchHit]:
+    """
+    Tìm trên sản phẩm / đối tác / phiếu bảo hành, không phân biệt dấu và hoa thường, xếp theo độ khớp
+    """
+    query = list(dict.fromkeys(tokenize(q)))
+    if not query:
+        return []
+    hits = []
+    for kind in types or SOURCES:
+        hits += await _search_source(kind, query, limit)
+    hits.sort(key=lambda h: (-h.score, h.title))
+    return hits[:limit]
+
+
+async def rebuild(batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Tạo lại searchTokens cho toàn bộ dữ liệu (dữ liệu có trước khi thêm tìm kiếm)
+    """
+    counts = {}
+    for kind, (model, fields, _, _) in SOURCES.items():
+        coll = model.get_pymongo_collection()
+        ops, total = [], 0
+        async for doc in coll.find({}, {f: 1 for f in fields}):
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"searchTokens": _tokens_for(kind, doc)}}))
+            if len(ops) >= batch_size:
+                await coll.bulk_write(ops, ordered=False)
+                total += len(ops)
+                ops = []
+        if ops:
+            await coll.bulk_write(ops, ordered=False)
+            total += len(ops)
+        counts[kind] = total
+    return counts
+
+
+if __name__ == "__main__":
+    # Chạy: python search_service.py  -> tạo lại searchTokens cho sản phẩm, đối tác, phiếu bảo hành
+    import asyncio
+    from app import connect_database
+
+    async def main():
+        await connect_database()
+        counts = await rebuild()
+        print(f"✅ Đã tạo lại chỉ mục tìm kiếm: {counts}")
+
+    asyncio.run(main())
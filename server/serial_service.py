@@ -0,0 +1,231 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from beanie.operators import In
+from pymongo import UpdateMany, UpdateOne
+
+from models import Product, SerialUnit, SerialStatus
+
+# Mọi thao tác trên IMEI đều làm theo lô (1 truy vấn cho cả danh sách)
+# dựa trên unique index serial_units.imei, không duyệt list trong Python
+
+
+def find_duplicates(imeis: List[str]) -> List[str]:
+    seen, dup = set(), []
+    for imei in imeis:
+        if imei in seen:
+            dup.append(imei)
+        seen.add(imei)
+    return dup
+
+
+async def in_stock_owners(imeis: List[str]) -> Dict[str, str]:
+    """
+    Trả về {imei: productId} của các IMEI trong danh sách đang nằm trong kho
+    """
+    if not imeis:
+        return {}
+    units = await SerialUnit.find(
+        In(SerialUnit.imei, imeis), SerialUnit.status == SerialStatus.IN_STOCK
+    ).to_list()
+    return {u.imei: u.productId for u in units}
+
+
+async def find_in_stock(imeis: List[str]) -> List[str]:
+    """
+    Trả về các IMEI trong danh sách đang nằm trong kho (không được nhập trùng)
+    """
+    return list(await in_stock_owners(imeis))
+
+
+_PREV_FIELDS = ("status", "productId", "location", "lastTransactionId", "updatedAt")
+
+
+async def receive_many(lines: List[Tuple[List[str], Product, Optional[str]]]) -> List:
+    """
+    Nhập kho: tạo mới hoặc đưa máy đã bán (khách trả lại) về trạng thái IN_STOCK.
+    lines = [(imeis, product, transaction_id)], ghi bằng 1 lệnh bulk_write.
+    Máy đang IN_STOCK không khớp filter -> upsert đụng unique index -> BulkWriteError.
+    Trạng thái cũ của máy (status, productId, location...) được giữ trong trường prev để hoàn tác.
+    Trả về danh sách _id được tạo mới (dùng để hoàn tác).
+    """
+    now = datetime.now()
+    ops = [
+        UpdateOne(
+            {"imei": imei, "status": {"$ne": SerialStatus.IN_STOCK.value}},
+            # Update pipeline: chép trạng thái cũ vào prev trước khi ghi đè ($literal: giá trị không bị hiểu là tên trường)
+            [
+                {"$set": {"prev": {field: f"${field}" for field in _PREV_FIELDS}}},
+                {"$set": {
+                    "productId": {"$literal": str(product.id)},
+                    "status": {"$literal": SerialStatus.IN_STOCK.value},
+                    "location": {"$literal": product.location},
+                    "lastTransactionId": {"$literal": transaction_id},
+                    "updatedAt": {"$literal": now},
+                }},
+            ],
+            upsert=True,
+        )
+        for imeis, product, transaction_id in lines
+        for imei in imeis
+    ]
+    if not ops:
+        return []
+    result = await SerialUnit.get_pymongo_collection().bulk_write(ops, ordered=False)
+    return list(result.upserted_ids.values())
+
+
+async def receive_units(imeis: List[str], product: Product, transaction_id: Optional[str] = None) -> List:
+    return await receive_many([(imeis, product, transaction_id)])
+
+
+async def sell_many(lines: List[Tuple[List[str], str, Optional[str]]]) -> int:
+    """
+    Xuất kho: chuyển các máy sang trạng thái SOLD, trả về số máy đã chuyển.
+    lines = [(imeis, product_id, transaction_id)], ghi bằng 1 lệnh bulk_write.
+    """
+    now = datetime.now()
+    ops = [
+        UpdateMany(
+            {"imei": {"$in": imeis}, "productId": product_id, "status": SerialStatus.IN_STOCK.value},
+            {"$set": {
+                "status": SerialStatus.SOLD.value,
+                "lastTransactionId": transaction_id,
+                "updatedAt": now,
+            }},
+        )
+        for imeis, product_id, transaction_id in lines
+        if imeis
+    ]
+    if not ops:
+        return 0
+    result = await SerialUnit.get_pymongo_collection().bulk_write(ops, ordered=False)
+    return result.modified_count
+
+
+async def revert_receive(transaction_ids: List[str], upserted_ids: List):
+    """
+    Hoàn tác receive_many: xóa máy vừa tạo, máy cũ trả về đúng trạng thái trước khi nhập
+    (SOLD / IN_WARRANTY, sản phẩm, vị trí... lưu trong prev)
+    """
+    if upserted_ids:
+        await SerialUnit.find(In(SerialUnit.id, upserted_ids)).delete()
+    await SerialUnit.get_pymongo_collection().update_many(
+        {"lastTransactionId": {"$in": transaction_ids}, "status": SerialStatus.IN_STOCK.value},
+        [
+            {"$set": {
+                "status": {"$ifNull": ["$prev.status", SerialStatus.SOLD.value]},
+                "productId": {"$ifNull": ["$prev.productId", "$productId"]},
+                "location": {"$ifNull": ["$prev.location", "$location"]},
+                "lastTransactionId": {"$ifNull": ["$prev.lastTransactionId", None]},
+                "updatedAt": {"$literal": datetime.now()},
+            }},
+            {"$unset": "prev"},
+        ],
+    )
+
+
+async def revert_sell(transaction_ids: List[str]):
+    """
+    Hoàn tác sell_many: đưa các máy đã chuyển SOLD bởi các giao dịch về IN_STOCK
+    """
+    await SerialUnit.find(
+        In(SerialUnit.lastTransactionId, transaction_ids), SerialUnit.status == SerialStatus.SOLD
+    ).update({"$set": {"status": SerialStatus.IN_STOCK.value, "updatedAt": datetime.now()}})
+
+
+async def set_warranty(imei: str, in_warranty: bool):
+    """
+    Đánh dấu máy đang bảo hành / đã trả khách (chỉ áp dụng cho máy đã bán)
+    """
+    current, target = (
+        (SerialStatus.SOLD, SerialStatus.IN_WARRANTY) if in_warranty
+        else (SerialStatus.IN_WARRANTY, SerialStatus.SOLD)
+    )
+    await SerialUnit.find_one({"imei": imei, "status": current.value}).update(
+        {"$set": {"status": target.value, "updatedAt": datetime.now()}}
+    )
+
+
+async def move_units(product_id: str, location: str):
+    await SerialUnit.find(
+        SerialUnit.productId == product_id, SerialUnit.status == SerialStatus.IN_STOCK
+    ).update({"$set": {"location": location, "updatedAt": datetime.now()}})
+
+
+async def move_many(moves: List[Tuple[str, str]]):
+    """
+    Chuyển vị trí IMEI tồn kho của nhiều sản phẩm: moves = [(product_id, location)], 1 lệnh bulk_write
+    """
+    if not moves:
+        return
+    now = datetime.now()
+    await SerialUnit.get_pymongo_collection().bulk_write([
+        UpdateMany(
+            {"productId": product_id, "status": SerialStatus.IN_STOCK.value},
+            {"$set": {"location": location, "updatedAt": now}},
+        )
+        for product_id, location in moves
+    ], ordered=False)
+
+async def list_in_stock(product_id: str) -> List[str]:
+    units = await SerialUnit.find(
+        SerialUnit.productId == product_id, SerialUnit.status == SerialStatus.IN_STOCK
+    ).sort("imei").to_list()
+    return [u.imei for u in units]
+
+
+async def sync_product_units(product: Product, imeis: List[str]) -> int:
+    """
+    Đồng bộ danh sách IMEI tồn kho khi sửa sản phẩm bằng tay.
+    Chỉ thêm/xóa phần chênh lệch, trả về số IMEI tồn kho sau khi đồng bộ.
+    """
+    product_id = str(product.id)
+    current = set(await list_in_stock(product_id))
+    wanted = set(imeis)
+
+    removed = list(current - wanted)
+    if removed:
+        await SerialUnit.find(
+            In(SerialUnit.imei, removed),
+            SerialUnit.productId == product_id,
+            SerialUnit.status == SerialStatus.IN_STOCK,
+        ).delete()
+    await receive_units(list(wanted - current), product)
+    return len(wanted)
+
+
+async def delete_product_units(product_id: str):
+    await SerialUnit.find(
+        SerialUnit.productId == product_id, SerialUnit.status == SerialStatus.IN_STOCK
+    ).delete()
+
+
+async def migrate_product_imeis() -> int:
+    """
+    Chuyển mảng Product.imeis (dữ liệu cũ) sang collection serial_units
+    """
+    products = Product.get_pymongo_collection()
+    migrated = 0
+    async for doc in products.find({"imeis.0": {"$exists": True}}, {"imeis": 1, "location": 1}):
+        product = Product.model_construct(id=doc["_id"], location=doc.get("location"))
+        await receive_units(doc["imeis"], product)
+        await products.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {"imeiCount": len(doc["imeis"])}, "$unset": {"imeis": ""}},
+        )
+        migrated += len(doc["imeis"])
+    return migrated
+
+
+if __name__ == "__main__":
+    # Chạy: python serial_service.py  -> chuyển IMEI từ products sang serial_units
+    import asyncio
+    from app import connect_database
+
+    async def main():
+        await connect_database()
+        migrated = await migrate_product_imeis()
+        print(f"✅ Đã chuyển {migrated} IMEI sang serial_units")
+
+    asyncio.run(main())
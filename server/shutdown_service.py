@@ -0,0 +1,62 @@
+import asyncio
+import signal
+from typing import Callable, List
+
+# Uvicorn nhận SIGINT/SIGTERM thì chờ mọi response đang mở kết thúc rồi mới chạy phần shutdown của lifespan.
+# Luồng SSE (cảnh báo tồn kho, change feed) không tự kết thúc -> phải đóng ngay khi nhận tín hiệu,
+# không đợi đến lifespan shutdown (sẽ không bao giờ tới khi còn dashboard đang mở).
+
+_callbacks: List[Callable[[], None]] = []
+_stopping = False
+
+
+def on_signal(callback: Callable[[], None]):
+    """
+    Đăng ký hàm chạy (trên event loop) khi server nhận tín hiệu tắt
+    """
+    _callbacks.append(callback)
+
+
+def stopping() -> bool:
+    return _stopping
+
+
+def trigger():
+    """
+    Đóng các luồng đang mở (gọi được nhiều lần). Tắt không qua tín hiệu thì lifespan shutdown gọi trực tiếp.
+    """
+    global _stopping
+    if _stopping:
+        return
+    _stopping = True
+    for callback in _callbacks:
+        try:
+            callback()
+        except Exception as e:
+            print(f"⚠️  Lỗi khi đóng kết nối lúc tắt server: {e}")
+
+
+def install():
+    """
+    Gắn thêm vào handler tín hiệu hiện có (của uvicorn), gọi trong lifespan startup
+    """
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            previous = signal.getsignal(sig)
+        except ValueError:
+            return  # Không chạy trong main thread: không nghe được tín hiệu
+
+        def handler(signum, frame, previous=previous):
+            loop.call_soon_threadsafe(trigger)
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                signal.signal(signum, previous)
+                signal.raise_signal(signum)
+
+        try:
+            signal.signal(sig, handler)
+        except ValueError:
+            return
+
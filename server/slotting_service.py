@@ -0,0 +1,237 @@
+import heapq
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from beanie import PydanticObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+from pymongo import UpdateOne
+
+import serial_service
+import stats_service
+from models import DailyStat, MovementLog, Product, TransactionType
+
+# Tối ưu vị trí kho (slotting) theo tốc độ xuất hàng:
+# 1. Tốc độ xuất của từng sản phẩm lấy từ bảng cộng dồn daily_stats (1 aggregate, không quét Transaction)
+# 2. Xếp hạng theo tốc độ, chia vào các zone theo thứ tự gần -> xa cửa với tỷ lệ share của từng zone (ABC)
+# 3. Sản phẩm đã ở đúng zone thì giữ nguyên -> kế hoạch chỉ gồm các sản phẩm phải chuyển
+# 4. Hàng chuyển đến được chia vào ô ít hàng nhất của zone, hàng chạy hơn được chọn ô trước
+# Vị trí có dạng "<ZONE>-<số ô>" (VD: A-01), zone = phần trước dấu "-".
+
+
+class ZoneConfig(BaseModel):
+    zone: str               # Tên zone (VD: A)
+    distance: float         # Khoảng cách tương đối tới cửa xuất (càng nhỏ càng gần)
+    share: float            # Tỷ lệ số SKU xếp vào zone (theo thứ hạng tốc độ)
+    slots: int = Field(100, ge=1)  # Số ô trong zone (A-01 .. A-100)
+
+
+class SlottingConfig(BaseModel):
+    days: int = Field(90, ge=1)     # Tính tốc độ xuất trong N ngày gần nhất
+    zones: List[ZoneConfig] = [
+        ZoneConfig(zone="A", distance=1, share=0.2),
+        ZoneConfig(zone="B", distance=2, share=0.3),
+        ZoneConfig(zone="C", distance=3, share=0.5),
+    ]
+    includeUnzoned: bool = False    # Có xếp lại sản phẩm đang ở vị trí ngoài các zone không
+
+
+class SlottingMove(BaseModel):
+    productId: str
+    productName: str
+    sku: str
+    fromLocation: str
+    toLocation: str
+    fromZone: Optional[str] = None
+    toZone: Optional[str] = None
+    velocity: int = 0
+    reason: Optional[str] = None
+
+
+class SlottingPlan(BaseModel):
+    generatedAt: datetime
+    totalProducts: int
+    correctlyPlaced: int
+    efficiency: int                 # % sản phẩm (được xếp hạng) đang ở đúng zone
+    travelCostBefore: float         # Tổng (tốc độ xuất x khoảng cách) trước khi chuyển
+    travelCostAfter: float          # ... sau khi áp dụng kế hoạch
+    currentZones: Dict[str, int]
+    idealZones: Dict[str, int]
+    moves: List[SlottingMove]
+
+
+class SlottingApply(BaseModel):
+    moves: List[SlottingMove]
+
+
+def zone_of(location: Optional[str]) -> str:
+    return (location or "").split("-")[0].strip().upper()
+
+
+async def export_velocity(days: int) -> Dict[str, int]:
+    """
+    Tổng số lượng xuất theo sản phẩm trong N ngày gần nhất
+    """
+    since = stats_service.day_key(datetime.now() - timedelta(days=days - 1))
+    cursor = await DailyStat.get_pymongo_collection().aggregate([
+        {"$match": {"day": {"$gte": since}, "type": TransactionType.EXPORT.value}},
+        {"$group": {"_id": "$productId", "quantity": {"$sum": "$quantity"}}},
+    ])
+    return {row["_id"]: row["quantity"] async for row in cursor}
+
+
+def _zone_reason(index: int, zone: ZoneConfig, zones: List[ZoneConfig]) -> str:
+    if index == 0:
+        return f"Hàng bán chạy, cần chuyển về Zone {zone.zone} (gần cửa)"
+    if index == len(zones) - 1:
+        return f"Hàng bán chậm, nên để ở Zone {zone.zone} (xa cửa)"
+    return f"Sức mua trung bình, phù hợp Zone {zone.zone}"
+
+
+def build_plan(products: List[dict], velocity: Dict[str, int], config: SlottingConfig) -> SlottingPlan:
+    """
+    Tính kế hoạch chuyển vị trí (thuần Python, không truy cập DB).
+    products: [{"_id", "name", "sku", "location"}]
+    """
+    zones = sorted(config.zones, key=lambda z: z.distance)
+    if not zones:
+        raise HTTPException(status_code=400, detail="Cần khai báo ít nhất 1 zone")
+    by_name = {z.zone.upper(): z for z in zones}
+    far = zones[-1].distance
+
+    # Sản phẩm ở vị trí ngoài các zone chỉ được xếp hạng khi includeUnzoned
+    current_counts, ideal_counts = defaultdict(int), defaultdict(int)
+    eligible = []
+    for p in products:
+        current = zone_of(p.get("location"))
+        current_counts[current if current in by_name else "Khác"] += 1
+        if current in by_name or config.includeUnzoned:
+            eligible.append(p)
+
+    # Xếp hạng: xuất nhiều trước, hòa thì theo SKU cho ổn định
+    ranked = sorted(eligible, key=lambda p: (-velocity.get(str(p["_id"]), 0), p.get("sku") or ""))
+    total = len(ranked)
+
+    # Ranh giới thứ hạng của từng zone theo tỷ lệ share cộng dồn
+    share_total = sum(z.share for z in zones) or 1
+    bounds, cumulative = [], 0.0
+    for z in zones:
+        cumulative += z.share / share_total
+        bounds.append(round(cumulative * total))
+    bounds[-1] = total
+
+    # Số hàng đang nằm ở từng ô -> chọn ô ít hàng nhất cho hàng chuyển đến
+    occupancy = {z.zone.upper(): defaultdict(int) for z in zones}
+    for p in ranked:
+        location = (p.get("location") or "").strip().upper()
+        zone = zone_of(location)
+        if zone in occupancy:
+            occupancy[zone][location] += 1
+    free_slots = {}
+    for z in zones:
+        name = z.zone.upper()
+        free_slots[name] = [
+            (occupancy[name].get(f"{name}-{i:02d}", 0), i) for i in range(1, z.slots + 1)
+        ]
+        heapq.heapify(free_slots[name])
+
+    moves = []
+    correct = 0
+    cost_before = cost_after = 0.0
+    zone_index = 0
+    for rank, p in enumerate(ranked):
+        while rank >= bounds[zone_index]:
+            zone_index += 1
+        target = zones[zone_index]
+        target_name = target.zone.upper()
+        pid = str(p["_id"])
+        speed = velocity.get(pid, 0)
+        current = zone_of(p.get("location"))
+        current_zone = by_name.get(current)
+
+        ideal_counts[target_name] += 1
+        cost_before += speed * (current_zone.distance if current_zone else far)
+
+        if current == target_name:
+            correct += 1
+            cost_after += speed * target.distance
+            continue
+
+        count, slot = heapq.heappop(free_slots[target_name])
+        heapq.heappush(free_slots[target_name], (count + 1, slot))
+        moves.append(SlottingMove(
+            productId=pid,
+            productName=p.get("name") or "",
+            sku=p.get("sku") or "",
+            fromLocation=p.get("location") or "",
+            toLocation=f"{target_name}-{slot:02d}",
+            fromZone=current or None,
+            toZone=target_name,
+            velocity=speed,
+            reason=_zone_reason(zone_index, target, zones),
+        ))
+        cost_after += speed * target.distance
+
+    return SlottingPlan(
+        generatedAt=datetime.now(),
+        totalProducts=len(products),
+        correctlyPlaced=correct,
+        efficiency=round(correct / total * 100) if total else 0,
+        travelCostBefore=cost_before,
+        travelCostAfter=cost_after,
+        currentZones=dict(current_counts),
+        idealZones=dict(ideal_counts),
+        moves=moves,
+    )
+
+
+async def plan(config: SlottingConfig) -> SlottingPlan:
+    velocity = await export_velocity(config.days)
+    cursor = Product.get_pymongo_collection().find({}, {"name": 1, "sku": 1, "location": 1}, batch_size=5000)
+    products = await cursor.to_list()
+    return build_plan(products, velocity, config)
+
+
+async def apply_moves(moves: List[SlottingMove]) -> List[MovementLog]:
+    """
+    Áp dụng kế hoạch: 1 bulk_write cập nhật vị trí sản phẩm + 1 insert_many lịch sử di chuyển.
+    Sản phẩm đã bị đổi vị trí kể từ lúc lập kế hoạch (fromLocation không khớp) được bỏ qua.
+    Trả về các MovementLog đã ghi.
+    """
+    if not moves:
+        return []
+    ids = []
+    for m in moves:
+        try:
+            ids.append(PydanticObjectId(m.productId))
+        except (InvalidId, TypeError):
+            raise HTTPException(status_code=400, detail=f"Mã sản phẩm không hợp lệ: {m.productId}")
+    now = datetime.now()
+    ops = [
+        UpdateOne(
+            {"_id": oid, "location": m.fromLocation},
+            {"$set": {"location": m.toLocation, "lastUpdated": now}},
+        )
+        for oid, m in zip(ids, moves)
+    ]
+    result = await Product.get_pymongo_collection().bulk_write(ops, ordered=False)
+
+    if result.modified_count == len(moves):
+        applied = moves
+    else:
+        # Đọc lại vị trí để biết sản phẩm nào đã chuyển
+        cursor = Product.get_pymongo_collection().find({"_id": {"$in": ids}}, {"location": 1})
+        moved = {str(doc["_id"]): doc["location"] async for doc in cursor}
+        applied = [m for m in moves if moved.get(m.productId) == m.toLocation]
+
+    logs = [
+        MovementLog(productId=m.productId, productName=m.productName, sku=m.sku,
+                    fromLocation=m.fromLocation, toLocation=m.toLocation, date=now)
+        for m in applied
+    ]
+    if logs:
+        await MovementLog.insert_many(logs)
+        await serial_service.move_many([(m.productId, m.toLocation) for m in applied])
+    return logs
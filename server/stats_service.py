@@ -0,0 +1,212 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from pymongo import UpdateOne
+
+from models import DailyStat, StatCounter, Product, Transaction, TransactionType
+
+# Bộ đếm tổng dùng cho Dashboard
+KIND_CATEGORY = "category"   # Tồn kho theo danh mục (biểu đồ tròn)
+KIND_EXPORT = "export"       # Tổng xuất theo sản phẩm (Top bán chạy)
+
+TREND_DAYS = 7
+
+
+def day_key(date: datetime) -> str:
+    return date.strftime("%Y-%m-%d")
+
+
+def category_key(category: Any) -> str:
+    # Lấy giá trị chuỗi của Enum hoặc string
+    return category.value if hasattr(category, 'value') else str(category)
+
+
+def _counter_op(kind: str, key: str, delta: int, label: str = "") -> UpdateOne:
+    update = {"$inc": {"value": delta}}
+    if label:
+        update["$set"] = {"label": label}
+    return UpdateOne({"kind": kind, "key": key}, update, upsert=True)
+
+
+async def adjust_category(category: Any, delta: int):
+    """
+    Cộng/trừ tồn kho của một danh mục (gọi khi số lượng sản phẩm thay đổi)
+    """
+    if delta:
+        cat = category_key(category)
+        await StatCounter.get_pymongo_collection().bulk_write([_counter_op(KIND_CATEGORY, cat, delta, cat)])
+
+
+async def record_transactions(transactions: List[Transaction], products: Dict[str, Product]):
+    """
+    Cập nhật bảng thống kê sau khi các phiếu nhập/xuất được ghi nhận.
+    Gộp theo key trong Python trước -> tối đa 2 lệnh bulk_write cho cả lô.
+    """
+    daily = defaultdict(lambda: {"quantity": 0, "transactionCount": 0, "productName": ""})
+    counters = defaultdict(lambda: {"delta": 0, "label": ""})
+
+    for trans in transactions:
+        product = products.get(trans.productId)
+        if product is None:
+            continue
+
+        cat = category_key(product.category)
+        sign = 1 if trans.type == TransactionType.IMPORT else -1
+        counters[(KIND_CATEGORY, cat)]["delta"] += sign * trans.quantity
+        counters[(KIND_CATEGORY, cat)]["label"] = cat
+
+        # Phiếu điều chỉnh kiểm kê chỉ làm thay đổi tồn kho, không tính vào nhập/xuất
+        if trans.stocktakeId:
+            continue
+
+        row = daily[(day_key(trans.date), trans.productId, trans.type.value)]
+        row["quantity"] += trans.quantity
+        row["transactionCount"] += 1
+        row["productName"] = trans.productName
+
+        if trans.type == TransactionType.EXPORT:
+            counters[(KIND_EXPORT, trans.productId)]["delta"] += trans.quantity
+            counters[(KIND_EXPORT, trans.productId)]["label"] = product.name
+
+    daily_ops = [
+        UpdateOne(
+            {"day": day, "productId": product_id, "type": type},
+            {"$inc": {"quantity": row["quantity"], "transactionCount": row["transactionCount"]},
+             "$set": {"productName": row["productName"]}},
+            upsert=True,
+        )
+        for (day, product_id, type), row in daily.items()
+    ]
+    counter_ops = [_counter_op(kind, key, c["delta"], c["label"]) for (kind, key), c in counters.items()]
+
+    if daily_ops:
+        await DailyStat.get_pymongo_collection().bulk_write(daily_ops, ordered=False)
+    if counter_ops:
+        await StatCounter.get_pymongo_collection().bulk_write(counter_ops, ordered=False)
+
+
+async def record_transaction(trans: Transaction, product: Product):
+    await record_transactions([trans], {trans.productId: product})
+
+
+async def get_dashboard_stats() -> dict:
+    """
+    Đọc số liệu Dashboard từ bảng thống kê: O(số ngày + số danh mục) document
+    """
+    categories = await StatCounter.find(StatCounter.kind == KIND_CATEGORY).to_list()
+
+    # Nếu chưa có dữ liệu thì trả về rỗng để không lỗi Frontend
+    if not categories:
+        return {
+            "categoryData": [],
+            "trendData": [],
+            "topProducts": []
+        }
+
+    # --- A. Tỷ lệ tồn kho theo Danh mục ---
+    category_data = [{"name": c.label or c.key, "value": c.value} for c in categories]
+
+    # --- B. Xu hướng Nhập/Xuất 7 ngày qua ---
+    today = datetime.now()
+    days = [today - timedelta(days=i) for i in range(TREND_DAYS - 1, -1, -1)]
+    trend_map = {day_key(d): {"date": d.strftime("%d/%m"), "import": 0, "export": 0} for d in days}
+
+    # Gộp theo (ngày, loại) ngay trong MongoDB -> tối đa 2 dòng / ngày
+    rows = await DailyStat.aggregate([
+        {"$match": {"day": {"$gte": day_key(days[0])}}},
+        {"$group": {"_id": {"day": "$day", "type": "$type"}, "quantity": {"$sum": "$quantity"}}},
+    ]).to_list()
+    for row in rows:
+        day = trend_map.get(row["_id"]["day"])
+        if day is None:
+            continue
+        if row["_id"]["type"] == TransactionType.IMPORT.value:
+            day["import"] += row["quantity"]
+        elif row["_id"]["type"] == TransactionType.EXPORT.value:
+            day["export"] += row["quantity"]
+
+    # --- C. Top 5 Sản phẩm bán chạy ---
+    top = await StatCounter.find(StatCounter.kind == KIND_EXPORT, StatCounter.value > 0).sort("-value").limit(5).to_list()
+    top_products = [{"name": c.label, "quantity": c.value} for c in top]
+
+    return {
+        "categoryData": category_data,
+        "trendData": list(trend_map.values()),
+        "topProducts": top_products
+    }
+
+
+async def rebuild_stats() -> dict:
+    """
+    Tính lại toàn bộ bảng thống kê từ lịch sử giao dịch và tồn kho hiện tại
+    """
+    await DailyStat.find_all().delete()
+    await StatCounter.find_all().delete()
+
+    # 1. Thống kê theo ngày / sản phẩm / loại
+    daily_rows = await Transaction.aggregate([
+        {"$match": {"stocktakeId": None}},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}},
+                "productId": "$productId",
+                "type": "$type",
+            },
+            "productName": {"$last": "$productName"},
+            "quantity": {"$sum": "$quantity"},
+            "transactionCount": {"$sum": 1},
+            "cost": {"$sum": {"$ifNull": ["$costAmount", 0]}},
+        }},
+    ]).to_list()
+    daily_stats = [
+        DailyStat(
+            day=r["_id"]["day"],
+            productId=r["_id"]["productId"],
+            productName=r["productName"],
+            type=r["_id"]["type"],
+            quantity=r["quantity"],
+            transactionCount=r["transactionCount"],
+            cost=r["cost"],
+        )
+        for r in daily_rows
+    ]
+
+    # 2. Tổng xuất theo sản phẩm
+    export_rows = await Transaction.aggregate([
+        {"$match": {"type": TransactionType.EXPORT.value, "stocktakeId": None}},
+        {"$group": {"_id": "$productId", "label": {"$last": "$productName"}, "value": {"$sum": "$quantity"}}},
+    ]).to_list()
+
+    # 3. Tồn kho theo danh mục
+    category_rows = await Product.aggregate([
+        {"$group": {"_id": "$category", "value": {"$sum": "$quantity"}}},
+    ]).to_list()
+
+    counters = [
+        StatCounter(kind=KIND_EXPORT, key=r["_id"], label=r["label"], value=r["value"])
+        for r in export_rows
+    ] + [
+        StatCounter(kind=KIND_CATEGORY, key=category_key(r["_id"]), label=category_key(r["_id"]), value=r["value"])
+        for r in category_rows
+    ]
+
+    if daily_stats:
+        await DailyStat.insert_many(daily_stats)
+    if counters:
+        await StatCounter.insert_many(counters)
+
+    return {"dailyStats": len(daily_stats), "counters": len(counters)}
+
+
+if __name__ == "__main__":
+    # Chạy: python stats_service.py  -> tính lại bảng thống kê từ lịch sử
+    import asyncio
+    from app import connect_database
+
+    async def main():
+        await connect_database()
+        result = await rebuild_stats()
+        print(f"✅ Đã tính lại thống kê: {result}")
+
+    asyncio.run(main())
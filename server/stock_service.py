@@ -0,0 +1,290 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from beanie import PydanticObjectId, UpdateResponse
+from beanie.operators import In
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import UpdateMany
+from pymongo.errors import BulkWriteError
+
+import cost_service
+import ledger_service
+import serial_service
+from models import Product, Transaction, TransactionType
+
+# Engine cập nhật tồn kho an toàn khi nhiều request chạy song song:
+# - Kiểm tra toàn bộ phiếu trước, chưa ghi gì nếu còn dòng lỗi
+# - Mỗi bước là lệnh cập nhật nguyên tử có điều kiện ($inc kèm quantity >= n), ghi theo lô
+# - Bước nào lỗi thì hoàn tác các bước trước theo thứ tự ngược lại
+#   (hoàn tác tồn kho cũng có điều kiện: hàng vừa nhập đã bị giao dịch khác xuất thì không trừ âm kho)
+# - Transaction chỉ được ghi khi tồn kho + IMEI đã cập nhật xong -> không có phiếu mồ côi
+
+
+def _line_error(index: int, trans: Transaction, detail: str, status_code: int = 400) -> dict:
+    return {"line": index, "productId": trans.productId, "detail": detail, "status": status_code}
+
+
+async def _load_products(transactions: List[Transaction]) -> Dict[str, Product]:
+    oids = []
+    for t in transactions:
+        try:
+            oids.append(PydanticObjectId(t.productId))
+        except (InvalidId, TypeError):
+            pass
+    products = await Product.find(In(Product.id, oids)).to_list() if oids else []
+    return {str(p.id): p for p in products}
+
+
+async def validate_batch(transactions: List[Transaction]) -> Tuple[Dict[str, Product], List[dict]]:
+    """
+    Kiểm tra cả phiếu trước khi ghi bất cứ thứ gì vào DB.
+    Trả về (sản phẩm theo id, danh sách lỗi theo từng dòng).
+    """
+    products = await _load_products(transactions)
+    import_imeis = [i for t in transactions if t.type == TransactionType.IMPORT for i in t.imeis]
+    export_imeis = [i for t in transactions if t.type == TransactionType.EXPORT for i in t.imeis]
+
+    # 1 truy vấn cho toàn bộ IMEI của phiếu
+    owners = await serial_service.in_stock_owners(import_imeis + export_imeis)
+
+    errors = []
+    seen_imeis = set()
+    available = {pid: p.quantity for pid, p in products.items()}
+
+    for index, t in enumerate(transactions):
+        if t.quantity <= 0:
+            errors.append(_line_error(index, t, "Số lượng phải lớn hơn 0"))
+            continue
+
+        # Nếu có nhập IMEI, số lượng IMEI phải khớp với số lượng tổng
+        if t.imeis and len(t.imeis) != t.quantity:
+            errors.append(_line_error(index, t, f"Số lượng là {t.quantity} nhưng danh sách chứa {len(t.imeis)} mã IMEI."))
+            continue
+
+        duplicates = serial_service.find_duplicates(t.imeis)
+        if duplicates:
+            errors.append(_line_error(index, t, f"IMEI {duplicates[0]} bị nhập trùng!"))
+            continue
+        reused = [i for i in t.imeis if i in seen_imeis]
+        seen_imeis.update(t.imeis)
+        if reused:
+            errors.append(_line_error(index, t, f"IMEI {reused[0]} xuất hiện ở nhiều dòng trong phiếu!"))
+            continue
+
+        if t.productId not in products:
+            errors.append(_line_error(index, t, "Không tìm thấy sản phẩm", 404))
+            continue
+
+        if t.type == TransactionType.IMPORT:
+            in_stock = [i for i in t.imeis if i in owners]
+            if in_stock:
+                errors.append(_line_error(index, t, f"IMEI {in_stock[0]} đã tồn tại trong kho!"))
+                continue
+            available[t.productId] += t.quantity
+        else:
+            # Cộng dồn theo sản phẩm: nhiều dòng xuất cùng 1 SKU trong 1 phiếu
+            if available[t.productId] < t.quantity:
+                errors.append(_line_error(index, t, "Lỗi: Không đủ hàng trong kho để xuất!"))
+                continue
+            missing = [i for i in t.imeis if owners.get(i) != t.productId]
+            if missing:
+                errors.append(_line_error(index, t, f"Lỗi: IMEI {missing[0]} không có trong kho để xuất!"))
+                continue
+            available[t.productId] -= t.quantity
+
+    return products, errors
+
+
+# SKU của phiếu thuộc sản phẩm đã xóa khi chạy backfill (không còn tra được)
+DELETED_SKU = ""
+
+
+def product_snapshot(product: Product) -> dict:
+    """
+    Thông tin sản phẩm chép vào phiếu lúc ghi (SKU, thương hiệu, danh mục, đơn giá)
+    """
+    category = product.category
+    return {
+        "sku": product.sku,
+        "brand": product.brand,
+        "category": category.value if hasattr(category, "value") else category,
+        "unitPrice": product.price,
+    }
+
+
+def seq_filter(product: Product):
+    """
+    Điều kiện "tồn kho chưa đổi kể từ lúc đọc" theo ledgerSeq (sản phẩm cũ chưa có trường này: model đọc ra 0)
+    """
+    return product.ledgerSeq if product.ledgerSeq else {"$in": [0, None]}
+
+
+async def _inc_stock(product_id: str, quantity: int, imei_count: int, guard: bool = False):
+    # guard=True: chỉ trừ khi còn đủ hàng (điều kiện nằm trong cùng lệnh update -> không bán âm)
+    query = {"_id": PydanticObjectId(product_id)}
+    if guard:
+        query["quantity"] = {"$gte": -quantity}
+    return await Product.find_one(query).update(
+        {"$inc": {"quantity": quantity, "imeiCount": imei_count, "ledgerSeq": 1}, "$set": {"lastUpdated": datetime.now()}},
+        response_type=UpdateResponse.NEW_DOCUMENT,
+    )
+
+
+UNDO_ATTEMPTS = 3
+UNDO_RETRY_DELAY = 0.2
+
+
+async def _revert_one(pid: str, quantity: int, imei_count: int) -> Product:
+    # Trừ lại phần đã nhập có điều kiện; không đủ hàng thì chờ các giao dịch đang chạy (có thể cũng đang hoàn tác)
+    for attempt in range(UNDO_ATTEMPTS):
+        reverted = await _inc_stock(pid, -quantity, -imei_count, guard=quantity > 0)
+        if reverted is not None:
+            return reverted
+        if attempt + 1 < UNDO_ATTEMPTS:
+            await asyncio.sleep(UNDO_RETRY_DELAY)
+    raise RuntimeError("không đủ hàng để trừ lại (đã bị giao dịch khác xuất)")
+
+
+async def _revert_stock(applied: Dict[str, Product], deltas: Dict[str, list]):
+    """
+    Hoàn tác các lệnh cập nhật tồn kho đã ghi của phiếu lỗi.
+    Cả lệnh đã ghi lẫn lệnh hoàn tác đều được ghi sổ kho (mỗi ledgerSeq có 1 dòng) và báo cho cost_service bỏ qua.
+    Không hoàn tác được thì ghi log để kiểm kê lại (tồn kho giữ nguyên, không bao giờ âm).
+    """
+    results = await asyncio.gather(*(
+        _revert_one(pid, *deltas[pid]) for pid in applied
+    ), return_exceptions=True)
+    changes = []
+    for (pid, product), reverted in zip(applied.items(), results):
+        changes.append((product, deltas[pid][0]))
+        await cost_service.skip(pid, product.ledgerSeq)
+        if isinstance(reverted, Product):
+            changes.append((reverted, -deltas[pid][0]))
+            await cost_service.skip(pid, reverted.ledgerSeq)
+        else:
+            print(f"❌ Không hoàn tác được tồn kho {product.name} ({pid}, {deltas[pid][0]:+d}): {reverted} -> cần kiểm kê lại")
+    await ledger_service.record_products(changes, ledger_service.SOURCE_ROLLBACK)
+
+
+async def apply_batch(transactions: List[Transaction]) -> Dict[str, Product]:
+    """
+    Ghi nhận cả phiếu nhiều dòng: tồn kho, IMEI rồi mới lưu các Transaction (insert_many).
+    Lỗi ở bất kỳ dòng nào -> không dòng nào được áp dụng.
+    Trả về các sản phẩm sau khi cập nhật (theo productId).
+    """
+    products, errors = await validate_batch(transactions)
+    if errors:
+        raise HTTPException(status_code=400, detail={"message": "Phiếu có dòng không hợp lệ", "errors": errors})
+
+    # Cấp _id trước để IMEI ghi nhận được phiếu nào đã thay đổi mình
+    for t in transactions:
+        t.id = t.id or PydanticObjectId()
+        for field, value in product_snapshot(products[t.productId]).items():
+            setattr(t, field, value)
+    trans_ids = [str(t.id) for t in transactions]
+
+    # Gộp thay đổi tồn kho theo sản phẩm
+    deltas = defaultdict(lambda: [0, 0])
+    for t in transactions:
+        sign = 1 if t.type == TransactionType.IMPORT else -1
+        deltas[t.productId][0] += sign * t.quantity
+        deltas[t.productId][1] += sign * len(t.imeis)
+
+    undo: List[Callable[[], Awaitable]] = []
+    try:
+        # 1. Tồn kho: mỗi sản phẩm 1 lệnh $inc có điều kiện, chạy song song
+        # return_exceptions: 1 lệnh lỗi (VD mất kết nối) vẫn phải hoàn tác các lệnh đã ghi
+        results = await asyncio.gather(*(
+            _inc_stock(pid, qty, count, guard=qty < 0) for pid, (qty, count) in deltas.items()
+        ), return_exceptions=True)
+        applied = {pid: p for pid, p in zip(deltas, results) if isinstance(p, Product)}
+        undo.append(lambda: _revert_stock(applied, deltas))
+        failed = [r for r in results if isinstance(r, BaseException)]
+        if failed:
+            raise failed[0]
+        if len(applied) != len(deltas):
+            raise HTTPException(status_code=400, detail="Lỗi: Không đủ hàng trong kho để xuất!")
+
+        # 2. IMEI: 1 bulk_write cho nhập, 1 bulk_write cho xuất
+        receive = [(t.imeis, applied[t.productId], str(t.id))
+                   for t in transactions if t.type == TransactionType.IMPORT and t.imeis]
+        if receive:
+            try:
+                upserted = await serial_service.receive_many(receive)
+            except BulkWriteError as e:
+                upserted = [u["_id"] for u in e.details.get("upserted", [])]
+                await serial_service.revert_receive(trans_ids, upserted)
+                raise HTTPException(status_code=409, detail="IMEI vừa được nhập bởi giao dịch khác, vui lòng thử lại")
+            undo.append(lambda: serial_service.revert_receive(trans_ids, upserted))
+
+        sell = [(t.imeis, t.productId, str(t.id))
+                for t in transactions if t.type == TransactionType.EXPORT and t.imeis]
+        if sell:
+            undo.append(lambda: serial_service.revert_sell(trans_ids))
+            sold = await serial_service.sell_many(sell)
+            if sold != sum(len(imeis) for imeis, _, _ in sell):
+                raise HTTPException(status_code=409, detail="IMEI vừa được xuất bởi giao dịch khác, vui lòng thử lại")
+
+        # 3. Lưu phiếu (bước cuối)
+        await Transaction.insert_many(transactions)
+    except Exception:
+        for step in reversed(undo):
+            try:
+                await step()
+            except Exception as e:
+                # Vẫn chạy các bước hoàn tác còn lại
+                print(f"❌ Lỗi khi hoàn tác phiếu: {e}")
+        raise
+
+    return applied
+
+
+async def apply_transaction(trans: Transaction) -> Product:
+    """
+    Ghi nhận 1 phiếu nhập/xuất (phiếu 1 dòng), trả về sản phẩm sau khi cập nhật
+    """
+    try:
+        products = await apply_batch([trans])
+    except HTTPException as e:
+        # Phiếu 1 dòng: trả lỗi dạng chuỗi như trước
+        if isinstance(e.detail, dict) and e.detail.get("errors"):
+            error = e.detail["errors"][0]
+            raise HTTPException(status_code=error["status"], detail=error["detail"])
+        raise
+    return products[trans.productId]
+
+
+async def backfill_product_snapshots() -> int:
+    """
+    Điền SKU / thương hiệu / danh mục / đơn giá cho các phiếu cũ chưa có (theo thông tin sản phẩm hiện tại).
+    Mỗi sản phẩm 1 lệnh update_many. Phiếu của sản phẩm đã xóa được đánh dấu sku = "" (DELETED_SKU)
+    để báo cáo không phải tra bảng sản phẩm cho các phiếu này.
+    """
+    ops = []
+    async for doc in Product.get_pymongo_collection().find({}, {"sku": 1, "brand": 1, "category": 1, "price": 1}):
+        product = Product.model_construct(sku=doc.get("sku"), brand=doc.get("brand"), category=doc.get("category"),
+                                          price=doc.get("price", 0.0))
+        ops.append(UpdateMany(
+            {"productId": str(doc["_id"]), "sku": None},
+            {"$set": product_snapshot(product)},
+        ))
+    collection = Transaction.get_pymongo_collection()
+    modified = (await collection.bulk_write(ops, ordered=False)).modified_count if ops else 0
+    # Còn sku = None sau bước trên = sản phẩm đã bị xóa
+    result = await collection.update_many({"sku": None}, {"$set": {"sku": DELETED_SKU}})
+    return modified + result.modified_count
+
+
+if __name__ == "__main__":
+    # Chạy: python stock_service.py  -> điền thông tin sản phẩm (SKU, thương hiệu, danh mục, đơn giá) cho phiếu cũ
+    from app import connect_database
+
+    async def main():
+        await connect_database()
+        updated = await backfill_product_snapshots()
+        print(f"✅ Đã điền thông tin sản phẩm cho {updated} phiếu")
+
+    asyncio.run(main())
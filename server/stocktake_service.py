@@ -0,0 +1,169 @@
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from beanie import PydanticObjectId, UpdateResponse
+from beanie.operators import In
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import UpdateOne
+
+import stock_service
+from models import Product, StocktakeItem, StocktakeSession, StocktakeStatus, Transaction, TransactionType
+
+MAX_ATTEMPTS = 5
+
+# Tính lại tổng chênh lệch ngay trong MongoDB (update pipeline), không cần đọc lại phiếu
+_TOTAL_DIFFERENCE = [{"$set": {"totalDifference": {"$sum": {
+    "$map": {"input": "$items", "in": {"$abs": "$$this.difference"}}
+}}}}]
+
+
+# Mỗi vòng ghi đóng 1 dấu riêng lên sản phẩm để biết lệnh nào đã ghi
+# (không dùng lastUpdated: giao dịch bán chạy song song cũng ghi đè trường này)
+MARK_FIELD = "stocktakeMark"
+
+
+def _session_id(session_id: str) -> PydanticObjectId:
+    try:
+        return PydanticObjectId(session_id)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=404, detail="Không tìm thấy phiếu kiểm kê")
+
+
+def _object_ids(product_ids) -> List[PydanticObjectId]:
+    oids = []
+    for pid in product_ids:
+        try:
+            oids.append(PydanticObjectId(pid))
+        except (InvalidId, TypeError):
+            pass
+    return oids
+
+
+async def patch_items(session_id: str, items: List[StocktakeItem], remove: List[str]) -> StocktakeSession:
+    """
+    Cập nhật từng phần phiếu nháp: thêm/sửa item theo productId, xóa item theo productId.
+    Không cần gửi lại toàn bộ items.
+    """
+    oid = _session_id(session_id)
+    session = await StocktakeSession.get(oid)
+    if not session:
+        raise HTTPException(status_code=404, detail="Không tìm thấy phiếu kiểm kê")
+    if session.status != StocktakeStatus.DRAFT:
+        raise HTTPException(status_code=400, detail="Phiếu kiểm kê đã hoàn tất, không thể sửa")
+
+    draft = {"_id": oid, "status": StocktakeStatus.DRAFT.value}
+    ops = []
+    for item in items:
+        data = item.model_dump()
+        # Có item của sản phẩm này -> sửa tại chỗ, chưa có -> thêm vào cuối (2 lệnh chạy tuần tự)
+        ops.append(UpdateOne({**draft, "items.productId": item.productId}, {"$set": {"items.$": data}}))
+        ops.append(UpdateOne({**draft, "items.productId": {"$ne": item.productId}}, {"$push": {"items": data}}))
+    if remove:
+        ops.append(UpdateOne(draft, {"$pull": {"items": {"productId": {"$in": remove}}}}))
+    ops.append(UpdateOne(draft, _TOTAL_DIFFERENCE))
+
+    await StocktakeSession.get_pymongo_collection().bulk_write(ops, ordered=True)
+    return await StocktakeSession.get(oid)
+
+
+async def _set_counts(counts: Dict[str, int]) -> Tuple[Dict[str, Tuple[Product, int]], List[str]]:
+    """
+    Ghi số lượng thực tế cho tất cả sản phẩm bằng 1 lệnh bulk_write mỗi vòng.
+    Mỗi lệnh chỉ ghi khi tồn kho chưa bị giao dịch khác đổi kể từ lúc đọc (optimistic),
+    sản phẩm bị đổi giữa chừng được đọc lại và thử lại ở vòng sau.
+    Trả về ({productId: (sản phẩm trước khi ghi, chênh lệch đã áp dụng)}, các productId chưa ghi được).
+    """
+    applied = {}
+    pending = dict(counts)
+    for _ in range(MAX_ATTEMPTS):
+        if not pending:
+            break
+        products = await Product.find(In(Product.id, _object_ids(pending))).to_list()
+        mark = str(ObjectId())
+        ops, planned = [], {}
+        for p in products:
+            pid = str(p.id)
+            delta = pending[pid] - p.quantity
+            if delta == 0:
+                applied[pid] = (p, 0)
+                continue
+            # Điều kiện cả ledgerSeq: sổ kho biết chắc thứ tự của lần ghi này (= ledgerSeq + 1)
+            ops.append(UpdateOne(
+                {"_id": p.id, "quantity": p.quantity, "ledgerSeq": stock_service.seq_filter(p)},
+                {"$set": {"quantity": pending[pid], "ledgerSeq": p.ledgerSeq + 1,
+                          "lastUpdated": datetime.now(), MARK_FIELD: mark}},
+            ))
+            planned[pid] = (p, delta)
+
+        # Sản phẩm đã bị xóa thì bỏ qua
+        pending = {pid: pending[pid] for pid in planned}
+        if not ops:
+            break
+
+        result = await Product.get_pymongo_collection().bulk_write(ops, ordered=False)
+        if result.modified_count == len(ops):
+            done = set(planned)
+        else:
+            # Xác định lệnh nào đã ghi qua dấu của vòng này
+            written = await Product.get_pymongo_collection().find(
+                {"_id": {"$in": _object_ids(planned)}, MARK_FIELD: mark}, {"_id": 1}
+            ).to_list()
+            done = {str(d["_id"]) for d in written}
+
+        for pid in done:
+            applied[pid] = planned[pid]
+            pending.pop(pid)
+
+    return applied, list(pending)
+
+
+async def complete_session(session: StocktakeSession) -> Tuple[List[Transaction], Dict[str, Product], List[str]]:
+    """
+    Hoàn tất kiểm kê: cập nhật tồn kho hàng loạt và ghi sổ chênh lệch thành phiếu điều chỉnh.
+    Trả về (các phiếu điều chỉnh, sản phẩm theo id, các productId chưa ghi được) để cập nhật thống kê.
+    Sản phẩm đã ghi luôn có phiếu điều chỉnh, kể cả khi còn sản phẩm chưa ghi được
+    (lần hoàn tất lại sẽ thấy chênh lệch 0 cho các sản phẩm này).
+    """
+    counts = {item.productId: item.actualQuantity for item in session.items}
+    applied, unapplied = await _set_counts(counts)
+
+    adjustments = [
+        Transaction(
+            productId=pid,
+            productName=product.name,
+            type=TransactionType.IMPORT if delta > 0 else TransactionType.EXPORT,
+            quantity=abs(delta),
+            partner="Kiểm kê",
+            notes=f"Điều chỉnh kiểm kê ({product.quantity} -> {product.quantity + delta})",
+            stocktakeId=str(session.id),
+            **stock_service.product_snapshot(product),
+        )
+        for pid, (product, delta) in applied.items()
+        if delta
+    ]
+    if adjustments:
+        await Transaction.insert_many(adjustments)
+
+    return adjustments, {pid: product for pid, (product, _) in applied.items()}, unapplied
+
+
+def ensure_applied(unapplied: List[str]):
+    if unapplied:
+        raise HTTPException(status_code=409, detail="Tồn kho đang thay đổi liên tục, vui lòng hoàn tất kiểm kê lại")
+
+
+async def complete_draft(session_id: str) -> StocktakeSession:
+    """
+    Chuyển phiếu nháp sang COMPLETED (nguyên tử, 1 phiếu chỉ hoàn tất được 1 lần)
+    """
+    session = await StocktakeSession.find_one(
+        {"_id": _session_id(session_id), "status": StocktakeStatus.DRAFT.value}
+    ).update(
+        {"$set": {"status": StocktakeStatus.COMPLETED.value, "date": datetime.now()}},
+        response_type=UpdateResponse.NEW_DOCUMENT,
+    )
+    if session is None:
+        raise HTTPException(status_code=400, detail="Không tìm thấy phiếu nháp để hoàn tất")
+    return session
@@ -0,0 +1,234 @@
+import bisect
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import BaseModel
+
+from models import (
+    MovementLog, Product, SerialUnit, StocktakeSession, StocktakeStatus, Transaction, TransactionType, WarrantyStatus,
+    WarrantyTicket,
+)
+
+# Truy vết vòng đời IMEI: nhập kho -> di chuyển -> kiểm kê -> xuất bán -> bảo hành -> trả máy / nhập lại.
+# Dùng cho 1 IMEI hay hàng nghìn IMEI (thu hồi sản phẩm) đều chỉ 2 lần aggregate, mỗi nhánh đi theo index:
+# 1. serial_units ∪ transactions ∪ warranty_tickets theo IMEI ($unionWith)
+#    -> trạng thái hiện tại, sản phẩm, các lần nhập/xuất -> khoảng thời gian máy nằm trong kho
+# 2. movement_logs ∪ stocktakes ∪ products theo (productId, khoảng thời gian trong kho)
+#    -> di chuyển / kiểm kê chỉ được tính cho máy đang ở trong kho lúc đó (MovementLog ghi theo sản phẩm)
+
+TRACE_BULK_LIMIT = int(os.getenv("TRACE_BULK_LIMIT", "10000"))
+
+_FAR_FUTURE = datetime(9999, 1, 1)
+
+
+class TraceEvent(BaseModel):
+    date: datetime
+    type: str  # TRANSACTION | MOVEMENT | STOCKTAKE | WARRANTY
+    sub_type: str
+    title: str
+    description: str
+    ref_id: str
+    productId: Optional[str] = None
+
+
+class SerialTrace(BaseModel):
+    imei: str
+    productId: Optional[str] = None
+    productName: Optional[str] = None
+    sku: Optional[str] = None
+    status: Optional[str] = None  # Trạng thái hiện tại trong serial_units (None = không còn bản ghi)
+    location: Optional[str] = None
+    events: List[TraceEvent] = []
+
+
+def _serial_pipeline(imeis: List[str]) -> list:
+    return [
+        {"$match": {"imei": {"$in": imeis}}},
+        {"$project": {"_id": 0, "kind": "unit", "imei": 1, "productId": 1, "status": 1, "location": 1}},
+        {"$unionWith": {"coll": Transaction.get_settings().name, "pipeline": [
+            {"$match": {"imeis": {"$in": imeis}}},
+            {"$project": {"kind": "transaction", "imeis": 1, "type": 1, "date": 1, "productId": 1,
+                          "productName": 1, "partner": 1, "notes": 1}},
+        ]}},
+        {"$unionWith": {"coll": WarrantyTicket.get_settings().name, "pipeline": [
+            {"$match": {"imei": {"$in": imeis}}},
+            {"$project": {"kind": "warranty", "imei": 1, "ticket_code": 1, "status": 1, "received_date": 1,
+                          "returned_date": 1, "customer_name": 1, "issue_description": 1}},
+        ]}},
+    ]
+
+
+def _product_pipeline(ranges: Dict[str, List[Tuple[datetime, datetime]]]) -> list:
+    # Mỗi sản phẩm: các khoảng thời gian (đã gộp) có ít nhất 1 máy cần truy vết nằm trong kho
+    def match(field: str) -> dict:
+        clauses = [{field: pid, "date": {"$gte": start, "$lt": end}} for pid, spans in ranges.items() for start, end in spans]
+        # $or không được rỗng: không có khoảng nào thì không khớp bản ghi nào
+        return {"$or": clauses} if clauses else {"_id": {"$exists": False}}
+
+    oids = []
+    for pid in ranges:
+        try:
+            oids.append(ObjectId(pid))
+        except (InvalidId, TypeError):
+            pass
+    return [
+        {"$match": match("productId")},
+        {"$project": {"kind": "movement", "productId": 1, "date": 1, "fromLocation": 1, "toLocation": 1}},
+        {"$unionWith": {"coll": StocktakeSession.get_settings().name, "pipeline": [
+            {"$match": {**match("items.productId"), "status": StocktakeStatus.COMPLETED.value}},
+            {"$project": {"kind": "stocktake", "date": 1, "items": {"$filter": {
+                "input": "$items", "cond": {"$in": ["$$this.productId", list(ranges)]},
+            }}}},
+        ]}},
+        {"$unionWith": {"coll": Product.get_settings().name, "pipeline": [
+            {"$match": {"_id": {"$in": oids}}},
+            {"$project": {"kind": "product", "name": 1, "sku": 1}},
+        ]}},
+    ]
+
+
+def _merge(spans: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+async def trace_many(imeis: List[str]) -> List[SerialTrace]:
+    """
+    Vòng đời của nhiều IMEI (giữ thứ tự đầu vào, bỏ trùng). Sự kiện mới nhất lên đầu.
+    """
+    imeis = list(dict.fromkeys(i.strip() for i in imeis if i and i.strip()))
+    if not imeis:
+        return []
+    wanted = set(imeis)
+    traces = {imei: SerialTrace(imei=imei) for imei in imeis}
+    # (date, type, productId) các lần nhập/xuất của từng IMEI để dựng khoảng thời gian trong kho
+    moves_in_out: Dict[str, List[Tuple[datetime, TransactionType, str]]] = defaultdict(list)
+
+    cursor = await SerialUnit.get_pymongo_collection().aggregate(_serial_pipeline(imeis))
+    async for doc in cursor:
+        kind = doc["kind"]
+        if kind == "unit":
+            trace = traces[doc["imei"]]
+            trace.productId, trace.status, trace.location = doc.get("productId"), doc.get("status"), doc.get("location")
+        elif kind == "transaction":
+            trans_type = TransactionType(doc["type"])
+            for imei in wanted.intersection(doc.get("imeis", [])):
+                moves_in_out[imei].append((doc["date"], trans_type, doc["productId"]))
+                traces[imei].events.append(TraceEvent(
+                    date=doc["date"], type="TRANSACTION", sub_type=trans_type.value,
+                    title="Giao dịch: Nhập Kho" if trans_type == TransactionType.IMPORT else "Giao dịch: Xuất Kho",
+                    description=f"Sản phẩm: {doc.get('productName')}. Đối tác: {doc.get('partner') or 'Không rõ'}",
+                    ref_id=str(doc["_id"]), productId=doc["productId"],
+                ))
+                traces[imei].productName = traces[imei].productName or doc.get("productName")
+        elif kind == "warranty":
+            events = traces[doc["imei"]].events
+            events.append(TraceEvent(
+                date=doc["received_date"], type="WARRANTY", sub_type=doc.get("status", ""),
+                title="Tiếp nhận Bảo hành / Sửa chữa",
+                description=f"Khách: {doc.get('customer_name')}. Lỗi: {doc.get('issue_description')}",
+                ref_id=str(doc["_id"]),
+            ))
+            if doc.get("returned_date"):
+                events.append(TraceEvent(
+                    date=doc["returned_date"], type="WARRANTY", sub_type=WarrantyStatus.RETURNED.value,
+                    title="Trả máy bảo hành cho khách", description=f"Phiếu {doc.get('ticket_code') or doc['_id']}",
+                    ref_id=str(doc["_id"]),
+                ))
+
+    # Khoảng thời gian máy nằm trong kho theo từng sản phẩm: [nhập, xuất)
+    stays: Dict[str, List[Tuple[str, datetime, datetime]]] = defaultdict(list)
+    for imei, trace in traces.items():
+        opened: Optional[Tuple[datetime, str]] = None
+        returned = False
+        for date, trans_type, product_id in sorted(moves_in_out[imei], key=lambda m: m[0]):
+            if trans_type == TransactionType.IMPORT:
+                opened = (date, product_id)
+                if returned:
+                    _retitle(trace, date, "Giao dịch: Nhập lại kho (khách trả / thu hồi)")
+            elif opened:
+                stays[imei].append((opened[1], opened[0], date))
+                opened, returned = None, True
+            else:
+                # Xuất nhưng không có phiếu nhập (IMEI nhập qua form sản phẩm): tính từ đầu
+                stays[imei].append((product_id, datetime.min, date))
+                returned = True
+        if opened:
+            stays[imei].append((opened[1], opened[0], _FAR_FUTURE))
+        elif not moves_in_out[imei] and trace.productId and trace.status == "IN_STOCK":
+            stays[imei].append((trace.productId, datetime.min, _FAR_FUTURE))
+        if trace.productId is None and stays[imei]:
+            trace.productId = stays[imei][-1][0]
+
+    ranges: Dict[str, List[Tuple[datetime, datetime]]] = defaultdict(list)
+    for spans in stays.values():
+        for product_id, start, end in spans:
+            ranges[product_id].append((start, end))
+    ranges = {pid: _merge(spans) for pid, spans in ranges.items()}
+    for trace in traces.values():
+        if trace.productId and trace.productId not in ranges:
+            ranges[trace.productId] = []
+
+    product_events: Dict[str, List[Tuple[datetime, TraceEvent]]] = defaultdict(list)
+    products: Dict[str, dict] = {}
+    if ranges:
+        cursor = await MovementLog.get_pymongo_collection().aggregate(_product_pipeline(ranges))
+        async for doc in cursor:
+            kind = doc["kind"]
+            if kind == "product":
+                products[str(doc["_id"])] = doc
+            elif kind == "movement":
+                product_events[doc["productId"]].append((doc["date"], TraceEvent(
+                    date=doc["date"], type="MOVEMENT", sub_type="MOVE", title="Di chuyển vị trí",
+                    description=f"Từ {doc.get('fromLocation')} -> {doc.get('toLocation')}",
+                    ref_id=str(doc["_id"]), productId=doc["productId"],
+                )))
+            elif kind == "stocktake":
+                for item in doc.get("items", []):
+                    product_events[item["productId"]].append((doc["date"], TraceEvent(
+                        date=doc["date"], type="STOCKTAKE", sub_type="COUNT", title="Kiểm kê",
+                        description=f"Sản phẩm: {item.get('productName')}. Hệ thống {item.get('systemQuantity')}, "
+                                    f"thực tế {item.get('actualQuantity')} (lệch {item.get('difference')})",
+                        ref_id=str(doc["_id"]), productId=item["productId"],
+                    )))
+
+    for trace in traces.values():
+        product = products.get(trace.productId)
+        if product:
+            trace.productName, trace.sku = product.get("name"), product.get("sku")
+
+    # Gắn di chuyển / kiểm kê vào các máy đang nằm trong kho lúc đó
+    dates: Dict[str, List[datetime]] = {}
+    for product_id, events in product_events.items():
+        events.sort(key=lambda e: e[0])
+        dates[product_id] = [e[0] for e in events]
+    for imei, spans in stays.items():
+        for product_id, start, end in spans:
+            events = product_events.get(product_id)
+            if not events:
+                continue
+            lo, hi = bisect.bisect_left(dates[product_id], start), bisect.bisect_left(dates[product_id], end)
+            traces[imei].events.extend(e[1] for e in events[lo:hi])
+
+    for trace in traces.values():
+        trace.events.sort(key=lambda e: e.date, reverse=True)
+    return [traces[imei] for imei in imeis]
+
+
+def _retitle(trace: SerialTrace, date: datetime, title: str):
+    for event in trace.events:
+        if event.date == date and event.sub_type == TransactionType.IMPORT.value:
+            event.title = title
+
+
+async def trace(imei: str) -> SerialTrace:
+    return (await trace_many([imei]))[0]